@@ -0,0 +1,61 @@
+#Config preprocessing and parsing of synthetic configs with an increasing number of bindings
+from pathlib import Path
+import tempfile
+from common import measure, result
+import gin
+from ginpipe.config import compile_config, load_compiled_config
+from ginpipe.core import gin_parse_with_flags, new_state
+
+@gin.configurable
+def bench_fn(a=None, b=None, c=None, lst=None):
+    return a
+
+def macro_name(i):
+    #Macros in operations can only have uppercase letters and underscores
+    name = ''
+    while True:
+        name = chr(ord('A') + i % 26) + name
+        i = i//26
+        if i == 0:
+            return 'N_' + name
+
+def synthetic_config(n_bindings):
+    #Plain bindings, macros, operations, scopes, appends and initial state keys, in similar proportions as real configs
+    lines = []
+    for i in range(n_bindings//10):
+        lines.append('{}={}'.format(macro_name(i), i))
+        lines.append('bench_fn.a = $(%{}*2)'.format(macro_name(i)))
+        lines.append('scope_{}/bench_fn:'.format(i))
+        lines.append('    b = {}'.format(i))
+        lines.append('    c = "value_{}"'.format(i))
+        lines.append('    lst = [{}, {}]'.format(i, i + 1))
+        lines.append('scope_{}/bench_fn.lst += [{}]'.format(i, i + 2))
+        lines.append('bench_fn.b = %{}'.format(macro_name(i)))
+        lines.append('$init_{}={}'.format(i, i))
+        lines.append('')
+    return '\n'.join(lines)
+
+def run(quick=False):
+    sizes = [100, 1000] if quick else [100, 1000, 5000]
+    repeats = 3 if quick else 5
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n in sizes:
+            config_path = Path(tmp_dir, 'config_{}.gin'.format(n))
+            with open(config_path, 'w') as f:
+                f.write(synthetic_config(n))
+
+            def flags(**kwargs):
+                return dict({'config_path': [str(config_path)], 'mods': [], 'experiment_name': 'bench', 'project_name': 'bench'}, **kwargs)
+            stats = measure(lambda f: compile_config(f), repeats, setup=lambda: (flags(),))
+            results.append(result('config.compile', {'n_bindings': n}, stats))
+            stats = measure(lambda f: load_compiled_config(f), repeats, setup=lambda: (flags(),))
+            results.append(result('config.compile_cached', {'n_bindings': n}, stats))
+
+            def parse(f):
+                gin.clear_config()
+                gin_parse_with_flags(new_state(f), f)
+            stats = measure(parse, repeats, setup=lambda: (flags(config_cache=False),))
+            results.append(result('config.gin_parse_with_flags', {'n_bindings': n}, stats))
+    gin.clear_config()
+    return results
@@ -0,0 +1,48 @@
+#Import and gin registration of synthetic module lists
+from pathlib import Path
+import sys
+import tempfile
+from common import measure, result
+from ginpipe.core import gin_configure_externals
+from ginpipe.environment import save_module_symbols
+
+_run_id = 0
+
+def synthetic_modules(root, n_modules, n_functions):
+    #Every call creates new module names, as gin doesn't allow registering the same name twice
+    global _run_id
+    _run_id += 1
+    lines = []
+    for m in range(n_modules):
+        name = 'benchmod_{}_{}'.format(_run_id, m)
+        with open(Path(root, name + '.py'), 'w') as f:
+            for i in range(n_functions):
+                f.write('def fn_{}_{}(state, x={}):\n    return state\n\n'.format(m, i, i))
+        lines.append('{}: {}'.format(name, name))
+    module_list = Path(root, 'modules_{}'.format(_run_id))
+    with open(module_list, 'w') as f:
+        f.write('\n'.join(lines))
+    return str(module_list)
+
+def run(quick=False):
+    sizes = [(5, 10), (20, 50)] if quick else [(5, 10), (20, 50), (50, 100)]
+    repeats = 3 if quick else 5
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sys.path.insert(0, tmp_dir)
+        for n_modules, n_functions in sizes:
+            params = {'n_modules': n_modules, 'n_functions': n_functions}
+            stats = measure(lambda f: gin_configure_externals(f), repeats,
+                            setup=lambda: ({'module_list': [synthetic_modules(tmp_dir, n_modules, n_functions)], 'eager_externals': True},))
+            results.append(result('externals.eager', params, stats))
+            #Config referencing a single module: the rest are skipped, as their symbols are known from previous runs
+            def lazy_flags():
+                module_list = synthetic_modules(tmp_dir, n_modules, n_functions)
+                names = [l.split(':')[0] for l in open(module_list).read().splitlines()]
+                for m, name in enumerate(names):
+                    save_module_symbols(name, ['fn_{}_{}'.format(m, i) for i in range(n_functions)])
+                return ({'module_list': [module_list], 'config_str': ['{}.fn_0_0.x = 1'.format(names[0])], 'mods': []},)
+            stats = measure(lambda f: gin_configure_externals(f), repeats, setup=lazy_flags)
+            results.append(result('externals.lazy', params, stats))
+        sys.path.remove(tmp_dir)
+    return results
@@ -0,0 +1,74 @@
+#Per task overhead of execute_pipeline: tasks do almost nothing, so the time is ginpipe's own bookkeeping
+#(fingerprints, manifest, saving) and dispatch.
+#pipeline.per_task_growth compares the per task time of a long and a short pipeline. Saving anything that grows
+#with the number of tasks after every task makes it grow linearly, run_all.py fails when it exceeds max_growth.
+from pathlib import Path
+import shutil
+import tempfile
+from common import measure, result
+from ginpipe.core import new_state, execute_pipeline
+
+def synthetic_tasks(n_tasks):
+    tasks = []
+    for i in range(n_tasks):
+        def task(state, i=i):
+            #Each task reads the output of the previous one
+            state['out_{}'.format(i)] = state['out_{}'.format(i - 1)] + 1 if i > 0 else 0
+            return state
+        task.__name__ = 'task_{}'.format(i)
+        tasks.append(task)
+    return tasks
+
+MAX_GROWTH = 2.0
+
+def run_tasks(output_dir, tasks, execution_order='sequential', repeats=3):
+    def fresh_state():
+        shutil.rmtree(output_dir, ignore_errors=True)
+        state = new_state({})
+        state.output_dir = str(output_dir)
+        return (state,)
+    return measure(lambda s: execute_pipeline(s, tasks=tasks, execution_order=execution_order, is_main=True), repeats, setup=fresh_state)
+
+def run_growth(output_dir, quick=False):
+    short, long = (30, 300) if quick else (50, 1000)
+    results = []
+    for execution_order in ['sequential', 'dag']:
+        per_task = {}
+        for n_tasks in [short, long]:
+            stats = run_tasks(output_dir, synthetic_tasks(n_tasks), execution_order)
+            per_task[n_tasks] = stats['min_s']/n_tasks
+        growth = per_task[long]/per_task[short]
+        results.append(result('pipeline.per_task_growth', {'n_tasks': [short, long], 'execution_order': execution_order}, stats,
+                              per_task_s=per_task, growth=growth, max_growth=MAX_GROWTH))
+    return results
+
+def run(quick=False):
+    sizes = [10, 100] if quick else [10, 100, 500]
+    repeats = 3 if quick else 5
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_dir = Path(tmp_dir, 'experiment')
+        for n_tasks in sizes:
+            tasks = synthetic_tasks(n_tasks)
+
+            def fresh_state():
+                shutil.rmtree(output_dir, ignore_errors=True)
+                state = new_state({})
+                state.output_dir = str(output_dir)
+                return (state,)
+            for execution_order in ['sequential', 'dag']:
+                params = {'n_tasks': n_tasks, 'execution_order': execution_order}
+                stats = measure(lambda s: execute_pipeline(s, tasks=tasks, execution_order=execution_order, is_main=True), repeats, setup=fresh_state)
+                results.append(result('pipeline.run', params, stats, per_task_s=stats['median_s']/n_tasks))
+
+            #Everything is done already: time to load the manifest and skip all tasks
+            def completed_state():
+                state, = fresh_state()
+                execute_pipeline(state, tasks=tasks, is_main=True)
+                state = new_state({})
+                state.output_dir = str(output_dir)
+                return (state,)
+            stats = measure(lambda s: execute_pipeline(s, tasks=tasks, is_main=True), repeats, setup=completed_state)
+            results.append(result('pipeline.resume_completed', {'n_tasks': n_tasks}, stats))
+        results.extend(run_growth(output_dir, quick))
+    return results
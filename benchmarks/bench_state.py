@@ -0,0 +1,57 @@
+#State.save and resume loading for synthetic states with an increasing number of keys and payload size
+from pathlib import Path
+import shutil
+import tempfile
+from common import measure, result
+from ginpipe.core import new_state
+from ginpipe.storage import list_saved_keys
+
+def synthetic_state(n_keys, payload_bytes):
+    state = new_state({})
+    for i in range(n_keys):
+        state['key_{}'.format(i)] = {'id': i, 'payload': bytes(payload_bytes), 'values': list(range(payload_bytes//64))}
+    return state
+
+def mark_all_used(state):
+    state._used_keys.update([k for k in state.keys() if k != 'flags'])
+
+def run(quick=False):
+    sizes = [(10, 1000), (100, 1000), (10, 1000000)] if quick else [(10, 1000), (100, 1000), (1000, 1000), (10, 1000000), (10, 10000000)]
+    repeats = 3 if quick else 5
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_keys, payload_bytes in sizes:
+            params = {'n_keys': n_keys, 'payload_bytes': payload_bytes}
+            state_path = Path(tmp_dir, 'state')
+
+            def cold_setup():
+                shutil.rmtree(state_path, ignore_errors=True)
+                state_path.mkdir()
+                state = synthetic_state(n_keys, payload_bytes)
+                state._saved_fingerprints.clear()
+                mark_all_used(state)
+                return (state,)
+            stats = measure(lambda s: s.save(state_path), repeats, setup=cold_setup)
+            results.append(result('state.save_cold', params, stats))
+
+            #Nothing changed since the last save: every key is hashed and skipped
+            def unchanged_setup():
+                state, = cold_setup()
+                state.save(state_path)
+                mark_all_used(state)
+                return (state,)
+            stats = measure(lambda s: s.save(state_path), repeats, setup=unchanged_setup)
+            results.append(result('state.save_unchanged', params, stats))
+
+            def resume(load_values):
+                state = new_state({})
+                for k, handle in list_saved_keys(state_path, state._storage_backends).items():
+                    state.register_lazy(k, handle)
+                if load_values:
+                    for k in list(state.keys()):
+                        state[k]
+            stats = measure(lambda: resume(False), repeats)
+            results.append(result('state.resume_index', params, stats))
+            stats = measure(lambda: resume(True), repeats)
+            results.append(result('state.resume_load_all', params, stats))
+    return results
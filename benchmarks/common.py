@@ -0,0 +1,30 @@
+#Helpers shared by the benchmarks. They import ginpipe from the src folder of this checkout.
+#Caches go to a temporary directory, so results don't depend on previous runs.
+import atexit
+import os
+from pathlib import Path
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+SRC_PATH = str(Path(__file__).resolve().parent.parent / 'src')
+if SRC_PATH not in sys.path:
+    sys.path.insert(0, SRC_PATH)
+CACHE_DIR = tempfile.mkdtemp(prefix='ginpipe_bench_')
+os.environ['GINPIPE_CACHE_DIR'] = CACHE_DIR
+atexit.register(shutil.rmtree, CACHE_DIR, ignore_errors=True)
+
+def measure(fn, repeats=5, setup=None):
+    #Runs setup (untimed) and fn repeats times, returns timing stats in seconds
+    times = []
+    for _ in range(repeats):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return {'min_s': min(times), 'median_s': statistics.median(times), 'repeats': repeats}
+
+def result(benchmark, params, stats, **extra):
+    return dict({'benchmark': benchmark, 'params': params}, **stats, **extra)
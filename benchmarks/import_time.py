@@ -0,0 +1,68 @@
+#Import time regression check for ginpipe.
+#Runs `python -X importtime -c "import ginpipe.core"` in fresh interpreters and fails if the import takes longer
+#than the budget or pulls in any of the heavy dependencies that should only be imported on first use.
+#   python benchmarks/import_time.py --budget_ms 400
+import argparse
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+HEAVY_MODULES = ['sympy', 'joblib', 'numpy', 'torch', 'diff_match_patch', 'termcolor']
+
+def measure_import(module='ginpipe.core'):
+    env = dict(os.environ)
+    src_path = str(Path(__file__).resolve().parent.parent / 'src')
+    env['PYTHONPATH'] = src_path + os.pathsep + env.get('PYTHONPATH', '')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                            capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise Exception('Importing {} failed:\n{}'.format(module, result.stderr))
+    cumulative_us = {}
+    for l in result.stderr.splitlines():
+        if not l.startswith('import time:') or ('|' not in l):
+            continue
+        _, cumulative, name = l.split('|')
+        try:
+            cumulative_us[name.strip()] = int(cumulative.strip())
+        except ValueError:
+            pass
+    return cumulative_us
+
+def run_import_benchmark(module='ginpipe.core', repeats=5):
+    times = []
+    imported_heavy = set()
+    for _ in range(repeats):
+        cumulative_us = measure_import(module)
+        times.append(cumulative_us[module]/1000)
+        imported_heavy.update([m for m in HEAVY_MODULES if m in cumulative_us])
+    return {'module': module,
+            'import_ms_min': min(times),
+            'import_ms_median': sorted(times)[len(times)//2],
+            'heavy_modules_imported': sorted(imported_heavy)}
+
+def main():
+    argparser = argparse.ArgumentParser(description='Check the import time of ginpipe')
+    argparser.add_argument('--budget_ms', type=float, default=400, help='Maximum allowed import time (min over repeats)')
+    argparser.add_argument('--repeats', type=int, default=5)
+    argparser.add_argument('--output', type=str, default=None, help='Path to write the results as JSON')
+    flags = argparser.parse_args()
+
+    results = run_import_benchmark(repeats=flags.repeats)
+    results['budget_ms'] = flags.budget_ms
+    print(json.dumps(results, indent=2))
+    if flags.output is not None:
+        with open(flags.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    failed = False
+    if len(results['heavy_modules_imported']) > 0:
+        print('Heavy modules imported at import time: {}'.format(', '.join(results['heavy_modules_imported'])))
+        failed = True
+    if results['import_ms_min'] > flags.budget_ms:
+        print('Import time {:.1f}ms is over the budget of {:.1f}ms'.format(results['import_ms_min'], flags.budget_ms))
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
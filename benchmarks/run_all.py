@@ -0,0 +1,105 @@
+#Benchmarks of ginpipe's own overhead. Runs offline with synthetic configs, modules, states and pipelines:
+#   python benchmarks/run_all.py --output results.json
+#   python benchmarks/run_all.py --quick --compare results.json
+#With --compare, exits with 1 if any benchmark got slower than the baseline by more than --threshold.
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import common
+import bench_config
+import bench_externals
+import bench_state
+import bench_pipeline
+import import_time
+from loguru import logger
+
+#Task logs would dominate the output
+logger.disable('ginpipe')
+
+SUITES = {
+    'config': bench_config.run,
+    'externals': bench_externals.run,
+    'state': bench_state.run,
+    'pipeline': bench_pipeline.run,
+}
+
+def run_imports(quick=False):
+    r = import_time.run_import_benchmark(repeats=3 if quick else 5)
+    return [{'benchmark': 'import.ginpipe_core', 'params': {}, 'min_s': r['import_ms_min']/1000,
+             'median_s': r['import_ms_median']/1000, 'heavy_modules_imported': r['heavy_modules_imported']}]
+
+SUITES['import'] = run_imports
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        return None
+
+def result_key(r):
+    return '{} {}'.format(r['benchmark'], json.dumps(r['params'], sort_keys=True))
+
+def compare(results, baseline, threshold):
+    #Compares the min over repeats, which is the least noisy statistic
+    baseline = {result_key(r): r for r in baseline['results']}
+    regressions = []
+    lines = ['{:<70}{:>12}{:>12}{:>8}'.format('benchmark', 'baseline', 'current', 'ratio')]
+    for r in results:
+        b = baseline.get(result_key(r))
+        if b is None:
+            continue
+        ratio = r['min_s']/max(b['min_s'], 1e-9)
+        lines.append('{:<70}{:>12.5f}{:>12.5f}{:>8.2f}'.format(result_key(r)[:69], b['min_s'], r['min_s'], ratio))
+        if ratio > threshold:
+            regressions.append(result_key(r))
+    print('\n'.join(lines))
+    return regressions
+
+def main():
+    argparser = argparse.ArgumentParser(description='Benchmark ginpipe overhead')
+    argparser.add_argument('--suites', nargs='+', default=list(SUITES.keys()), choices=list(SUITES.keys()))
+    argparser.add_argument('--quick', action='store_true', help='Smaller sizes and fewer repeats')
+    argparser.add_argument('--output', type=str, default=None, help='Path to write the results as JSON')
+    argparser.add_argument('--compare', type=str, default=None, help='Results of a previous run to compare against')
+    argparser.add_argument('--threshold', type=float, default=1.25, help='Slowdown ratio considered a regression')
+    flags = argparser.parse_args()
+
+    results = []
+    for suite in flags.suites:
+        print('Running {} benchmarks'.format(suite), file=sys.stderr)
+        results.extend(SUITES[suite](quick=flags.quick))
+    report = {'date': datetime.datetime.now().isoformat(),
+              'commit': git_commit(),
+              'python': sys.version,
+              'platform': platform.platform(),
+              'cpu_count': os.cpu_count(),
+              'quick': flags.quick,
+              'results': results}
+    for r in results:
+        print('{:<70}{:>12.5f}'.format(result_key(r)[:69], r['min_s']))
+    if flags.output is not None:
+        with open(flags.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    #Benchmarks of how a cost scales fail on their own, without a baseline
+    too_steep = [r for r in results if r.get('growth', 0) > r.get('max_growth', float('inf'))]
+    for r in too_steep:
+        print('{} grows {:.2f}x, more than {}x'.format(result_key(r), r['growth'], r['max_growth']))
+    if flags.compare is not None:
+        with open(flags.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, flags.threshold)
+        if len(regressions) > 0:
+            print('Regressions over {}x:\n{}'.format(flags.threshold, '\n'.join(regressions)))
+            sys.exit(1)
+    if len(too_steep) > 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
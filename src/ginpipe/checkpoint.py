@@ -0,0 +1,74 @@
+import copy
+import queue
+import threading
+from loguru import logger
+
+def snapshot(v):
+    #Tasks usually grow dicts and lists in place (e.g. execution_times), so the writer gets its own shallow copy.
+    #Other values are handed over as they are: reassigning a key is safe, modifying an array in place is not.
+    if isinstance(v, (dict, list, set)):
+        return copy.copy(v)
+    return v
+
+class AsyncWriter:
+    #Single background thread that runs save jobs in submission order. Jobs for the same key are versioned,
+    #so a write is skipped if a newer one was already submitted for that key.
+    #Jobs without a key (manifest and fingerprint appends) describe the writes submitted before them, so those
+    #are never skipped: otherwise the manifest could list an output that is not on disk yet. For the same reason,
+    #once a job fails every later job without a key is dropped.
+    def __init__(self, max_queue_size=8):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.versions = {}
+        #Latest version of each key when the last job without a key was submitted
+        self.barrier = {}
+        self.lock = threading.Lock()
+        self.error = None
+        self.failed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            key, version, fn, args = self.queue.get()
+            try:
+                if fn is None:
+                    return
+                with self.lock:
+                    superseded = (key is not None) and (self.versions[key] != version) and (version > self.barrier.get(key, 0))
+                if self.failed and (key is None):
+                    logger.warning('Dropping {} after a failed checkpoint'.format(getattr(fn, '__name__', fn)))
+                elif not superseded:
+                    fn(*args)
+            except Exception as e:
+                logger.error('Background checkpoint failed: {}'.format(e))
+                self.error = e
+                self.failed = True
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, fn, *args, key=None):
+        #Blocks if the queue is full, so a slow disk throttles the pipeline instead of piling up snapshots.
+        self._raise_error()
+        version = None
+        with self.lock:
+            if key is not None:
+                version = self.versions[key] = self.versions.get(key, 0) + 1
+            else:
+                self.barrier = dict(self.versions)
+        self.queue.put((key, version, fn, args))
+
+    def flush(self):
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        #The thread is stopped before raising the error of a failed job
+        self.queue.join()
+        self.queue.put((None, None, None, ()))
+        self.thread.join()
+        self._raise_error()
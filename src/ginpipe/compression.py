@@ -0,0 +1,137 @@
+from pathlib import Path
+import tempfile
+import time
+from loguru import logger
+
+#Codecs are given as 'name' or 'name:level', e.g. 'none', 'zlib:6', 'lz4', 'zstd:19'
+VALID_CODECS = ['none', 'zlib', 'lz4', 'zstd']
+BENCHMARK_CODECS = ['none', 'zlib:1', 'zlib:6', 'lz4', 'zstd:3', 'zstd:9']
+
+def _register_zstd(joblib):
+    from joblib.compressor import CompressorWrapper, register_compressor
+    try:
+        import zstandard
+    except ImportError:
+        zstandard = None
+
+    class ZstdCompressorWrapper(CompressorWrapper):
+        #Registered in joblib, so joblib.load detects zstd compressed files by their magic number
+        prefix = b'\x28\xb5\x2f\xfd'
+        extension = '.zst'
+
+        def __init__(self):
+            self.fileobj_factory = None
+
+        def _check_versions(self):
+            if zstandard is None:
+                raise ValueError('zstd codec requires the zstandard package: pip install zstandard')
+
+        def compressor_file(self, fileobj, compresslevel=None):
+            self._check_versions()
+            if isinstance(fileobj, (str, Path)):
+                fileobj = open(fileobj, 'wb')
+            return zstandard.ZstdCompressor(level=3 if compresslevel is None else compresslevel).stream_writer(fileobj)
+
+        def decompressor_file(self, fileobj):
+            self._check_versions()
+            return zstandard.ZstdDecompressor().stream_reader(fileobj)
+
+    register_compressor('zstd', ZstdCompressorWrapper(), force=True)
+
+_zstd_registered = False
+
+def import_joblib():
+    #joblib (and numpy, which it imports) is slow to import, so it is imported the first time state is
+    #hashed, saved or loaded instead of when ginpipe is imported
+    global _zstd_registered
+    import joblib
+    if not _zstd_registered:
+        _register_zstd(joblib)
+        _zstd_registered = True
+    return joblib
+
+def parse_codec(codec):
+    if codec is None:
+        return 'none', None
+    name, _, level = str(codec).partition(':')
+    if name not in VALID_CODECS:
+        raise Exception('Codec not recognized: {}. The following values are allowed: {}'.format(name, VALID_CODECS))
+    return name, int(level) if level != '' else None
+
+def joblib_compress(codec):
+    #Translates a codec into the compress argument of joblib.dump
+    name, level = parse_codec(codec)
+    if name == 'none':
+        return 0
+    return (name, level if level is not None else 3)
+
+def compress_bytes(data, codec):
+    #For stores that write bytes instead of files (CheckpointLog). Same codecs and default levels as joblib_compress.
+    name, level = parse_codec(codec)
+    if name == 'none':
+        return data
+    elif name == 'zlib':
+        import zlib
+        return zlib.compress(data, 3 if level is None else level)
+    elif name == 'lz4':
+        return _import_codec('lz4.frame', 'lz4').compress(data, compression_level=3 if level is None else level)
+    else:
+        return _import_codec('zstandard', 'zstandard').ZstdCompressor(level=3 if level is None else level).compress(data)
+
+def decompress_bytes(data, codec):
+    name, _ = parse_codec(codec)
+    if name == 'none':
+        return data
+    elif name == 'zlib':
+        import zlib
+        return zlib.decompress(data)
+    elif name == 'lz4':
+        return _import_codec('lz4.frame', 'lz4').decompress(data)
+    else:
+        return _import_codec('zstandard', 'zstandard').ZstdDecompressor().decompress(data)
+
+def _import_codec(module, package):
+    import importlib
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise ValueError('{} codec requires the {} package: pip install {}'.format(package, package, package))
+
+def benchmark_codecs(state, codecs=None, keys=None):
+    #Compresses every key with each codec and reports compression ratio and throughput
+    joblib = import_joblib()
+    codecs = codecs if codecs is not None else BENCHMARK_CODECS
+    keys = keys if keys is not None else list(state.keys())
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for k in keys:
+            results[k] = {}
+            path = Path(tmp_dir, 'value.pkl')
+            try:
+                joblib.dump(state[k], path)
+                raw_size = path.stat().st_size
+            except Exception as e:
+                logger.warning('Could not benchmark {}: {}'.format(k, e))
+                continue
+            for codec in codecs:
+                try:
+                    wt = time.time()
+                    joblib.dump(state[k], path, compress=joblib_compress(codec))
+                    dump_time = time.time() - wt
+                    size = path.stat().st_size
+                    wt = time.time()
+                    joblib.load(path)
+                    load_time = time.time() - wt
+                except Exception as e:
+                    logger.warning('Could not benchmark {} with {}: {}'.format(k, codec, e))
+                    continue
+                results[k][codec] = {'size': size,
+                                     'ratio': raw_size/max(size, 1),
+                                     'dump_MBps': raw_size/max(dump_time, 1e-9)/1e6,
+                                     'load_MBps': raw_size/max(load_time, 1e-9)/1e6}
+    report = '\nCodec benchmark:\n{:<30}{:<10}{:>14}{:>10}{:>14}{:>14}\n'.format('key', 'codec', 'size', 'ratio', 'dump MB/s', 'load MB/s')
+    for k, rk in results.items():
+        for codec, r in rk.items():
+            report += '{:<30}{:<10}{:>14}{:>10.2f}{:>14.1f}{:>14.1f}\n'.format(k[:29], codec, r['size'], r['ratio'], r['dump_MBps'], r['load_MBps'])
+    logger.info(report)
+    return results
@@ -0,0 +1,297 @@
+#Preprocessing of ginpipe's extended gin syntax:
+#   !load_template: blocks, += appends to lists, $(...) operations, $key=value initial state keys
+#   and the EXPERIMENT_NAME, PROJECT_NAME and OUTPUT_DIR default macros.
+#The config is split in lines once and every step is a linear walk over them. It is not a single tokenizer pass:
+#operations can use macros defined after them, so macros are collected in a walk before operations are expanded.
+#The expanded config is cached on disk, keyed on the hash of the input configs (with templates already loaded)
+#and the flags it depends on. The least recently used entries are deleted beyond GINPIPE_CONFIG_CACHE_SIZE.
+import ast
+import datetime
+import hashlib
+import json
+import os
+from pathlib import Path
+import re
+from loguru import logger
+from .environment import CACHE_DIR, _read_cache, _write_cache
+from .operations import evaluate_operation
+
+#Bump when the preprocessing changes, to invalidate compiled configs
+PREPROCESSOR_VERSION = 3
+DEFAULT_MACROS = ['EXPERIMENT_NAME', 'PROJECT_NAME', 'OUTPUT_DIR']
+CONFIG_CACHE_SIZE = int(os.environ.get('GINPIPE_CONFIG_CACHE_SIZE', 256))
+OPERATION_PATTERN = re.compile(r'\$\((.*?)\)')
+MACRO_PATTERN = re.compile(r'%([A-Z_]+)')
+
+def load_template(block_data, config_path):
+    template_path = Path(Path(config_path).parent, block_data['template'][1:-1])
+    with open(template_path, 'r') as f:
+        template = f.read()
+    block_data.pop('template')
+    for k,v in block_data.items():
+        template = template.replace('{'+k+'}', v[1:-1])
+    return [template]
+
+def process_templates(config, config_path):
+    lines = config.split('\n')
+    block_start = None
+    block_data = {}
+    i=0
+    new_lines = []
+    while i < len(lines):
+        if lines[i].strip() == '!load_template:':
+            block_start = i
+        elif block_start is not None:
+            if len(lines[i].lstrip()) < len(lines[i]):
+                #This means we are in an indented block
+                data_i = lines[i].split('=')
+                block_data[data_i[0].strip()] = data_i[1].strip()
+            else:
+                #Out of block, so we have gathered all info regarding the template loading
+                new_data = load_template(block_data, config_path)
+                new_lines.extend(new_data)
+                block_start = None
+                block_data = {}
+        else:
+            new_lines.append(lines[i])
+        i+=1
+    if block_start is not None:
+        new_data = load_template(block_data, config_path)
+        new_lines.extend(new_data)
+
+    return '\n'.join(new_lines)
+
+def read_configs(flags):
+    if 'config_str' not in flags:
+        flags['config_str'] = []
+        for c in flags['config_path']:
+            with open(c,'r') as f:
+                config_i = f.read()
+            config_i = process_templates(config_i, c)
+            flags['config_str'].append(config_i)
+    return flags['config_str']
+
+def apply_mods(config, mods):
+    for m in mods:
+        config += m + '\n'
+    return config
+
+def n_indent(x):
+    return [xi == ' ' for xi in x].index(False)
+
+def concat_lists(x,y):
+    return x.strip()[:-1] + ',' + y.strip()[1:]
+
+def add_prefix_to_key(prefix, k):
+    k = k.strip()
+    if prefix != '':
+        return prefix + '.' + k
+    else:
+        return k
+
+def default_lines(flags, config):
+    #Definitions of the default macros missing in the config, and the output directory
+    exp_name = flags.get('experiment_name',datetime.datetime.now().strftime('%y-%d-%m-%H%M%S'))
+    proj_name = flags.get('project_name','features2wav')
+    config_from_flags = {
+        'EXPERIMENT_NAME': exp_name,
+        'PROJECT_NAME': proj_name,
+        'OUTPUT_DIR': 'experiments/{}/{}'.format(proj_name,exp_name)
+    }
+    mods = flags.get('mods', [])
+    mods = {k.split('=')[0]: k.split('=')[1] for k in mods}
+    existing = {k: None for k in config_from_flags}
+    for x in config.split():
+        for k in config_from_flags:
+            if x.startswith(k):
+                existing[k] = x.split('=')[-1]
+    lines = []
+    for k,v in config_from_flags.items():
+        if k in mods:
+            existing[k] = mods[k]
+        if existing[k] is None:
+            if isinstance(v,str) and not v.startswith('%'):
+                v = "'{}'".format(v)
+            lines.append("{}={}".format(k,v))
+    output_dir = config_from_flags['OUTPUT_DIR'] if existing['OUTPUT_DIR'] is None else existing['OUTPUT_DIR'].replace("'","")
+    return lines, output_dir
+
+def merge_appends(lines):
+    #Lines with += are removed and replaced by a single binding with the concatenated lists, at the end of the config
+    config_as_dict = {}
+    append_keys = {}
+    lines_to_erase = set()
+    prefix = ''
+    list_unfinished=False
+    list_acc=''
+    unfinished_type = ''
+    unfinished_k = ''
+    for i, l in enumerate(lines):
+        if list_unfinished:
+            if unfinished_type == '+=':
+                lines_to_erase.add(i)
+            list_acc += l.strip()
+            if ']' in l:
+                list_unfinished=False
+                if unfinished_type == '+=':
+                    if unfinished_k in config_as_dict:
+                        config_as_dict[unfinished_k] = concat_lists(config_as_dict[unfinished_k], list_acc)
+                    else:
+                        config_as_dict[unfinished_k] = list_acc
+                    append_keys[unfinished_k] = True
+                elif unfinished_type == '=':
+                    config_as_dict[unfinished_k] = list_acc
+                list_acc = ''
+        elif not (l.isspace() or l == ''):
+            indent = n_indent(l)
+            if indent == 0:
+                prefix = ''
+            if '+=' in l:
+                k,v = l.split('+=')
+                k = add_prefix_to_key(prefix,k)
+                if ('[' in v) and (']' not in v):
+                    list_unfinished = True
+                    list_acc += v
+                    unfinished_type = '+='
+                    unfinished_k = k
+                elif ('[' in v) and (']' in v):
+                    if k in config_as_dict:
+                        config_as_dict[k] = concat_lists(config_as_dict[k], v)
+                    else:
+                        config_as_dict[k] = v
+                lines_to_erase.add(i)
+                append_keys[k] = True
+            elif '=' in l:
+                k,v = l.split('=')
+                k = add_prefix_to_key(prefix,k)
+                if ('[' not in v) or (('[' in v) and (']' in v)):
+                    config_as_dict[k] = v
+                else:
+                    list_unfinished = True
+                    list_acc += v
+                    unfinished_type = '='
+                    unfinished_k = k
+            elif ':' in l:
+                prefix = l.split(':')[0]
+    new_lines = [l for i, l in enumerate(lines) if i not in lines_to_erase]
+    for a in append_keys:
+        new_lines.append('{}={}'.format(a,config_as_dict[a]))
+    return new_lines
+
+def expand_lines(lines, extract_initial_state=True, sympy_fallback=False):
+    #Evaluates $(...) operations and takes out the $key=value lines as initial state.
+    #Operations can use any top level macro of the config, even if it is defined after them.
+    macros = {}
+    for l in lines:
+        if ('=' in l) and (not l.startswith(' ')):
+            k, v = l.split('=')[:2]
+            if '.' not in k:
+                macros[k] = v
+
+    def replace_placeholder(match):
+        var_name = match.group(1)
+        return str(macros.get(var_name, f"%{var_name}"))
+
+    new_lines = []
+    initial_state = []
+    for l in lines:
+        if '$(' in l:
+            for m in OPERATION_PATTERN.findall(l):
+                l = l.replace(f'$({m})', evaluate_operation(MACRO_PATTERN.sub(replace_placeholder, m), sympy_fallback))
+        if extract_initial_state and l.startswith('$'):
+            key, val = l[1:].split('=')
+            initial_state.append((key, val))
+        else:
+            new_lines.append(l)
+    return new_lines, initial_state
+
+def parse_initial_value(val):
+    try:
+        return ast.literal_eval(val)
+    except:
+        return val
+
+def configure_defaults(state, config):
+    lines, state.output_dir = default_lines(state.flags, config)
+    for l in lines:
+        config += l + '\n'
+    return state, config
+
+def process_appends(state, config):
+    return state, '\n'.join(merge_appends(config.split('\n')))
+
+def process_operations(state, config):
+    lines, _ = expand_lines(config.split('\n'), extract_initial_state=False, sympy_fallback=state.flags.get('sympy_fallback', False))
+    return state, '\n'.join(lines)
+
+def get_initial_state(state,config):
+    lines = config.split('\n')
+    for l in lines:
+        if l.startswith('$'):
+            key, val = l[1:].split('=')
+            state[key] = parse_initial_value(val)
+    return state, '\n'.join([l for l in lines if not l.startswith('$')])
+
+def compile_config(flags):
+    #Returns the expanded config and the (key, value) pairs of the initial state.
+    #The default macros are not included, as they depend on the experiment name (see default_lines).
+    config = ''
+    for c in read_configs(flags):
+        config += c + '\n'
+    config = apply_mods(config, flags['mods'])
+    lines = merge_appends(config.split('\n'))
+    lines, initial_state = expand_lines(lines, sympy_fallback=flags.get('sympy_fallback', False))
+    return '\n'.join(lines), initial_state
+
+def uses_default_macros(config):
+    #Operations referencing a default macro need it defined before being expanded
+    return any([('%' + k) in m for m in OPERATION_PATTERN.findall(config) for k in DEFAULT_MACROS])
+
+def compiled_config_cache_path(flags):
+    key = json.dumps({'version': PREPROCESSOR_VERSION,
+                      'configs': read_configs(flags),
+                      'mods': flags.get('mods', []),
+                      'sympy_fallback': flags.get('sympy_fallback', False)})
+    return Path(CACHE_DIR, 'configs', hashlib.md5(key.encode()).hexdigest() + '.json')
+
+def touch_cache(path):
+    #The mtime of an entry is its last use
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def prune_config_cache(cache_dir, max_entries=None):
+    max_entries = max_entries if max_entries is not None else CONFIG_CACHE_SIZE
+    entries = []
+    for path in Path(cache_dir).glob('*.json'):
+        try:
+            entries.append((path.stat().st_mtime_ns, path))
+        except OSError:
+            #Deleted by another process meanwhile
+            pass
+    for _, path in sorted(entries)[:max(len(entries) - max_entries, 0)]:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+def load_compiled_config(flags):
+    #Returns the config ready to be parsed by gin, the output directory and the initial state
+    raw_config = '\n'.join(read_configs(flags) + flags['mods'])
+    defaults, output_dir = default_lines(flags, raw_config)
+    if uses_default_macros(raw_config):
+        config, initial_state = compile_config(dict(flags, mods=flags['mods'] + defaults))
+        return config, output_dir, initial_state
+    cache_path = compiled_config_cache_path(flags) if flags.get('config_cache', True) else None
+    compiled = _read_cache(cache_path) if cache_path is not None else None
+    if compiled is not None:
+        logger.debug('Using compiled config {}'.format(cache_path))
+        touch_cache(cache_path)
+        config, initial_state = compiled['config'], [tuple(x) for x in compiled['initial_state']]
+    else:
+        config, initial_state = compile_config(flags)
+        if cache_path is not None:
+            _write_cache(cache_path, {'config': config, 'initial_state': initial_state})
+            prune_config_cache(cache_path.parent)
+    return config + '\n' + '\n'.join(defaults), output_dir, initial_state
@@ -1,21 +1,27 @@
 import gin
-import datetime
-import joblib
 import importlib
 import inspect
 from pathlib import Path
 import time
 from loguru import logger
 import sys
-import ast
-import joblib
-from diff_match_patch import diff_match_patch
-from termcolor import colored
-import subprocess
-import re
-import ast
-from sympy import sympify
 import os
+from .environment import config_tokens, module_is_referenced, save_module_symbols, installed_packages
+from .dag import get_task_io, run_dag, BOOKKEEPING_KEYS
+from .stream import fuse_streams
+from .distributed import get_communicator, is_writer, is_rank_zero_task, shared_resume_point
+from .manifest import KeyFingerprints, make_entry, load_manifest, save_manifest, append_manifest, find_resume_point, fingerprint
+from .memo import TaskCache
+from .storage import LazyValue, list_saved_keys, save_value, default_backends, load_fingerprints, save_fingerprints, append_fingerprints
+from .checkpoint import AsyncWriter, snapshot
+from .compression import benchmark_codecs, import_joblib
+from .profiling import Profiler, profile_task, get_profiler, set_profiler
+from .config import (read_configs, process_templates, load_template, apply_mods, configure_defaults, process_appends,
+                     process_operations, get_initial_state, n_indent, concat_lists, add_prefix_to_key,
+                     load_compiled_config, parse_initial_value)
+import json
+from collections import OrderedDict, ChainMap
+import threading
 
 logger.remove()
 new_level = logger.level("INTRO", no=55, color="<yellow>", icon="")
@@ -23,8 +29,10 @@ logger.add(sys.stderr, format="<blue>{time: YYYY/MM/D > HH:mm:ss}</blue> <level>
 logger.add(sys.stderr, format="<cyan><bold>{message}</bold></cyan>", level="INTRO", colorize=True)
 
 def stdin_gen():
-    for x in sys.stdin.read().split():
-        yield x
+    #Reads line by line, so it can be used by a stream_source on inputs that don't fit in memory
+    for line in sys.stdin:
+        for x in line.split():
+            yield x
 
 def get_objs_from_module(m):
     imported_objs = {}
@@ -59,6 +67,16 @@ def import_module(k):
 
     return module, imported_objs
     
+#Modules of the module list skipped because the config doesn't reference them: import path -> gin module name
+_skipped_modules = {}
+
+def register_module(k, v):
+    module, imported_objs = import_module(k)
+    save_module_symbols(k, imported_objs.keys())
+    for obj in imported_objs.values():
+        gin.config.external_configurable(obj, module=v)
+    return module, imported_objs
+
 def gin_configure_externals(flags):
     ms = {}
     log_str = '\nAvailable objects in gin:\n---------------------------------------------\n'
@@ -74,249 +92,78 @@ def gin_configure_externals(flags):
         for k,v in ms.items():
             module_list_str += "{}: {}\n".format(k,v)
         flags['module_list_str'] = module_list_str
+    #Modules are only imported if the config references them, unless eager_externals is set
+    tokens = None
+    if (not flags.get('eager_externals', False)) and (('config_str' in flags) or ('config_path' in flags)):
+        tokens = config_tokens(read_configs(flags) + flags.get('mods', []))
     lib_versions = {}
+    _skipped_modules.clear()
     for k, v in ms.items():
-        module, imported_objs = import_module(k)
+        if (tokens is not None) and (not module_is_referenced(k, v, tokens)):
+            logger.debug('Skipping {}: not referenced in the config'.format(k))
+            _skipped_modules[k] = v
+            continue
+        module, imported_objs = register_module(k, v)
         if hasattr(module, '__version__'):
             lib_versions[k] = module.__version__
         log_str += f'{v}\n'
         for obj_name, obj in imported_objs.items():
             log_str += f'\t{obj_name}\n'
-            gin.config.external_configurable(obj, module=v)
     logger.debug(log_str)
-    result = subprocess.run(['pip', 'list'], capture_output=True, text=True)
-    if result.returncode == 0:
-        lib_versions['pip_list'] = result.stdout
-    else:
-        logger.warning('Pip list retrieval failed: {}'.format(result.stderr))
+    lib_versions['pip_list'] = installed_packages()
     return lib_versions
 
-def configure_defaults(state, config):
-    def find_macro(key, config, mods):
-        val = [x.split('=')[-1] for x in config.split() if x.startswith(key)]
-        if len(val)>0:
-            val = val[-1]
-        else:
-            val = None
-        if (mods is not None) and (key in mods):
-            val = mods[key]
-        return val
-
-    exp_name = state.flags.get('experiment_name',datetime.datetime.now().strftime('%y-%d-%m-%H%M%S'))
-    proj_name = state.flags.get('project_name','features2wav')
-    config_from_flags = {
-        'EXPERIMENT_NAME': exp_name,
-        'PROJECT_NAME': proj_name,
-        'OUTPUT_DIR': 'experiments/{}/{}'.format(proj_name,exp_name)
-    }
-    mods = state.flags.get('mods', [])
-    mods = {k.split('=')[0]: k.split('=')[1] for k in mods}
-    for k,v in config_from_flags.items():
-        already_exists = find_macro(k, config, mods)
-        if already_exists is None:
-            if isinstance(v,str) and not v.startswith('%'):
-                v = "'{}'".format(v)
-            config += "{}={}\n".format(k,v)
-        if k == 'OUTPUT_DIR':
-            state.output_dir = config_from_flags['OUTPUT_DIR'] if already_exists is None else already_exists.replace("'","")
-    
-    return state, config
-
-def apply_mods(config, mods):
-    for m in mods:
-        config += m + '\n'
-    return config
-
-def n_indent(x):
-    return [xi == ' ' for xi in x].index(False)
-
-def concat_lists(x,y):
-    return x.strip()[:-1] + ',' + y.strip()[1:]
-
-def add_prefix_to_key(prefix, k):
-    k = k.strip()
-    if prefix != '':
-        return prefix + '.' + k
-    else:
-        return k
-
-def process_appends(state, config):
-    lines = config.split('\n')
-    config_as_dict = {}
-    append_keys = []
-    lines_to_erase = []
-    prefix = ''
-    list_unfinished=False
-    list_acc=''
-    unfinished_type = ''
-    unfinished_k = ''
-    for l in lines:
-        if list_unfinished:
-            if unfinished_type == '+=':
-                lines_to_erase.append(l)
-            if ']' not in l:
-                list_acc += l.strip()
-            else:
-                list_acc += l.strip()
-                list_unfinished=False
-                if unfinished_type == '+=':
-                    if unfinished_k in config_as_dict:
-                        config_as_dict[unfinished_k] = concat_lists(config_as_dict[unfinished_k], list_acc)
-                        append_keys.append(unfinished_k)
-                    else:
-                        config_as_dict[unfinished_k] = list_acc
-                        append_keys.append(unfinished_k)
-                        lines_to_erase.append(l)
-                elif unfinished_type == '=':
-                    config_as_dict[unfinished_k] = list_acc
-                list_acc = ''
-
-
-        elif not (l.isspace() or l == ''):
-            indent = n_indent(l)
-            if indent == 0:
-                prefix = ''
-            if '+=' in l:
-                k,v = l.split('+=')
-                k = add_prefix_to_key(prefix,k)
-                if ('[' in v) and (']' not in v):
-                    list_unfinished = True
-                    list_acc += v
-                    unfinished_type = '+='
-                    unfinished_k = k
-                elif ('[' in v) and (']' in v):
-                    if k in config_as_dict:
-                        config_as_dict[k] = concat_lists(config_as_dict[k], v)
-                    else:
-                        config_as_dict[k] = v
-                lines_to_erase.append(l)
-                append_keys.append(k)
-            elif '=' in l:
-                k,v = l.split('=')
-                k = add_prefix_to_key(prefix,k)
-                if ('[' not in v) or (('[' in v) and (']' in v)):
-                    config_as_dict[k] = v
-                else:
-                    list_unfinished = True
-                    list_acc += v
-                    unfinished_type = '='
-                    unfinished_k = k
-            elif ':' in l:
-                prefix = l.split(':')[0]
-    for l in lines_to_erase:
-        lines.remove(l)
-    for a in set(append_keys):
-        new_line = '{}={}'.format(a,config_as_dict[a])
-        lines.append(new_line)
-    config = '\n'.join(lines)
-
-    return state, config
-
-def get_initial_state(state,config):
-    inits_keys = [l for l in config.split('\n') if l.startswith('$')]
-    for k in inits_keys:
-        key, val = k[1:].split('=')
-        try:
-            val = ast.literal_eval(val)
-        except:
-            pass
-        state[key] = val
-        config = config.replace(k,'')
-
-    return state, config
-
-def load_template(block_data, config_path):
-    template_path = Path(Path(config_path).parent, block_data['template'][1:-1])
-    with open(template_path, 'r') as f:
-        template = f.read()
-    block_data.pop('template')
-    for k,v in block_data.items():
-        template = template.replace('{'+k+'}', v[1:-1])
-    return [template]
-
-def process_templates(config, config_path):
-    lines = config.split('\n')
-    block_start = None
-    block_data = {}
-    i=0
-    new_lines = []
-    while i < len(lines):
-        if lines[i].strip() == '!load_template:':
-            block_start = i
-        elif block_start is not None:
-            if len(lines[i].lstrip()) < len(lines[i]):
-                #This means we are in an indented block
-                data_i = lines[i].split('=')
-                block_data[data_i[0].strip()] = data_i[1].strip()
-            else:
-                #Out of block, so we have gathered all info regarding the template loading
-                new_data = load_template(block_data, config_path)
-                new_lines.extend(new_data)
-                block_start = None
-                block_data = {}
-        else:
-            new_lines.append(lines[i])
-        i+=1
-    if block_start is not None:
-        new_data = load_template(block_data, config_path)
-        new_lines.extend(new_data)
-
-    return '\n'.join(new_lines)
-
-def process_operations(state, config):
-    # Variable values
-    macros = {l.split('=')[0]: l.split('=')[1] for l in config.split('\n') if ('=' in l) and ('.' not in l.split('=')[0]) and (not l.startswith(' '))}
-    # Find lines with operations
-    pattern = r'\$\((.*?)\)'
-    pattern_macro = r'%([A-Z_]+)'
-    
-    def replace_placeholder(match):
-        var_name = match.group(1)  # Extract the variable name after '%'
-        return str(macros.get(var_name, f"%{var_name}"))  # Replace with the value or leave as-is
-
-    new_l = []
-    for l in config.split('\n'):
-        matches = re.findall(pattern, l)
-        replacements = [re.sub(pattern_macro, replace_placeholder, m) for m in matches]
-        for m,r in zip(matches, replacements):
-            rexpr = sympify(r)
-            if not rexpr.is_integer:
-                r_str = str(rexpr.evalf())
-            else:
-                r_str = str(rexpr)
-            l = l.replace(f'$({m})', r_str)
-        new_l.append(l)
-    new_config = '\n'.join(new_l)
-    
-    return state, new_config
-
-def gin_parse_with_flags(state, flags):
-    consolidated_config = ''
-    if 'config_str' in flags:
-        for c in flags['config_str']:
-            consolidated_config += c + '\n'
-    else:
-        flags['config_str'] = []
-        for c in flags['config_path']:
-            with open(c,'r') as f:
-                config_i = f.read()
-            config_i = process_templates(config_i, c)
-            flags['config_str'].append(config_i)
-            consolidated_config += config_i + '\n'
-            
-    consolidated_config = apply_mods(consolidated_config, flags['mods'])
-    state, consolidated_config = configure_defaults(state, consolidated_config)
-    state, consolidated_config = process_appends(state, consolidated_config)
-    state, consolidated_config = process_operations(state, consolidated_config)
-    state,consolidated_config = get_initial_state(state,consolidated_config)
-    gin.parse_config(consolidated_config)
+def register_skipped_modules(state):
+    #The symbols cached for a skipped module can be outdated, e.g. when a package exports a symbol from a new submodule
+    for k, v in list(_skipped_modules.items()):
+        logger.info('Importing {}, skipped from the module list'.format(k))
+        module, _ = register_module(k, v)
+        if hasattr(module, '__version__') and ('library_versions' in state):
+            state['library_versions'][k] = module.__version__
+        del _skipped_modules[k]
+
+def gin_parse_with_flags(state, flags, set_initial_state=True):
+    #set_initial_state=False for states that already ran tasks, e.g. a prefix shared by sweep experiments
+    consolidated_config, state.output_dir, initial_state = load_compiled_config(flags)
+    if set_initial_state:
+        for key, val in initial_state:
+            state[key] = parse_initial_value(val)
+    try:
+        gin.parse_config(consolidated_config)
+    except ValueError as e:
+        if (not str(e).startswith('No configurable matching')) or (len(_skipped_modules) == 0):
+            raise
+        register_skipped_modules(state)
+        gin.clear_config()
+        gin.parse_config(consolidated_config)
     state.operative_config = gin.operative_config_str()
     state.config_str = consolidated_config
     return state
 
+def is_unchanged(v, handle):
+    #Read-only values can't differ from their saved copy, others are compared with the fingerprint they were saved with
+    np = sys.modules.get('numpy')
+    if (np is not None) and isinstance(v, np.ndarray) and (not v.flags.writeable):
+        return True
+    if isinstance(v, (bool, int, float, complex, str, bytes, type(None))):
+        return True
+    return (handle.fp is not None) and (handle.fp.split(':')[0] == fingerprint(v))
+
 class State:
     _used_keys = set()
+    _read_keys = set()
     _internal_state = {}
+    #Lazily loaded keys still equal to their copy on disk, in least recently used order
+    _loaded_handles = OrderedDict()
+    _max_loaded_size = None
+    _lazy_lock = threading.Lock()
+    _storage_backends = default_backends()
+    #Saves to a CheckpointLog instead of a file per key if set
+    _checkpoint_store = None
+    _async_writer = None
+    _saved_fingerprints = {}
+    _default_codec = None
+    _key_codecs = {}
 
     def __getstate__(self):
         return self._internal_state
@@ -326,56 +173,185 @@ class State:
 
     def __setattr__(self, k, v):
         self._used_keys.add(k)
+        self._loaded_handles.pop(k, None)
         self._internal_state[k] = v
 
     def __setitem__(self, k, v):
         self._used_keys.add(k)
+        self._loaded_handles.pop(k, None)
         self._internal_state[k] = v
 
     def __getitem__(self, k):
-        return self._internal_state[k]
+        v = self._resolve(k)
+        self._read_keys.add(k)
+        return v
     
     def __getattr__(self, k):
-        return self._internal_state[k]
+        v = self._resolve(k)
+        self._read_keys.add(k)
+        return v
     
     def __contains__(self, k):
         return k in self._internal_state
     
-    def get(self, *args, **kwargs):
-        return self._internal_state.get(*args, **kwargs)
+    def get(self, k, *args, **kwargs):
+        if k in self._internal_state:
+            self._read_keys.add(k)
+            return self._resolve(k)
+        return self._internal_state.get(k, *args, **kwargs)
     
     def keys(self):
         return self._internal_state.keys()
     
     def values(self):
-        return self._internal_state.values()
+        return [self._resolve(k) for k in self._internal_state.keys()]
     
     def items(self):
-        return self._internal_state.items()
+        return [(k, self._resolve(k)) for k in self._internal_state.keys()]
     
-    def setdefault(self, *args, **kwargs):
-        self._internal_state.setdefault(*args, **kwargs)
+    def setdefault(self, k, default=None):
+        if k in self._internal_state:
+            return self._resolve(k)
+        #A used key like any other write, so it is saved and merged from views
+        self[k] = default
+        return default
+
+    def _resolve(self, k):
+        v = self._internal_state[k]
+        if k in self._loaded_handles:
+            self._loaded_handles.move_to_end(k)
+        elif isinstance(v, LazyValue):
+            with self._lazy_lock:
+                v = self._internal_state[k]
+                if isinstance(v, LazyValue):
+                    handle = v
+                    logger.debug('Loading {} from {}'.format(k, handle.path))
+                    v = handle.load()
+                    self._shared_storage()[k] = v
+                    self._loaded_handles[k] = handle
+                    self._evict_over_limit(keep=k)
+        return v
+
+    def register_lazy(self, k, handle):
+        self._internal_state[k] = handle
+
+    def evict(self, keys=None):
+        #Drops loaded values that are still equal to their copy on disk, so they are reloaded on next access.
+        #Values modified in place since they were loaded (e.g. a dict a task added items to) are kept in memory.
+        keys = list(self._loaded_handles.keys()) if keys is None else [k for k in keys if k in self._loaded_handles]
+        storage = self._shared_storage()
+        for k in keys:
+            handle = self._loaded_handles.pop(k)
+            if is_unchanged(storage[k], handle):
+                storage[k] = handle
+            else:
+                logger.debug('Keeping {} in memory, it was modified or its fingerprint is unknown'.format(k))
+
+    def set_max_loaded_size(self, max_size):
+        State._max_loaded_size = max_size
+
+    def _evict_over_limit(self, keep=None):
+        if self._max_loaded_size is None:
+            return
+        loaded_size = sum([h.size for h in self._loaded_handles.values()])
+        for k in list(self._loaded_handles.keys()):
+            if loaded_size <= self._max_loaded_size:
+                break
+            if k != keep:
+                loaded_size -= self._loaded_handles[k].size
+                self.evict([k])
     
     def _reset_used_keys(self):
         self._used_keys.clear()
+        self._read_keys.clear()
+
+    def _new_view(self):
+        #Shares the underlying storage but tracks used keys separately, so concurrent tasks don't mix them up.
+        #Writes go to the view's own dict, run_dag merges them into the state from the main thread.
+        view = State()
+        object.__setattr__(view, '_used_keys', set())
+        object.__setattr__(view, '_read_keys', set())
+        object.__setattr__(view, '_internal_state', ChainMap({}, self._internal_state))
+        return view
+
+    def _view_writes(self):
+        return {k: self._internal_state.maps[0][k] for k in self._used_keys}
+
+    def _shared_storage(self):
+        #Lazily loaded values replace their handle in the shared storage, also when loaded through a view
+        if isinstance(self._internal_state, ChainMap):
+            return self._internal_state.maps[-1]
+        return self._internal_state
 
     def get_used_keys(self):
         return self._used_keys
 
-    def save(self, output_path):
+    def set_storage_backends(self, backends):
+        State._storage_backends = backends
+
+    def set_codecs(self, default_codec=None, key_codecs=None):
+        #Per key codecs can also be given in the key_codecs state key: $key_codecs={'token_ids': 'zstd:9'}
+        State._default_codec = default_codec
+        State._key_codecs = key_codecs if key_codecs is not None else {}
+
+    def set_checkpoint_store(self, store):
+        State._checkpoint_store = store
+
+    def set_async_writer(self, writer):
+        State._async_writer = writer
+
+    def save(self, output_path, fingerprints=None, manifest_entries=None):
+        #Keys whose content matches the fingerprint of their last saved version are not written again
+        fingerprints = fingerprints if fingerprints is not None else {}
+        store = self._checkpoint_store
+        if str(output_path) not in self._saved_fingerprints:
+            if store is None:
+                self._saved_fingerprints[str(output_path)] = load_fingerprints(output_path)
+                #Drops the lines of old versions of the keys
+                save_fingerprints(self._saved_fingerprints[str(output_path)], output_path)
+            else:
+                self._saved_fingerprints[str(output_path)] = store.fingerprints(output_path)
+        saved_fingerprints = self._saved_fingerprints[str(output_path)]
+        key_codecs = dict(self._key_codecs, **self.get('key_codecs', {}))
+        new_fingerprints = {}
         for k in self.get_used_keys():
             if k not in self.get('keys_not_saved',[]):
-                k_out_path = Path(output_path, f'{k}.pkl')
-                k_temp_path = Path(output_path, f'tmp_{k}.pkl')
-                joblib.dump(self[k],k_temp_path)
-                if k_out_path.exists():
-                    k_out_path.unlink()
-                k_temp_path.rename(k_out_path)
+                v = self[k]
+                codec = key_codecs.get(k, self._default_codec)
+                #Bookkeeping keys change in every run, hashing them would cost as much as writing them
+                fp = fingerprints[k] if k in fingerprints else (fingerprint(v) if k not in BOOKKEEPING_KEYS else None)
+                if fp is not None:
+                    fp = '{}:{}'.format(fp, codec)
+                if (fp is not None) and (saved_fingerprints.get(k) == fp):
+                    continue
+                if store is not None:
+                    #Not versioned in the writer: commits only include the puts queued before them
+                    if self._async_writer is None:
+                        store.put(output_path, k, v, codec, fp)
+                    else:
+                        self._async_writer.submit(store.put, output_path, k, snapshot(v), codec, fp)
+                elif self._async_writer is None:
+                    save_value(k, v, output_path, self._storage_backends, codec)
+                else:
+                    self._async_writer.submit(save_value, k, snapshot(v), output_path, self._storage_backends, codec, key=(str(output_path), k))
+                saved_fingerprints[k] = fp
+                new_fingerprints[k] = fp
+        if store is not None:
+            #Fingerprints are kept in the index of the log, next to the values
+            if self._async_writer is None:
+                store.commit(output_path, manifest_entries=manifest_entries)
+            else:
+                self._async_writer.submit(store.commit, output_path, None, manifest_entries)
+        elif len(new_fingerprints) > 0:
+            #Appended after the keys: a key on disk may be newer than its fingerprint, but never older
+            if self._async_writer is None:
+                append_fingerprints(new_fingerprints, output_path)
+            else:
+                self._async_writer.submit(append_fingerprints, new_fingerprints, output_path)
         self._reset_used_keys()
 
 
-def setup_gin(flags, save_config=True):
-    welcome_message="""
+WELCOME_MESSAGE="""
     
   ______   __                      __                     
  /      \ /  |                    /  |                    
@@ -391,92 +367,338 @@ $$    $$/ $$ |$$ |  $$ |$$    $$/ $$ |$$    $$/ $$       |
                         $$/           $$/                 
 
     """
-    logger.log('INTRO',welcome_message)
+
+def setup_gin(flags, save_config=True):
+    logger.log('INTRO',WELCOME_MESSAGE)
     state = State()
     state.flags = flags
     state['library_versions'] = gin_configure_externals(flags)
     state = gin_parse_with_flags(state, flags)
-    if (save_config) and int(os.environ.get('LOCAL_RANK',0))==0:
-        config_log_path = Path(state.output_dir,'config.gin')
-        config_log_path.parent.mkdir(parents=True, exist_ok=True)
-        config_str = gin.config_str()
-        if config_log_path.exists():
-            with open(config_log_path,'r') as f:
-                existing_config_str = f.read()
-            dmp = diff_match_patch()
-            diffs = dmp.diff_main(config_str, existing_config_str)
-            diffs = [d for d in diffs if d[0] != 0]
-
-            logger.warning('A config already exists in {}'.format(config_log_path))
-            if len(diffs) > 0:
-                logger.info('Differences between configs are:')
-                diff_str = ""
-                for d in diffs:
-                    if d[0] == -1:
-                        diff_str += '{} {}'.format(colored('-','red'), d[1].replace('\n',''))
-                    elif d[0] == 1:
-                        diff_str += '{} {}'.format(colored('+','green'), d[1].replace('\n',''))
-                print(diff_str)
-            else:
-                logger.info('Both configs look the same')
-            print('Do you want to overwrite the experiment? y/[n]')
-            for var in sys.stdin:
-                var = var[0]
-                if var == 'n':
-                    logger.error('Aborting experiment')
-                    sys.exit(1)
-                elif var == 'y':
-                    logger.warning('Existing experiment will be overwritten')
-                else:
-                    raise Exception('Unrecognized input')
-                break
+    if (save_config) and is_writer():
+        write_config_log(state)
 
-        with open(config_log_path,'w') as f:
-            f.write(gin.config_str())
+    return state
 
+def write_config_log(state, interactive=True):
+    config_log_path = Path(state.output_dir,'config.gin')
+    config_log_path.parent.mkdir(parents=True, exist_ok=True)
+    config_str = gin.config_str()
+    if config_log_path.exists() and interactive:
+        with open(config_log_path,'r') as f:
+            existing_config_str = f.read()
+        from diff_match_patch import diff_match_patch
+        from termcolor import colored
+        dmp = diff_match_patch()
+        diffs = dmp.diff_main(config_str, existing_config_str)
+        diffs = [d for d in diffs if d[0] != 0]
+
+        logger.warning('A config already exists in {}'.format(config_log_path))
+        if len(diffs) > 0:
+            logger.info('Differences between configs are:')
+            diff_str = ""
+            for d in diffs:
+                if d[0] == -1:
+                    diff_str += '{} {}'.format(colored('-','red'), d[1].replace('\n',''))
+                elif d[0] == 1:
+                    diff_str += '{} {}'.format(colored('+','green'), d[1].replace('\n',''))
+            print(diff_str)
+        else:
+            logger.info('Both configs look the same')
+        print('Do you want to overwrite the experiment? y/[n]')
+        for var in sys.stdin:
+            var = var[0]
+            if var == 'n':
+                logger.error('Aborting experiment')
+                sys.exit(1)
+            elif var == 'y':
+                logger.warning('Existing experiment will be overwritten')
+            else:
+                raise Exception('Unrecognized input')
+            break
+    elif config_log_path.exists():
+        logger.warning('Overwriting existing config in {}'.format(config_log_path))
+
+    with open(config_log_path,'w') as f:
+        f.write(config_str)
+
+def new_state(flags):
+    #State keeps its storage in class attributes, so running a new experiment in the same process needs them cleared
+    for attr in [State._used_keys, State._read_keys, State._internal_state, State._loaded_handles, State._saved_fingerprints]:
+        attr.clear()
+    State._async_writer = None
+    State._storage_backends = default_backends()
+    state = State()
+    state.flags = flags
     return state
 
-def save_state(state):
+def save_state(state, fingerprints=None, manifest_entries=None):
+    #manifest_entries are appended to the manifest after the keys are saved, so it never lists a task whose outputs are not on disk
     output_path = Path(state.output_dir,'state')
     if not output_path.exists():
         output_path.mkdir(parents=True)
+    if state._checkpoint_store is not None:
+        #Committed with the keys
+        state.save(output_path, fingerprints, manifest_entries=manifest_entries)
+        return
+    state.save(output_path, fingerprints)
+    if manifest_entries:
+        if state._async_writer is None:
+            append_manifest(manifest_entries, output_path)
+        else:
+            state._async_writer.submit(append_manifest, manifest_entries, output_path)
+
+def reset_manifest(state):
+    #The manifest on disk is replaced when a pipeline starts, by the entries of the tasks it skips
+    output_path = Path(state.output_dir,'state')
+    output_path.mkdir(parents=True, exist_ok=True)
+    if state._checkpoint_store is not None:
+        state._checkpoint_store.commit(output_path, manifest=list(state['task_manifest']))
+    else:
+        save_manifest(state['task_manifest'], output_path)
+
+def save_bookkeeping(state):
+    #execution_times, task_io and the operative config grow with the pipeline, so they are saved once when it ends
+    #or fails instead of after every task. Outputs of a failed task are not saved. The wall and process times
+    #are also in the manifest entries, so they are kept if the run is killed.
+    state._reset_used_keys()
     state.operative_config = gin.operative_config_str()
-    state.save(output_path)
+    state._used_keys.update([k for k in ['execution_times', 'task_io'] if k in state])
+    save_state(state)
 
-@gin.configurable
-def execute_pipeline(state, tasks=None, execution_order='sequential', output_dir=None, cache=True, is_main=False):
-    valid_execution_orders = ['sequential']
-    logger.info('Started execution of pipeline')
-    if (Path(state.output_dir,'state.pkl').exists()) and cache and is_main:
-        logger.info('Loading state from previous experiment in {}'.format(Path(state.output_dir,'state.pkl')))
-        state_ = joblib.load(Path(state.output_dir,'state.pkl'))
-        for k,v in state_.items():
-            if (k not in state) and (k != 'execution_times'):
-                state[k] = v
-    elif (Path(state.output_dir,'state').exists()) and cache and is_main:
-        for f in Path(state.output_dir, 'state').glob('*.pkl'):
-            k = f.stem
-            if (k not in state) and (k != 'execution_times'):
-                state[k] = joblib.load(f)
-    if execution_order == 'sequential':
-        for t in tasks:
-            logger.info('Running {}'.format(t.__name__))
+def record_task(state, index, t, wt, pt, reads, writes, fps, save=True, metrics=None, nested=False):
+    #Bookkeeping keys are not used keys: they are saved by save_bookkeeping and the manifest.
+    #Tasks of nested pipelines only save their outputs, their entries would clash with the outer manifest.
+    execution_times = state._internal_state.setdefault('execution_times', {})
+    i=0
+    while True:
+        name = '{}_{}'.format(t.__name__, i)
+        if name in execution_times:
+            i+=1
+        else:
+            times = {'wall_time': wt, 'process_time': pt}
+            execution_times[name] = times
+            break
+    reads = set(reads) - BOOKKEEPING_KEYS
+    writes = set(writes) - BOOKKEEPING_KEYS
+    task_io = state.get('task_io', {})
+    task_io[t.__name__] = {'reads': sorted(reads), 'writes': sorted(writes)}
+    #Not a used key, it is saved by save_bookkeeping
+    state._loaded_handles.pop('task_io', None)
+    state._internal_state['task_io'] = task_io
+    entry = dict(make_entry(index, t, reads, writes, fps), wall_time=wt, process_time=pt)
+    state._internal_state.setdefault('task_manifest', []).append(entry)
+    state._used_keys.update(writes)
+    save_start = time.time()
+    if save and is_writer():
+        save_state(state, entry['outputs'], [entry] if not nested else None)
+    #With async_save this is only the time to queue the keys
+    times['save_time'] = time.time() - save_start
+    if get_profiler() is not None:
+        get_profiler().record(index, t.__name__, wt, pt, save_start, times['save_time'], metrics)
+
+def broadcast_resumed(state, comm, n_done, manifest, fps):
+    #Sends the outputs of the tasks skipped on every rank. Lazy keys are loaded to be sent and unloaded again.
+    if comm.rank == 0:
+        manifest = [e for e in manifest if e['index'] < n_done]
+        outputs = sorted(set([k for e in manifest for k in e['outputs']]))
+        lazy = [k for k in outputs if isinstance(state._internal_state[k], LazyValue)]
+        comm.broadcast((n_done, manifest, {k: state._resolve(k) for k in outputs}))
+        state.evict(lazy)
+        return n_done, manifest
+    n_done, manifest, outputs = comm.broadcast()
+    for k, v in outputs.items():
+        state._internal_state[k] = v
+    for e in manifest:
+        fps.update(e['outputs'])
+    return n_done, manifest
+
+def run_on_rank_zero(state, index, t, comm, task_cache, fps, rerun_tasks=None, nested=False):
+    #Other ranks wait for the outputs of the task and record it as if they had run it
+    if comm.rank != 0:
+        message = comm.broadcast()
+        if 'error' in message:
+            raise Exception('Task {} failed on rank 0: {}'.format(t.__name__, message['error']))
+        for k, v in message['outputs'].items():
+            state[k] = v
+        record_task(state, index, t, message['wall_time'], message['process_time'], message['reads'], set(message['outputs']), fps, nested=nested)
+        return
+    wt, pt = 0, 0
+    try:
+        if not ((task_cache is not None) and reuse_cached(state, index, t, task_cache, fps, rerun_tasks, nested)):
+            logger.info('Running {} on rank 0'.format(t.__name__))
             pt = time.process_time()
             wt = time.time()
             state._reset_used_keys()
-            state = t(state)
+            with profile_task(index, t.__name__) as metrics:
+                t(state)
             pt = time.process_time() - pt
             wt = time.time() - wt
-            _ = state.setdefault('execution_times', {})
-            i=0
-            while True:
-                name = '{}_{}'.format(t.__name__, i)
-                if name in state['execution_times']:
-                    i+=1
-                else:
-                    state['execution_times'][name] = {'wall_time': wt, 'process_time': pt}
-                    break
-            if int(os.environ.get('LOCAL_RANK',0))==0:
-                save_state(state)
+            reads, writes = set(state._read_keys), set(state.get_used_keys())
+            if task_cache is not None:
+                store_cached(state, t, task_cache, reads, writes, fps)
+            record_task(state, index, t, wt, pt, reads, writes, fps, metrics=metrics, nested=nested)
+    except Exception as e:
+        comm.broadcast({'error': repr(e)})
+        raise
+    entry = state['task_manifest'][-1]
+    comm.broadcast({'reads': list(entry['inputs']), 'outputs': {k: state[k] for k in entry['outputs']},
+                    'wall_time': wt, 'process_time': pt})
+
+def reuse_cached(state, index, t, task_cache, fps, rerun_tasks=None, nested=False):
+    if (rerun_tasks is not None) and (t.__name__ in rerun_tasks):
+        return False
+    wt = time.time()
+    hit = task_cache.lookup(t, fps)
+    if hit is None:
+        return False
+    reads, outputs = hit
+    logger.info('Reusing cached outputs of {}'.format(t.__name__))
+    for k,v in outputs.items():
+        state[k] = v
+    record_task(state, index, t, time.time() - wt, 0, reads, set(outputs), fps, nested=nested)
+    return True
+
+def restore_outer_pipeline(state, outer_manifest, outer_used_keys, outer_read_keys):
+    #For the outer task, the nested pipeline writes the outputs of its tasks and reads their inputs not written before
+    entries = sorted(state._internal_state.get('task_manifest', []), key=lambda e: e['index'])
+    written = set()
+    for e in entries:
+        outer_read_keys.update(set(e['inputs']) - written)
+        written.update(e['outputs'])
+    state._internal_state['task_manifest'] = outer_manifest
+    state._used_keys.clear()
+    state._used_keys.update(outer_used_keys | written)
+    state._read_keys.clear()
+    state._read_keys.update(outer_read_keys)
+
+def store_cached(state, t, task_cache, reads, writes, fps):
+    writes = set(writes) - BOOKKEEPING_KEYS
+    task_cache.store(t, set(reads) - BOOKKEEPING_KEYS, {k: state[k] for k in writes if k in state}, fps)
+
+@gin.configurable
+def execute_pipeline(state, tasks=None, execution_order='sequential', output_dir=None, cache=True, is_main=False, task_io=None, executor='thread', max_workers=None, task_cache=None, max_loaded_size=None, storage_backends=None, async_save=False, save_queue_size=8, codec=None, key_codecs=None, codec_benchmark=False, instruments=None, shm_min_size=1024*1024, stream_queue_size=8, checkpoint_store=None, distributed=False, rank_zero_tasks=None, rank_independent_tasks=None, rerun_tasks=None):
+    valid_execution_orders = ['sequential', 'dag']
+    tasks = fuse_streams(tasks, stream_queue_size)
+    state.set_max_loaded_size(max_loaded_size)
+    if storage_backends is not None:
+        state.set_storage_backends(storage_backends)
+    state.set_checkpoint_store(checkpoint_store)
+    state.set_codecs(codec, key_codecs)
+    logger.info('Started execution of pipeline')
+    #A pipeline run by a task of another one keeps the manifest, used and read keys of the outer pipeline
+    nested = (not is_main) and ('task_manifest' in state._internal_state)
+    if nested:
+        outer_manifest = state._internal_state['task_manifest']
+        outer_used_keys, outer_read_keys = set(state._used_keys), set(state._read_keys)
     else:
-        raise Exception('Execution order not recognized: {}. The following values are allowed: {}'.format(execution_order, valid_execution_orders))
+        state._saved_fingerprints.clear()
+    #Tasks already run on this state by another process (e.g. a prefix shared by sweep experiments)
+    manifest = state._internal_state.pop('task_manifest', []) if is_main else []
+    inherited = len(manifest) > 0
+    fps = KeyFingerprints(state)
+    comm = None
+    writer = None
+    #Nested pipelines save with the writer of the outer one
+    parent_writer = state._async_writer
+    parent_profiler = get_profiler()
+    profiler = None
+    completed = False
+    try:
+        #Created inside the try, so the connections are closed if resuming fails
+        comm = get_communicator() if distributed else None
+        if (comm is not None) and (execution_order != 'sequential') and any([is_rank_zero_task(t, rank_zero_tasks) for t in tasks]):
+            raise Exception('Rank zero only tasks require execution_order sequential')
+        #Only rank 0 resumes from disk, it sends the outputs of the tasks skipped on every rank to the other ranks
+        from_disk = cache and is_main and ((comm is None) or (comm.rank == 0))
+        if (Path(state.output_dir,'state.pkl').exists()) and from_disk:
+            logger.info('Loading state from previous experiment in {}'.format(Path(state.output_dir,'state.pkl')))
+            state_ = import_joblib().load(Path(state.output_dir,'state.pkl'))
+            for k,v in state_.items():
+                if (k not in state) and (k != 'execution_times'):
+                    state[k] = v
+        elif (Path(state.output_dir,'state').exists()) and from_disk:
+            state_path = Path(state.output_dir, 'state')
+            handles = list_saved_keys(state_path, state._storage_backends) if checkpoint_store is None else checkpoint_store.handles(state_path)
+            for k, handle in handles.items():
+                if (k not in state) and (k != 'execution_times'):
+                    state.register_lazy(k, handle)
+            if not inherited:
+                manifest = load_manifest(state_path) if checkpoint_store is None else checkpoint_store.manifest(state_path)
+        if (comm is None) or (comm.rank == 0):
+            max_done = shared_resume_point(tasks, rank_zero_tasks, rank_independent_tasks) if comm is not None else None
+            n_done = find_resume_point(state, tasks, manifest, fps, rerun_tasks, max_done)
+        if comm is not None:
+            n_done, manifest = broadcast_resumed(state, comm, n_done if comm.rank == 0 else None, manifest, fps)
+        if n_done > 0:
+            logger.info('Skipping {} already completed tasks: {}'.format(n_done, ', '.join([t.__name__ for t in tasks[:n_done]])))
+        #Not a used key: save_state appends its entries to the manifest
+        state._internal_state['task_manifest'] = [e for e in manifest if e['index'] < n_done]
+        if is_main and is_writer():
+            if inherited and (n_done > 0):
+                state._used_keys.update([k for e in state['task_manifest'] for k in e['outputs']])
+                save_state(state)
+            reset_manifest(state)
+        writer = AsyncWriter(save_queue_size) if async_save and (parent_writer is None) else None
+        state.set_async_writer(writer or parent_writer)
+        profiler = Profiler(instruments, state.output_dir) if instruments is not None else None
+        set_profiler(profiler)
+        if execution_order == 'sequential':
+            for i, t in enumerate(tasks[n_done:], n_done):
+                if (comm is not None) and is_rank_zero_task(t, rank_zero_tasks):
+                    run_on_rank_zero(state, i, t, comm, task_cache, fps, rerun_tasks, nested)
+                    continue
+                if (task_cache is not None) and reuse_cached(state, i, t, task_cache, fps, rerun_tasks, nested):
+                    continue
+                logger.info('Running {}'.format(t.__name__))
+                pt = time.process_time()
+                wt = time.time()
+                state._reset_used_keys()
+                with profile_task(i, t.__name__) as metrics:
+                    state = t(state)
+                pt = time.process_time() - pt
+                wt = time.time() - wt
+                reads, writes = set(state._read_keys), set(state.get_used_keys())
+                if task_cache is not None:
+                    store_cached(state, t, task_cache, reads, writes, fps)
+                record_task(state, i, t, wt, pt, reads, writes, fps, metrics=metrics, nested=nested)
+        elif execution_order == 'dag':
+            state._reset_used_keys()
+            ios = [get_task_io(t, state, task_io) for t in tasks[n_done:]]
+            def on_task_end(i, reads, writes, wt, pt, metrics=None):
+                if task_cache is not None:
+                    store_cached(state, tasks[n_done + i], task_cache, reads, writes, fps)
+                record_task(state, n_done + i, tasks[n_done + i], wt, pt, reads, writes, fps, metrics=metrics, nested=nested)
+            def reuse(i):
+                return (task_cache is not None) and reuse_cached(state, n_done + i, tasks[n_done + i], task_cache, fps, rerun_tasks, nested)
+            run_dag(state, tasks[n_done:], ios, on_task_end, executor=executor, max_workers=max_workers, reuse_cached=reuse, shm_min_size=shm_min_size, first_index=n_done)
+        else:
+            raise Exception('Execution order not recognized: {}. The following values are allowed: {}'.format(execution_order, valid_execution_orders))
+        completed = True
+    finally:
+        if comm is not None:
+            comm.close()
+        try:
+            if writer is not None:
+                writer.close()
+            #The bookkeeping is saved without the closed writer
+            state.set_async_writer(parent_writer)
+            if (not nested) and ('execution_times' in state) and is_writer():
+                save_bookkeeping(state)
+        except Exception as e:
+            #Doesn't hide the error that stopped the pipeline
+            if completed:
+                raise
+            logger.error('Could not save the state of the failed pipeline: {}'.format(e))
+        finally:
+            state.set_async_writer(parent_writer)
+            if nested:
+                restore_outer_pipeline(state, outer_manifest, outer_used_keys, outer_read_keys)
+            set_profiler(parent_profiler)
+            if profiler is not None:
+                profiler.close()
+                profiler.save()
+                logger.info('Profile written to {}'.format(Path(state.output_dir, 'profile.json')))
+    if codec_benchmark:
+        results = benchmark_codecs(state, keys=[k for k in state.keys() if k not in state.get('keys_not_saved', []) + ['task_manifest']])
+        with open(Path(state.output_dir, 'codec_benchmark.json'), 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,141 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+import time
+from loguru import logger
+from .profiling import profile_task
+from .transport import SharedMemoryTransport, import_inputs, export_outputs
+
+#Keys written by ginpipe itself after each task. They never create dependencies between tasks.
+BOOKKEEPING_KEYS = {'execution_times', 'task_io', 'task_manifest', 'operative_config'}
+
+_process_state = None
+_process_tasks = None
+
+def declare_io(reads=None, writes=None):
+    #Decorator to declare which state keys a task reads and writes:
+    #   @declare_io(reads=['a'], writes=['train_feats'])
+    #   def extract_train(state): ...
+    def decorator(fn):
+        fn._ginpipe_io = {'reads': set(reads or []), 'writes': set(writes or [])}
+        return fn
+    return decorator
+
+def get_task_io(t, state, task_io=None):
+    #Priority: gin binding (execute_pipeline.task_io) > decorator > keys observed in a previous run.
+    #Returns None if the keys touched by the task are unknown.
+    name = t.__name__
+    if (task_io is not None) and (name in task_io):
+        io = task_io[name]
+    elif hasattr(t, '_ginpipe_io'):
+        io = t._ginpipe_io
+    elif name in state.get('task_io', {}):
+        io = state.get('task_io')[name]
+    else:
+        return None
+    return {'reads': set(io.get('reads', [])) - BOOKKEEPING_KEYS, 'writes': set(io.get('writes', [])) - BOOKKEEPING_KEYS}
+
+def build_dependencies(ios):
+    #Task j depends on an earlier task i if they conflict on any key (RAW, WAR or WAW).
+    #Tasks with unknown io behave as barriers.
+    deps = []
+    for j, io_j in enumerate(ios):
+        deps_j = set()
+        for i in range(j):
+            io_i = ios[i]
+            if (io_i is None) or (io_j is None):
+                deps_j.add(i)
+            elif (io_i['writes'] & (io_j['reads'] | io_j['writes'])) or (io_i['reads'] & io_j['writes']):
+                deps_j.add(i)
+        deps.append(deps_j)
+    return deps
+
+def _run_in_thread(t, view, index=None):
+    pt = time.thread_time()
+    wt = time.time()
+    with profile_task(index, t.__name__) as metrics:
+        t(view)
+    pt = time.thread_time() - pt
+    wt = time.time() - wt
+    #Written to the view, not to the shared state, while save_state may be reading it
+    return set(view._read_keys), view._view_writes(), wt, pt, metrics
+
+def _run_in_process(idx, inputs, shm_min_size=None, index=None):
+    #Runs in a worker forked from the main process, so tasks and gin bindings are inherited.
+    #idx is the position in the tasks given to run_dag, index the one in the pipeline.
+    t = _process_tasks[idx]
+    view = _process_state._new_view()
+    inputs, attached = import_inputs(inputs)
+    for k, v in inputs.items():
+        view._internal_state[k] = v
+    pt = time.process_time()
+    wt = time.time()
+    with profile_task(index, t.__name__) as metrics:
+        t(view)
+    pt = time.process_time() - pt
+    wt = time.time() - wt
+    writes = export_outputs({k: view[k] for k in view.get_used_keys()}, attached, shm_min_size)
+    return set(view._read_keys), writes, wt, pt, metrics
+
+def run_dag(state, tasks, ios, on_task_end, executor='thread', max_workers=None, reuse_cached=None, shm_min_size=None, first_index=0):
+    #With the process executor, values over shm_min_size bytes are passed through shared memory (see transport.py).
+    #first_index is the index of tasks[0] in the pipeline, for the profiler.
+    global _process_state, _process_tasks
+    valid_executors = ['thread', 'process']
+    if executor not in valid_executors:
+        raise Exception('Executor not recognized: {}. The following values are allowed: {}'.format(executor, valid_executors))
+    deps = build_dependencies(ios)
+    if executor == 'thread':
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+    else:
+        _process_state = state
+        _process_tasks = tasks
+        pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('fork'))
+    transport = SharedMemoryTransport(shm_min_size) if (executor == 'process') and (shm_min_size is not None) else None
+    pending = list(range(len(tasks)))
+    done = set()
+    running = {}
+    try:
+        with pool:
+            while pending or running:
+                for i in [i for i in pending if deps[i] <= done]:
+                    t = tasks[i]
+                    pending.remove(i)
+                    if (reuse_cached is not None) and reuse_cached(i):
+                        done.add(i)
+                        continue
+                    logger.info('Running {}'.format(t.__name__))
+                    if executor == 'thread':
+                        running[pool.submit(_run_in_thread, t, state._new_view(), first_index + i)] = i
+                    elif ios[i] is None:
+                        #Unknown keys: the task is a barrier, so nothing else is running. Run it here.
+                        view = state._new_view()
+                        reads, writes, wt, pt, metrics = _run_in_thread(t, view, first_index + i)
+                        for k, v in writes.items():
+                            state[k] = v
+                        on_task_end(i, reads, set(writes), wt, pt, metrics)
+                        done.add(i)
+                    else:
+                        inputs = {k: state[k] for k in ios[i]['reads'] if k in state}
+                        if transport is not None:
+                            inputs = transport.export_inputs(i, inputs, state)
+                        running[pool.submit(_run_in_process, i, inputs, transport.min_size if transport is not None else None, first_index + i)] = i
+                if len(running) == 0:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    i = running.pop(f)
+                    reads, writes, wt, pt, metrics = f.result()
+                    if transport is not None:
+                        writes = transport.import_outputs(i, writes)
+                    #Outputs are merged here, in the main thread, for both executors
+                    for k, v in writes.items():
+                        state[k] = v
+                    on_task_end(i, reads, set(writes), wt, pt, metrics)
+                    done.add(i)
+    finally:
+        if transport is not None:
+            #Outputs of tasks that finished after another one failed
+            for f in running:
+                if f.done() and (not f.cancelled()) and (f.exception() is None):
+                    transport.discard(f.result()[1])
+            transport.close()
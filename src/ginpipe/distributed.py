@@ -0,0 +1,158 @@
+#Distributed mode of execute_pipeline, for pipelines launched once per rank (torchrun, mpirun...):
+#   execute_pipeline.distributed = True
+#Rank 0 is the only one resuming from disk and saving the state.
+#Tasks tagged with @rank_zero_only (or listed in execute_pipeline.rank_zero_tasks) only run on rank 0 and their
+#outputs are broadcast, the rest run on every rank.
+#When resuming, rank 0 sends the outputs of completed rank zero tasks to the other ranks. Outputs of tasks run by
+#every rank may differ between ranks, so every rank runs again from the first of them, unless the task is tagged
+#with @rank_independent (or listed in execute_pipeline.rank_independent_tasks): then its outputs are the same on
+#every rank (e.g. a model trained with DistributedDataParallel) and rank 0 sends its own.
+#If torch.distributed is initialized its process group is used, otherwise rank 0 listens on a TCP socket at
+#MASTER_ADDR and GINPIPE_PORT (MASTER_PORT + 1 by default, as torch uses MASTER_PORT) and the other ranks connect.
+import os
+import pickle
+import socket
+import struct
+import sys
+import time
+from loguru import logger
+
+RENDEZVOUS_TIMEOUT = 600
+
+def get_rank():
+    return int(os.environ.get('RANK', os.environ.get('LOCAL_RANK', 0)))
+
+def get_world_size():
+    return int(os.environ.get('WORLD_SIZE', 1))
+
+def is_writer():
+    #Only one process writes config.gin and the state, also when several nodes share the output dir
+    return get_rank() == 0
+
+def rank_zero_only(fn):
+    #   @rank_zero_only
+    #   def download_dataset(state): ...
+    fn._ginpipe_rank_zero = True
+    return fn
+
+def is_rank_zero_task(t, rank_zero_tasks=None):
+    #Priority like task_io: gin binding (execute_pipeline.rank_zero_tasks) > decorator
+    if (rank_zero_tasks is not None) and (t.__name__ in rank_zero_tasks):
+        return True
+    return getattr(t, '_ginpipe_rank_zero', False)
+
+def rank_independent(fn):
+    #   @rank_independent
+    #   def train(state): ...
+    fn._ginpipe_rank_independent = True
+    return fn
+
+def is_rank_independent_task(t, rank_independent_tasks=None):
+    if (rank_independent_tasks is not None) and (t.__name__ in rank_independent_tasks):
+        return True
+    return getattr(t, '_ginpipe_rank_independent', False)
+
+def shared_resume_point(tasks, rank_zero_tasks=None, rank_independent_tasks=None):
+    #How many leading tasks can be skipped on every rank, with the outputs of rank 0, if they are completed
+    for i, t in enumerate(tasks):
+        if not (is_rank_zero_task(t, rank_zero_tasks) or is_rank_independent_task(t, rank_independent_tasks)):
+            logger.info('{} runs on every rank and its outputs may depend on the rank, it is never skipped'.format(t.__name__))
+            return i
+    return len(tasks)
+
+def _recv_exactly(conn, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while len(view) > 0:
+        n_read = conn.recv_into(view)
+        if n_read == 0:
+            raise Exception('Connection to rank 0 closed')
+        view = view[n_read:]
+    return buf
+
+class TorchCommunicator:
+    def __init__(self):
+        import torch.distributed as dist
+        self.dist = dist
+        self.rank = dist.get_rank()
+        self.world_size = dist.get_world_size()
+
+    def broadcast(self, obj=None):
+        objs = [obj]
+        self.dist.broadcast_object_list(objs, src=0)
+        return objs[0]
+
+    def close(self):
+        pass
+
+class SocketCommunicator:
+    #Rank 0 sends every message to each rank. Arrays go out of band (pickle protocol 5), without copying them.
+    def __init__(self, rank, world_size, addr, port, timeout=RENDEZVOUS_TIMEOUT):
+        self.rank = rank
+        self.world_size = world_size
+        self.conns = []
+        if rank == 0:
+            server = socket.create_server((addr, port))
+            server.listen(world_size)
+            server.settimeout(timeout)
+            conns = {}
+            try:
+                while len(conns) < world_size - 1:
+                    conn, _ = server.accept()
+                    conn.settimeout(None)
+                    conns[struct.unpack('!I', _recv_exactly(conn, 4))[0]] = conn
+            except socket.timeout:
+                raise Exception('Timed out waiting for ranks {} to connect to {}:{}'.format(sorted(set(range(1, world_size)) - set(conns)), addr, port))
+            finally:
+                server.close()
+            self.conns = [conns[r] for r in sorted(conns)]
+        else:
+            start = time.time()
+            while True:
+                try:
+                    conn = socket.create_connection((addr, port), timeout=timeout)
+                    break
+                except OSError:
+                    #Rank 0 may not be listening yet
+                    if time.time() - start > timeout:
+                        raise Exception('Timed out connecting to rank 0 at {}:{}'.format(addr, port))
+                    time.sleep(0.1)
+            conn.settimeout(None)
+            conn.sendall(struct.pack('!I', rank))
+            self.conns = [conn]
+
+    def broadcast(self, obj=None):
+        if self.rank == 0:
+            buffers = []
+            data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+            frames = [data] + [b.raw() for b in buffers]
+            header = struct.pack('!I', len(frames)) + b''.join([struct.pack('!Q', f.nbytes if isinstance(f, memoryview) else len(f)) for f in frames])
+            for conn in self.conns:
+                conn.sendall(header)
+                for f in frames:
+                    conn.sendall(f)
+            return obj
+        conn = self.conns[0]
+        n_frames = struct.unpack('!I', _recv_exactly(conn, 4))[0]
+        sizes = struct.unpack('!{}Q'.format(n_frames), _recv_exactly(conn, 8*n_frames))
+        frames = [_recv_exactly(conn, n) for n in sizes]
+        return pickle.loads(frames[0], buffers=frames[1:])
+
+    def close(self):
+        for conn in self.conns:
+            conn.close()
+        self.conns = []
+
+def get_communicator():
+    #None when running a single process
+    torch = sys.modules.get('torch')
+    if (torch is not None) and torch.distributed.is_available() and torch.distributed.is_initialized():
+        if torch.distributed.get_world_size() > 1:
+            return TorchCommunicator()
+        return None
+    if get_world_size() <= 1:
+        return None
+    addr = os.environ.get('MASTER_ADDR', '127.0.0.1')
+    port = int(os.environ.get('GINPIPE_PORT', int(os.environ.get('MASTER_PORT', 29500)) + 1))
+    logger.info('Rank {} of {} connecting to {}:{}'.format(get_rank(), get_world_size(), addr, port))
+    return SocketCommunicator(get_rank(), get_world_size(), addr, port)
@@ -0,0 +1,105 @@
+import hashlib
+import importlib.metadata
+import importlib.util
+import json
+import os
+from pathlib import Path
+import re
+import sys
+from loguru import logger
+
+CACHE_DIR = Path(os.environ.get('GINPIPE_CACHE_DIR', '~/.cache/ginpipe')).expanduser()
+
+def _read_cache(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_cache(path, data):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(path.parent, 'tmp_{}_{}'.format(os.getpid(), path.name))
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        tmp_path.replace(path)
+    except OSError as e:
+        logger.debug('Could not write cache {}: {}'.format(path, e))
+
+def environment_fingerprint():
+    #Installing or removing packages touches the site-packages directories, changing their mtime.
+    #Other entries of sys.path (e.g. the working directory) change too often to be part of the fingerprint.
+    paths = [(p, os.stat(p).st_mtime_ns) for p in sys.path if os.path.isdir(p) and (os.path.basename(p) in ['site-packages', 'dist-packages'])]
+    return hashlib.md5(repr((sys.prefix, sys.version, paths)).encode()).hexdigest()
+
+def installed_packages():
+    #Same information as `pip list`, collected in-process and cached per environment
+    cache_path = Path(CACHE_DIR, 'environments', environment_fingerprint() + '.json')
+    packages = _read_cache(cache_path)
+    if packages is None:
+        packages = {}
+        for d in importlib.metadata.distributions():
+            name = d.metadata['Name']
+            if name is not None:
+                packages[name] = d.version
+        _write_cache(cache_path, packages)
+    names = sorted(packages, key=str.lower)
+    name_width = max([len('Package')] + [len(n) for n in names])
+    version_width = max([len('Version')] + [len(packages[n]) for n in names])
+    lines = ['{:<{}} {}'.format('Package', name_width, 'Version'), '{} {}'.format('-'*name_width, '-'*version_width)]
+    lines += ['{:<{}} {}'.format(n, name_width, packages[n]) for n in names]
+    return '\n'.join(lines) + '\n'
+
+def config_tokens(config_strs):
+    #Selector-like tokens in the config, with all their dotted suffixes (gin matches partial selectors)
+    tokens = set()
+    for c in config_strs:
+        for token in re.findall(r'[A-Za-z_][\w.]*', c):
+            parts = token.strip('.').split('.')
+            for i in range(len(parts)):
+                tokens.add('.'.join(parts[i:]))
+    return tokens
+
+def _module_origin(k):
+    #Mirrors the lookup order of core.import_module without importing the module
+    if Path(k.replace('.','/')+'/__init__.py').exists():
+        return Path(k.replace('.','/')+'/__init__.py')
+    try:
+        spec = importlib.util.find_spec(k)
+    except (ImportError, ValueError):
+        spec = None
+    if (spec is not None) and (spec.origin is not None) and os.path.exists(spec.origin):
+        return Path(spec.origin)
+    return None
+
+def _symbols_cache_path(k):
+    #Keyed on the module file only, stat'ing every file of big packages would cost more than it saves.
+    #Symbols a package gets from its other files can be missing, gin_parse_with_flags then imports the skipped modules.
+    origin = _module_origin(k)
+    if origin is None:
+        return None
+    key = repr((k, str(origin.resolve()), origin.stat().st_mtime_ns))
+    return Path(CACHE_DIR, 'symbols', hashlib.md5(key.encode()).hexdigest() + '.json')
+
+def load_module_symbols(k):
+    cache_path = _symbols_cache_path(k)
+    if cache_path is None:
+        #Entries like package.module.fn register a single object
+        return [k.split('.')[-1]] if '.' in k else None
+    return _read_cache(cache_path)
+
+def save_module_symbols(k, symbols):
+    cache_path = _symbols_cache_path(k)
+    if cache_path is not None:
+        _write_cache(cache_path, sorted(symbols))
+
+def module_is_referenced(k, v, tokens):
+    #k: import path in the module list, v: gin module name it is registered under
+    if (v in tokens) or any([t.startswith(v + '.') for t in tokens]):
+        return True
+    symbols = load_module_symbols(k)
+    if symbols is None:
+        #Never imported before: import it to learn which symbols it exports
+        return True
+    return any([s in tokens for s in symbols])
@@ -0,0 +1,287 @@
+import gin
+import json
+import os
+from pathlib import Path
+import pickle
+import sys
+import threading
+from loguru import logger
+from .compression import compress_bytes, decompress_bytes, parse_codec
+from .storage import LazyValue, TMP_PREFIX
+
+SEGMENT_PREFIX = 'log_'
+SEGMENT_SUFFIX = '.seg'
+INDEX_FILENAME = 'index.json'
+JOURNAL_FILENAME = 'index.journal'
+#Raw arrays start at a multiple of this, like the data of NumpyBackend's .npy files
+ALIGNMENT = 64
+
+@gin.configurable
+class CheckpointLog:
+    #Saves the state of each output dir in a few append-only segment files instead of a file per key:
+    #   execute_pipeline.checkpoint_store = @CheckpointLog()
+    #Values are appended to the last segment and each save_state commits them: the segment is fsync'd and a
+    #line with the new index entries (key -> segment, offset, length, version) and the new manifest entries is
+    #appended to index.journal and fsync'd. Values written after the last commit are ignored when the log is opened.
+    #Resuming only reads the index, values are loaded from the segments when first accessed.
+    #When more than compact_ratio of the bytes are old versions, the live values are copied to a new segment,
+    #the index is snapshotted to index.json and the old segments deleted.
+    def __init__(self, segment_size=1024**3, compact_ratio=0.5, min_compact_size=64*1024**2, fsync=True, mmap_mode='r', min_array_size=1024*1024):
+        self.segment_size = segment_size
+        self.compact_ratio = compact_ratio
+        self.min_compact_size = min_compact_size
+        self.fsync = fsync
+        #Uncompressed arrays over min_array_size are stored raw and loaded memory-mapped (None to load them in memory)
+        self.mmap_mode = mmap_mode
+        self.min_array_size = min_array_size
+        self.logs = {}
+        self.lock = threading.Lock()
+
+    def open(self, state_path):
+        with self.lock:
+            key = str(Path(state_path).resolve())
+            if key not in self.logs:
+                self.logs[key] = SegmentLog(state_path, self)
+            return self.logs[key]
+
+    def put(self, state_path, k, v, codec=None, fp=None):
+        self.open(state_path).put(k, v, codec, fp)
+
+    def commit(self, state_path, manifest=None, manifest_entries=None):
+        #manifest replaces the whole manifest, manifest_entries are appended to it
+        self.open(state_path).commit(manifest, manifest_entries)
+
+    def fingerprints(self, state_path):
+        return self.open(state_path).fingerprints()
+
+    def handles(self, state_path):
+        return self.open(state_path).handles()
+
+    def manifest(self, state_path):
+        return self.open(state_path).manifest
+
+    def close(self):
+        with self.lock:
+            for log in self.logs.values():
+                log.close()
+            self.logs = {}
+
+class LogValue(LazyValue):
+    #Handle to a key in a SegmentLog or LogIndex. It reads the current entry of the key, so it survives compactions.
+    def __init__(self, log, k):
+        self.log = log
+        self.k = k
+        self.path = log.segment_path(log.entries[k]['segment'])
+        self.size = log.entries[k]['length']
+        self.fp = log.entries[k]['fp']
+
+    def load(self):
+        return self.log.get(self.k)
+
+    def __repr__(self):
+        return 'LogValue({}, {})'.format(self.log.path, self.k)
+
+def encode(v, codec, min_array_size):
+    #Returns the bytes to append and the entry fields needed to decode them
+    np = sys.modules.get('numpy')
+    if (np is not None) and isinstance(v, np.ndarray) and (not v.dtype.hasobject) and (v.nbytes >= min_array_size) and (parse_codec(codec)[0] == 'none'):
+        v = np.ascontiguousarray(v)
+        return memoryview(v).cast('B'), {'format': 'array', 'dtype': v.dtype.str, 'shape': list(v.shape)}
+    return compress_bytes(pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL), codec), {'format': 'pickle', 'codec': codec}
+
+class LogIndex:
+    #Read-only view of a SegmentLog as of its last commit. It never creates, truncates or keeps open a file,
+    #so it can read the log of a running pipeline (e.g. in ginpipe plan).
+    def __init__(self, path, mmap_mode='r'):
+        self.path = Path(path)
+        self.mmap_mode = mmap_mode
+        self.entries = {}
+        self.manifest = []
+        #Size of the journal up to its last complete line
+        self.valid_size = self._load_index()
+
+    def segment_path(self, i):
+        return Path(self.path, '{}{:06d}{}'.format(SEGMENT_PREFIX, i, SEGMENT_SUFFIX))
+
+    def segment_ids(self):
+        return sorted([int(f.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for f in self.path.glob(SEGMENT_PREFIX + '*' + SEGMENT_SUFFIX)])
+
+    def _apply(self, record):
+        for k, entry in record.get('keys', {}).items():
+            if (k not in self.entries) or (entry['version'] > self.entries[k]['version']):
+                self.entries[k] = entry
+        if 'manifest' in record:
+            self.manifest = record['manifest']
+        if 'manifest_entries' in record:
+            self.manifest = self.manifest + record['manifest_entries']
+
+    def _load_index(self):
+        index_path = Path(self.path, INDEX_FILENAME)
+        if index_path.exists():
+            with open(index_path, 'r') as f:
+                self._apply(json.load(f))
+        journal_path = Path(self.path, JOURNAL_FILENAME)
+        if not journal_path.exists():
+            return 0
+        valid_size = 0
+        with open(journal_path, 'rb') as f:
+            for line in f:
+                #A crash while appending leaves a partial last line, which is ignored
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                self._apply(record)
+                valid_size += len(line)
+        return valid_size
+
+    def get(self, k):
+        entry = self.entries[k]
+        return self._read(entry, self.segment_path(entry['segment']))
+
+    def _read(self, entry, path):
+        if entry['format'] == 'array':
+            import numpy as np
+            if self.mmap_mode is not None:
+                return np.memmap(path, dtype=np.dtype(entry['dtype']), mode=self.mmap_mode, offset=entry['offset'], shape=tuple(entry['shape']))
+            with open(path, 'rb') as f:
+                f.seek(entry['offset'])
+                return np.fromfile(f, dtype=np.dtype(entry['dtype']), count=entry['length']//np.dtype(entry['dtype']).itemsize).reshape(entry['shape'])
+        with open(path, 'rb') as f:
+            f.seek(entry['offset'])
+            data = f.read(entry['length'])
+        return pickle.loads(decompress_bytes(data, entry['codec']))
+
+    def fingerprints(self):
+        return {k: e['fp'] for k, e in self.entries.items() if e['fp'] is not None}
+
+    def handles(self):
+        return {k: LogValue(self, k) for k in self.entries}
+
+class SegmentLog(LogIndex):
+    def __init__(self, path, options):
+        Path(path).mkdir(parents=True, exist_ok=True)
+        super().__init__(path, options.mmap_mode)
+        self.options = options
+        self.lock = threading.RLock()
+        self.pending = {}
+        self.pending_writes = False
+        journal_path = Path(self.path, JOURNAL_FILENAME)
+        if journal_path.exists() and (self.valid_size < journal_path.stat().st_size):
+            logger.warning('Dropping uncommitted end of {}'.format(journal_path))
+            with open(journal_path, 'r+b') as f:
+                f.truncate(self.valid_size)
+        #Sizes are tracked here, so commits don't stat the segments
+        self.sizes = {i: self.segment_path(i).stat().st_size for i in self.segment_ids()}
+        self.active = max(self.sizes) if len(self.sizes) > 0 else 0
+        self.file = open(self.segment_path(self.active), 'ab')
+        self.sizes[self.active] = self.file.tell()
+        self.journal = open(journal_path, 'ab')
+
+    def _sync(self, f):
+        f.flush()
+        if self.options.fsync:
+            os.fsync(f.fileno())
+
+    def _append(self, data, aligned):
+        if (self.file.tell() > 0) and (self.file.tell() + len(data) > self.options.segment_size):
+            self._sync(self.file)
+            self.file.close()
+            self.active += 1
+            self.file = open(self.segment_path(self.active), 'ab')
+        if aligned and (self.file.tell() % ALIGNMENT != 0):
+            self.file.write(bytes(ALIGNMENT - self.file.tell() % ALIGNMENT))
+        offset = self.file.tell()
+        self.file.write(data)
+        self.sizes[self.active] = self.file.tell()
+        self.pending_writes = True
+        return self.active, offset
+
+    def put(self, k, v, codec=None, fp=None):
+        data, entry = encode(v, codec, self.options.min_array_size)
+        with self.lock:
+            segment, offset = self._append(data, aligned=entry['format'] == 'array')
+            current = self.pending.get(k, self.entries.get(k))
+            entry.update({'segment': segment, 'offset': offset, 'length': len(data),
+                          'version': current['version'] + 1 if current is not None else 1, 'fp': fp})
+            self.pending[k] = entry
+
+    def commit(self, manifest=None, manifest_entries=None):
+        with self.lock:
+            if (len(self.pending) == 0) and (manifest is None) and (not manifest_entries):
+                return
+            if self.pending_writes:
+                self._sync(self.file)
+                self.pending_writes = False
+            record = {'keys': self.pending}
+            if manifest is not None:
+                record['manifest'] = manifest
+            if manifest_entries:
+                record['manifest_entries'] = manifest_entries
+            self.journal.write((json.dumps(record) + '\n').encode())
+            self._sync(self.journal)
+            self._apply(record)
+            self.pending = {}
+            if self.should_compact():
+                self.compact()
+
+    def get(self, k):
+        #Holds the lock so a compaction can't delete the segment meanwhile
+        with self.lock:
+            if self.entries[k]['segment'] == self.active:
+                self.file.flush()
+            return super().get(k)
+
+    def fingerprints(self):
+        with self.lock:
+            return super().fingerprints()
+
+    def handles(self):
+        with self.lock:
+            return super().handles()
+
+    def should_compact(self):
+        total = sum(self.sizes.values())
+        live = sum([e['length'] for e in self.entries.values()])
+        return (total >= self.options.min_compact_size) and (total - live > self.options.compact_ratio*total)
+
+    def compact(self):
+        #Called holding the lock after a commit. Live values are copied as bytes, without decoding them.
+        old_segments = sorted(self.sizes)
+        logger.info('Compacting checkpoint log in {}'.format(self.path))
+        self._sync(self.file)
+        self.file.close()
+        self.active = old_segments[-1] + 1
+        self.sizes = {}
+        self.file = open(self.segment_path(self.active), 'ab')
+        entries = {}
+        for k, entry in sorted(self.entries.items(), key=lambda x: (x[1]['segment'], x[1]['offset'])):
+            with open(self.segment_path(entry['segment']), 'rb') as f:
+                f.seek(entry['offset'])
+                data = f.read(entry['length'])
+            segment, offset = self._append(data, aligned=entry['format'] == 'array')
+            entries[k] = dict(entry, segment=segment, offset=offset)
+        self._sync(self.file)
+        self.pending_writes = False
+        #The snapshot replaces the journal: write it, then empty the journal. Replaying a journal over a newer
+        #snapshot is harmless, as entries only replace older versions.
+        tmp_path = Path(self.path, TMP_PREFIX + INDEX_FILENAME)
+        with open(tmp_path, 'w') as f:
+            json.dump({'keys': entries, 'manifest': self.manifest}, f)
+            self._sync(f)
+        tmp_path.replace(Path(self.path, INDEX_FILENAME))
+        self.journal.close()
+        self.journal = open(Path(self.path, JOURNAL_FILENAME), 'wb')
+        self._sync(self.journal)
+        self.entries = entries
+        #Memory-mapped arrays of deleted segments stay valid until they are released
+        for i in old_segments:
+            self.segment_path(i).unlink()
+
+    def close(self):
+        with self.lock:
+            self._sync(self.file)
+            self.file.close()
+            self.journal.close()
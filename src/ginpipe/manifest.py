@@ -0,0 +1,221 @@
+import gin
+import inspect
+import json
+from pathlib import Path
+import types
+from loguru import logger
+from .compression import import_joblib
+from .storage import LazyValue
+
+#One entry per line, so recording a task appends a line instead of rewriting the whole manifest
+MANIFEST_FILENAME = 'manifest.jsonl'
+
+def fingerprint(v):
+    try:
+        return import_joblib().hash(v)
+    except Exception:
+        #Unhashable values never match, so tasks consuming them are always recomputed
+        return None
+
+def _binding_repr(v, seen):
+    #Stable representation of a bound value: macros are resolved and references include their own bindings,
+    #so a change anywhere down the reference chain changes the representation.
+    if isinstance(v, gin.config.ConfigurableReference):
+        if v.selector in ['gin.macro', 'gin.constant']:
+            return _binding_repr(gin.query_parameter('%' + '/'.join(v.scopes)), seen)
+        if v.scoped_selector in seen:
+            return repr(v)
+        bindings = gin.get_bindings(v.scoped_selector, resolve_references=False)
+        bindings = {k: _binding_repr(b, seen | {v.scoped_selector}) for k, b in sorted(bindings.items())}
+        return '{}{}'.format(repr(v), bindings)
+    elif isinstance(v, (list, tuple)):
+        return '{}{}'.format(type(v).__name__, [_binding_repr(x, seen) for x in v])
+    elif isinstance(v, dict):
+        return '{}'.format({k: _binding_repr(x, seen) for k, x in v.items()})
+    else:
+        return repr(v)
+
+def _code_names(code):
+    #Global and attribute names used by a function, including its nested functions and comprehensions
+    names = set(code.co_names)
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType):
+            names.update(_code_names(c))
+    return names
+
+def _is_configurable(obj):
+    try:
+        gin.get_bindings(obj, resolve_references=False)
+        return True
+    except (ValueError, TypeError):
+        return False
+
+def called_configurables(fn, module=None, seen=None):
+    #Configurables a task calls by name (f(...), module.f(...)), also through plain functions of the task module
+    #and through other configurables. Calls through variables or gin references are not found: bind those
+    #configurables as task parameters, or list the task in execute_pipeline.rerun_tasks after changing them.
+    seen = set() if seen is None else seen
+    target = inspect.unwrap(fn)
+    if inspect.isclass(target):
+        target = inspect.unwrap(target.__init__)
+    code = getattr(target, '__code__', None)
+    if (code is None) or (code in seen):
+        return {}
+    seen.add(code)
+    module = target.__module__ if module is None else module
+    names = _code_names(code)
+    fn_globals = getattr(target, '__globals__', {})
+    candidates = []
+    for name in names:
+        obj = fn_globals.get(name)
+        if isinstance(obj, types.ModuleType):
+            candidates.extend([getattr(obj, a) for a in names if isinstance(getattr(obj, a, None), (types.FunctionType, type))])
+        elif isinstance(obj, (types.FunctionType, type)):
+            candidates.append(obj)
+    configurables = {}
+    for obj in candidates:
+        if _is_configurable(obj):
+            name = '{}.{}'.format(obj.__module__, obj.__qualname__)
+            if name not in configurables:
+                bindings = gin.get_bindings(obj, resolve_references=False)
+                configurables[name] = {k: _binding_repr(v, set()) for k, v in sorted(bindings.items())}
+                configurables.update(called_configurables(obj, module, seen))
+        elif getattr(obj, '__module__', None) == module:
+            configurables.update(called_configurables(obj, module, seen))
+    return configurables
+
+def task_bindings(t):
+    if hasattr(t, '_ginpipe_stages'):
+        #Fused streaming tasks
+        return {'{}_{}'.format(i, s.__name__): task_bindings(s) for i, s in enumerate(t._ginpipe_stages)}
+    fn = t
+    bindings = {}
+    while True:
+        try:
+            bindings = gin.get_bindings(fn, resolve_references=False)
+            break
+        except ValueError:
+            fn = getattr(fn, '__wrapped__', None)
+            if fn is None:
+                break
+    if (fn is not None) and (fn is not t):
+        #Scoped reference (@scope/task): the scope is not recoverable from the wrapper, so depend on the whole config.
+        return {'__config__': fingerprint(gin.config_str())}
+    bindings = {k: _binding_repr(v, set()) for k, v in sorted(bindings.items())}
+    #Only added when there are called configurables, so manifests of tasks without them keep matching
+    calls = called_configurables(t)
+    calls.pop('{}.{}'.format(t.__module__, t.__qualname__), None)
+    if len(calls) > 0:
+        bindings['__calls__'] = {k: calls[k] for k in sorted(calls)}
+    return bindings
+
+def state_fingerprint(state, k):
+    #Values saved on disk, loaded or not, take the fingerprint they were saved with instead of being loaded and hashed
+    v = state._internal_state[k]
+    handle = v if isinstance(v, LazyValue) else state._loaded_handles.get(k)
+    if (handle is not None) and (handle.fp is not None):
+        return handle.fp.split(':')[0]
+    return fingerprint(state._resolve(k))
+
+class KeyFingerprints:
+    #Fingerprints of state keys as the pipeline advances. Keys written by tasks take the fingerprint of the
+    #recorded output, the rest are hashed the first time a task reads them.
+    def __init__(self, state):
+        self.state = state
+        self.fps = {}
+
+    def __getitem__(self, k):
+        if k not in self.fps:
+            self.fps[k] = state_fingerprint(self.state, k) if k in self.state else None
+        return self.fps[k]
+
+    def update(self, fps):
+        self.fps.update(fps)
+
+def make_entry(index, t, reads, writes, fps):
+    inputs = {k: fps[k] for k in sorted(reads)}
+    outputs = {k: fingerprint(fps.state[k]) for k in sorted(writes) if k in fps.state}
+    fps.update(outputs)
+    return {'index': index, 'task': t.__name__, 'bindings': task_bindings(t), 'inputs': inputs, 'outputs': outputs}
+
+def load_manifest(state_path):
+    manifest_path = Path(state_path, MANIFEST_FILENAME)
+    if not manifest_path.exists():
+        return []
+    manifest = []
+    with open(manifest_path, 'r') as f:
+        for line in f:
+            #A crash while appending leaves a partial last line, the task is run again
+            try:
+                manifest.append(json.loads(line))
+            except ValueError:
+                break
+    return manifest
+
+def save_manifest(manifest, state_path):
+    #Replaces the manifest, when a pipeline starts. Tasks then append their entry with append_manifest.
+    manifest_path = Path(state_path, MANIFEST_FILENAME)
+    tmp_path = Path(state_path, 'tmp_' + MANIFEST_FILENAME)
+    with open(tmp_path, 'w') as f:
+        for e in manifest:
+            f.write(json.dumps(e) + '\n')
+    tmp_path.replace(manifest_path)
+
+def append_manifest(entries, state_path):
+    with open(Path(state_path, MANIFEST_FILENAME), 'a') as f:
+        for e in entries:
+            f.write(json.dumps(e) + '\n')
+
+def _is_saved(state, k):
+    return isinstance(state._internal_state[k], LazyValue) or (k in state._loaded_handles)
+
+def find_resume_point(state, tasks, manifest, fps, rerun_tasks=None, max_done=None):
+    #Returns how many leading tasks can be skipped: same task, same bindings, same inputs and cached outputs.
+    #At most max_done tasks are skipped.
+    entries = {e['index']: e for e in manifest}
+    max_done = len(tasks) if max_done is None else min(max_done, len(tasks))
+    #Outputs of the tasks skipped so far, fps gets them once the resume point is final
+    outputs = {}
+    n = 0
+    while n < max_done:
+        t = tasks[n]
+        entry = entries.get(n)
+        if (entry is None) or (entry['task'] != t.__name__):
+            break
+        if (rerun_tasks is not None) and (t.__name__ in rerun_tasks):
+            logger.info('{} is in rerun_tasks, resuming from it'.format(t.__name__))
+            break
+        if entry['bindings'] != task_bindings(t):
+            logger.info('Bindings of {} changed, resuming from it'.format(t.__name__))
+            break
+        changed_inputs = [k for k, v in entry['inputs'].items() if (v is None) or ((outputs[k] if k in outputs else fps[k]) != v)]
+        if len(changed_inputs) > 0:
+            logger.info('Inputs {} of {} changed, resuming from it'.format(changed_inputs, t.__name__))
+            break
+        if any(k not in state for k in entry['outputs']):
+            break
+        outputs.update(entry['outputs'])
+        n += 1
+    #Saved values are the last ones written. If a task after the resume point overwrote a key, the value the key
+    #had at the resume point is lost, so the task that wrote that value runs again.
+    while n > 0:
+        writers = {}
+        for i in range(n):
+            for k, v in entries[i]['outputs'].items():
+                writers[k] = (i, v)
+        overwritten = {k: i for k, (i, v) in writers.items() if _is_saved(state, k) and (state_fingerprint(state, k) != v)}
+        if len(overwritten) == 0:
+            break
+        n = min(overwritten.values())
+        logger.info('{} changed after {} ran, resuming from it'.format(sorted([k for k, i in overwritten.items() if i == n]), tasks[n].__name__))
+    #Keys only written after the resume point don't exist yet at it
+    written = set([k for i in range(n) for k in entries[i]['outputs']])
+    for k in sorted(set([k for e in manifest if e['index'] >= n for k in e['outputs']]) - written):
+        if (k in state) and _is_saved(state, k):
+            logger.debug('Dropping {}, it is written after the resume point'.format(k))
+            state._internal_state.pop(k)
+            state._loaded_handles.pop(k, None)
+            fps.fps.pop(k, None)
+    for i in range(n):
+        fps.update(entries[i]['outputs'])
+    return n
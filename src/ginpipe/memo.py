@@ -0,0 +1,111 @@
+import gin
+import inspect
+import json
+import os
+from pathlib import Path
+from loguru import logger
+from .manifest import fingerprint, task_bindings
+from .compression import import_joblib
+
+def code_version(t):
+    if hasattr(t, '_ginpipe_stages'):
+        return fingerprint([code_version(s) for s in t._ginpipe_stages])
+    fn = inspect.unwrap(t)
+    try:
+        return fingerprint(inspect.getsource(fn))
+    except (OSError, TypeError):
+        return fingerprint(getattr(getattr(fn, '__code__', None), 'co_code', None))
+
+@gin.configurable
+class TaskCache:
+    #Content-addressed cache of task outputs shared between experiments:
+    #   execute_pipeline.task_cache = @TaskCache()
+    #   TaskCache.cache_dir = '/scratch/ginpipe_cache'
+    #   TaskCache.max_size = 100e9
+    #Entries are keyed on the task bindings (with those of the configurables it calls, see called_configurables),
+    #its source code and the fingerprints of the state keys it reads. Tasks in execute_pipeline.rerun_tasks are
+    #always run, for changes that aren't part of the key.
+    #The least recently used entries are evicted when the cache grows over max_size bytes.
+    def __init__(self, cache_dir='~/.cache/ginpipe/tasks', max_size=None):
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.max_size = max_size
+        Path(self.cache_dir, 'index').mkdir(parents=True, exist_ok=True)
+        Path(self.cache_dir, 'entries').mkdir(parents=True, exist_ok=True)
+
+    def signature(self, t):
+        return fingerprint({'task': '{}.{}'.format(t.__module__, t.__name__),
+                            'bindings': task_bindings(t),
+                            'code': code_version(t)})
+
+    def _entry_key(self, sig, reads, fps):
+        inputs = {k: fps[k] for k in sorted(reads)}
+        if any(v is None for v in inputs.values()):
+            return None
+        return fingerprint({'signature': sig, 'inputs': inputs})
+
+    def _known_reads(self, sig):
+        index_path = Path(self.cache_dir, 'index', '{}.json'.format(sig))
+        if not index_path.exists():
+            return []
+        with open(index_path, 'r') as f:
+            return json.load(f)
+
+    def lookup(self, t, fps):
+        #Returns (reads, outputs) of a previous execution with the same signature and inputs, or None.
+        sig = self.signature(t)
+        for reads in self._known_reads(sig):
+            key = self._entry_key(sig, reads, fps)
+            entry_path = Path(self.cache_dir, 'entries', '{}.pkl'.format(key))
+            if (key is None) or (not entry_path.exists()):
+                continue
+            try:
+                outputs = import_joblib().load(entry_path)
+                os.utime(entry_path)
+            except (OSError, EOFError):
+                #Evicted or being replaced by another process
+                continue
+            return set(reads), outputs
+        return None
+
+    def store(self, t, reads, outputs, fps):
+        sig = self.signature(t)
+        key = self._entry_key(sig, reads, fps)
+        if key is None:
+            logger.warning('Outputs of {} not cached: some of its inputs can not be hashed'.format(t.__name__))
+            return
+        entry_path = Path(self.cache_dir, 'entries', '{}.pkl'.format(key))
+        tmp_path = Path(self.cache_dir, 'entries', 'tmp_{}_{}.pkl'.format(key, os.getpid()))
+        import_joblib().dump(outputs, tmp_path)
+        tmp_path.replace(entry_path)
+        known_reads = self._known_reads(sig)
+        if sorted(reads) not in known_reads:
+            known_reads.append(sorted(reads))
+            index_path = Path(self.cache_dir, 'index', '{}.json'.format(sig))
+            tmp_path = Path(self.cache_dir, 'index', 'tmp_{}_{}.json'.format(sig, os.getpid()))
+            with open(tmp_path, 'w') as f:
+                json.dump(known_reads, f)
+            tmp_path.replace(index_path)
+        self.evict()
+
+    def evict(self):
+        if self.max_size is None:
+            return
+        entries = []
+        for f in Path(self.cache_dir, 'entries').glob('*.pkl'):
+            if f.name.startswith('tmp_'):
+                continue
+            try:
+                stat = f.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, f))
+        total_size = sum([e[1] for e in entries])
+        for mtime, size, f in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            logger.debug('Evicting {} from task cache'.format(f.name))
+            try:
+                f.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= size
@@ -0,0 +1,73 @@
+#Evaluation of $(...) config operations, e.g. $(%N_LAYERS*2) or $(%SR/%HOP).
+#Expressions are parsed with ast and only numbers, arithmetic operators and parentheses are allowed.
+#Integer arithmetic is exact (fractions), so the results parse to the same values as sympy's: integers as ints
+#and anything else as a float rounded to 15 significant digits. Only the formatting differs, sympy pads the
+#digits and ginpipe doesn't, e.g. $(3/2) gives 1.5 instead of 1.50000000000000 and $(1e20) 1e+20 instead of
+#1.00000000000000e+20.
+import ast
+from fractions import Fraction
+from functools import lru_cache
+import operator
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+MAX_EXPONENT = 10000
+
+def _eval_node(node):
+    if isinstance(node, ast.Expression):
+        return _eval_node(node.body)
+    elif isinstance(node, ast.Constant) and (type(node.value) in [int, float]):
+        return Fraction(node.value) if isinstance(node.value, int) else node.value
+    elif isinstance(node, ast.BinOp) and (type(node.op) in BINARY_OPERATORS):
+        left = _eval_node(node.left)
+        right = _eval_node(node.right)
+        if isinstance(node.op, ast.Pow) and (abs(right) > MAX_EXPONENT):
+            raise ValueError('Exponent too large: {}'.format(right))
+        result = BINARY_OPERATORS[type(node.op)](left, right)
+        #Floor division of fractions gives an int
+        return Fraction(result) if isinstance(result, int) else result
+    elif isinstance(node, ast.UnaryOp) and (type(node.op) in UNARY_OPERATORS):
+        return UNARY_OPERATORS[type(node.op)](_eval_node(node.operand))
+    else:
+        raise ValueError('Unsupported expression: {}'.format(ast.dump(node)))
+
+def format_result(x):
+    if isinstance(x, Fraction) and (x.denominator == 1):
+        return str(x.numerator)
+    x = float(x)
+    if x.is_integer() and abs(x) < 1e15:
+        #Keep float operations as floats when they give round numbers, e.g. $(2.5*2) -> 5.0
+        return '{:.1f}'.format(x)
+    return '{:.15g}'.format(x)
+
+@lru_cache(maxsize=None)
+def evaluate_arithmetic(expr):
+    #sympy reads ^ as a power. Replacing it before parsing also gives it the precedence and associativity of **.
+    return format_result(_eval_node(ast.parse(expr.strip().replace('^', '**'), mode='eval')))
+
+def evaluate_sympy(expr):
+    from sympy import sympify
+    rexpr = sympify(expr)
+    if not rexpr.is_integer:
+        return str(rexpr.evalf())
+    else:
+        return str(rexpr)
+
+def evaluate_operation(expr, sympy_fallback=False):
+    try:
+        return evaluate_arithmetic(expr)
+    except (SyntaxError, ValueError, TypeError, ZeroDivisionError, OverflowError) as e:
+        if sympy_fallback:
+            return evaluate_sympy(expr)
+        raise Exception('Could not evaluate operation $({}): {}. Only numbers, macros and arithmetic operators are allowed, use --sympy_fallback to evaluate it with sympy'.format(expr, e))
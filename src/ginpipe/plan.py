@@ -0,0 +1,230 @@
+#ginpipe plan: parses a config like ginpipe run, but instead of running the pipeline reports which tasks would be
+#skipped (completed in the output dir or in the task cache) and which recomputed, with their expected wall time,
+#memory and I/O. Estimates are medians over the manifests, execution_times and profile.json of previous experiments.
+#   ginpipe plan config.gin --module_list modules --history experiments/other_project
+#The critical path is given for sequential execution and for the dag with and without a limit of workers.
+#Tasks reading outputs of a task reused from the task cache are counted as recomputed: the fingerprints of cached
+#outputs are only known by loading them, so the estimate errs on the long side.
+import argparse
+import datetime
+import json
+import os
+from pathlib import Path
+import statistics
+import gin
+from loguru import logger
+from .core import setup_gin, execute_pipeline
+from .dag import get_task_io, build_dependencies, BOOKKEEPING_KEYS
+from .logstore import LogIndex, JOURNAL_FILENAME, INDEX_FILENAME
+from .manifest import KeyFingerprints, load_manifest, find_resume_point
+from .profiling import PROFILE_FILENAME
+from .storage import list_saved_keys, default_backends
+from .stream import fuse_streams
+
+PROFILE_METRICS = ['peak_rss_mb', 'read_bytes', 'write_bytes', 'rchar', 'wchar']
+
+def history_dirs(output_dir, extra_dirs=()):
+    #Experiments of the same project (and sweeps inside it) plus the ones given with --history
+    dirs = set()
+    for root in [Path(output_dir).parent] + [Path(d) for d in extra_dirs]:
+        for pattern in ['*/state', '*/*/state', '*/' + PROFILE_FILENAME, '*/*/' + PROFILE_FILENAME]:
+            dirs.update([p.parent for p in root.glob(pattern)])
+    return sorted(dirs)
+
+def is_log(state_path):
+    return Path(state_path, JOURNAL_FILENAME).exists() or Path(state_path, INDEX_FILENAME).exists()
+
+def saved_key(state_path, k):
+    #Only reads: the experiment could be running
+    handles = LogIndex(state_path).handles() if is_log(state_path) else list_saved_keys(state_path, default_backends())
+    return handles[k].load() if k in handles else None
+
+def saved_manifest(state_path):
+    return LogIndex(state_path).manifest if is_log(state_path) else load_manifest(state_path)
+
+def task_name(times_key):
+    #execution_times keys are <task>_<n>, n counting repeated tasks
+    return times_key.rsplit('_', 1)[0]
+
+def load_history(dirs):
+    history = {}
+    for d in dirs:
+        manifest, execution_times = [], None
+        try:
+            if Path(d, 'state').exists():
+                manifest = saved_manifest(Path(d, 'state'))
+                execution_times = saved_key(Path(d, 'state'), 'execution_times')
+        except Exception as e:
+            logger.warning('Could not read execution times of {}: {}'.format(d, e))
+        #Manifest entries have the times of every completed task, also in killed runs. execution_times is only
+        #saved when the pipeline ends, it adds the save times.
+        timed = [e for e in manifest if 'wall_time' in e]
+        for e in timed:
+            history.setdefault(e['task'], {}).setdefault('wall_time', []).append(e['wall_time'])
+        for k, times in (execution_times or {}).items():
+            h = history.setdefault(task_name(k), {})
+            for m in ['save_time'] if len(timed) > 0 else ['wall_time', 'save_time']:
+                if m in times:
+                    h.setdefault(m, []).append(times[m])
+        if Path(d, PROFILE_FILENAME).exists():
+            with open(Path(d, PROFILE_FILENAME), 'r') as f:
+                records = json.load(f)['tasks']
+            for r in records:
+                h = history.setdefault(r['task'], {})
+                for m in PROFILE_METRICS:
+                    if m in r:
+                        h.setdefault(m, []).append(r[m])
+                #Runs with a profile also have a manifest and execution_times, only use the profile when those are missing
+                if (len(timed) == 0) and (not execution_times):
+                    h.setdefault('wall_time', []).append(r['wall_time'])
+                if not execution_times:
+                    h.setdefault('save_time', []).append(r['save_time'])
+    return history
+
+def estimate(history, name):
+    h = history.get(name, {})
+    est = {m: statistics.median(v) for m, v in h.items() if len(v) > 0}
+    est['samples'] = len(h.get('wall_time', []))
+    return est
+
+def cache_hit(task_cache, t, fps, known_keys):
+    #Like TaskCache.lookup, but without loading the outputs. Reads with unknown fingerprints can't hit.
+    sig = task_cache.signature(t)
+    for reads in task_cache._known_reads(sig):
+        key = task_cache._entry_key(sig, reads, {k: fps[k] if k in known_keys else None for k in reads})
+        if (key is not None) and Path(task_cache.cache_dir, 'entries', '{}.pkl'.format(key)).exists():
+            return True
+    return False
+
+def critical_path(deps, durations):
+    finish = []
+    for j, d in enumerate(durations):
+        finish.append(max([finish[i] for i in deps[j]], default=0) + d)
+    return max(finish, default=0)
+
+def simulate(deps, durations, workers):
+    #Same scheduling as run_dag: ready tasks start in order as soon as a worker is free
+    pending = list(range(len(durations)))
+    finish = {}
+    running = []
+    now = 0
+    while pending or running:
+        for j in [j for j in pending if all([i in finish and finish[i] <= now for i in deps[j]])]:
+            if len(running) >= workers:
+                break
+            pending.remove(j)
+            running.append(j)
+            finish[j] = now + durations[j]
+        if len(running) == 0:
+            break
+        now = min([finish[j] for j in running])
+        running = [j for j in running if finish[j] > now]
+    return max(finish.values(), default=0)
+
+def make_plan(state, history):
+    bindings = gin.get_bindings(execute_pipeline)
+    tasks = fuse_streams(bindings.get('tasks', []), bindings.get('stream_queue_size', 8))
+    checkpoint_store = bindings.get('checkpoint_store')
+    task_cache = bindings.get('task_cache')
+    state_path = Path(state.output_dir, 'state')
+    #Same resume logic as execute_pipeline, without loading any value
+    fps = KeyFingerprints(state)
+    initial_keys = [k for k in state.keys() if k not in BOOKKEEPING_KEYS]
+    manifest = []
+    if Path(state.output_dir, 'state.pkl').exists():
+        logger.warning('{} has a state.pkl, execute_pipeline loads it but recomputes every task'.format(state.output_dir))
+    elif state_path.exists() and bindings.get('cache', True):
+        #The checkpoint log is read with a LogIndex, opening it would truncate the journal of a running experiment
+        log = LogIndex(state_path) if checkpoint_store is not None else None
+        handles = list_saved_keys(state_path, bindings.get('storage_backends') or default_backends()) if log is None else log.handles()
+        for k, handle in handles.items():
+            if (k not in state) and (k != 'execution_times'):
+                state.register_lazy(k, handle)
+        manifest = load_manifest(state_path) if log is None else log.manifest
+    n_done = find_resume_point(state, tasks, manifest, fps, bindings.get('rerun_tasks'))
+    #Fingerprints known without running anything: initial keys and outputs of completed tasks
+    known_keys = set(initial_keys + [k for e in manifest if e['index'] < n_done for k in e['outputs']])
+    task_io = bindings.get('task_io')
+    rows = []
+    for i, t in enumerate(tasks):
+        est = estimate(history, t.__name__)
+        if i < n_done:
+            action = 'skip'
+        elif (task_cache is not None) and (t.__name__ not in (bindings.get('rerun_tasks') or [])) and cache_hit(task_cache, t, fps, known_keys):
+            action = 'cached'
+        else:
+            action = 'run'
+        #Reusing or skipping takes no task time, but cached outputs are still saved
+        duration = est.get('wall_time', 0) if action == 'run' else 0
+        save_time = est.get('save_time', 0) if action != 'skip' else 0
+        rows.append({'index': i, 'task': t.__name__, 'action': action, 'expected_time': duration + save_time,
+                     'estimate': est, 'io': get_task_io(t, state, task_io)})
+    durations = [r['expected_time'] for r in rows]
+    deps = build_dependencies([r['io'] for r in rows])
+    max_workers = bindings.get('max_workers') or min(32, (os.cpu_count() or 1) + 4)
+    for r in rows:
+        r['io'] = {k: sorted(v) for k, v in r['io'].items()} if r['io'] is not None else None
+    return {'output_dir': str(state.output_dir),
+            'execution_order': bindings.get('execution_order', 'sequential'),
+            'tasks': rows,
+            'n_skipped': len([r for r in rows if r['action'] != 'run']),
+            'no_history': [r['task'] for r in rows if (r['action'] == 'run') and (r['estimate']['samples'] == 0)],
+            'sequential_time': sum(durations),
+            'dag_critical_path': critical_path(deps, durations),
+            'dag_time': simulate(deps, durations, max_workers),
+            'max_workers': max_workers}
+
+def format_size(n):
+    if n is None:
+        return '-'
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(n) < 1024:
+            return '{:.0f}{}'.format(n, unit)
+        n /= 1024
+    return '{:.0f}TB'.format(n)
+
+def format_time(t):
+    if t < 60:
+        return '{:.1f}s'.format(t)
+    return str(datetime.timedelta(seconds=round(t)))
+
+def format_plan(plan):
+    lines = ['Plan for {} ({})'.format(plan['output_dir'], plan['execution_order']),
+             '{:<4}{:<40}{:<8}{:>12}{:>9}{:>11}{:>10}{:>10}'.format('#', 'task', 'action', 'time', 'samples', 'peak_rss', 'read', 'written')]
+    for r in plan['tasks']:
+        est = r['estimate']
+        time_str = format_time(r['expected_time']) if (r['action'] != 'run') or (est['samples'] > 0) else '?'
+        rss = '{:.0f}MB'.format(est['peak_rss_mb']) if 'peak_rss_mb' in est else '-'
+        lines.append('{:<4}{:<40}{:<8}{:>12}{:>9}{:>11}{:>10}{:>10}'.format(r['index'], r['task'][:39], r['action'], time_str,
+                     est['samples'], rss, format_size(est.get('read_bytes')), format_size(est.get('write_bytes'))))
+    lines.append('{} of {} tasks skipped or reused from the task cache'.format(plan['n_skipped'], len(plan['tasks'])))
+    lines.append('Sequential: {}'.format(format_time(plan['sequential_time'])))
+    lines.append('Dag: {} with {} workers, critical path {}'.format(format_time(plan['dag_time']), plan['max_workers'], format_time(plan['dag_critical_path'])))
+    if len(plan['no_history']) > 0:
+        lines.append('No previous executions of {}, counted as 0s'.format(', '.join(plan['no_history'])))
+    return '\n'.join(lines)
+
+def main(args=None):
+    argparser = argparse.ArgumentParser(prog='ginpipe plan', description='Show which tasks of a pipeline would run and how long they would take')
+    argparser.add_argument('config_path', nargs='+', default=[], help='Path to gin config files')
+    argparser.add_argument('--experiment_name', type=str, default=datetime.datetime.now().strftime('%y-%d-%m-%H%M%S'),
+                           help='Name of the experiment to plan (its output dir is checked for completed tasks)')
+    argparser.add_argument('--project_name', type=str, default='my_project')
+    argparser.add_argument('--mods', dest='mods', nargs='+', default=[])
+    argparser.add_argument('--module_list', dest='module_list', nargs='+', default=[])
+    argparser.add_argument('--eager_externals', action='store_true')
+    argparser.add_argument('--no_config_cache', dest='config_cache', action='store_false')
+    argparser.add_argument('--sympy_fallback', action='store_true')
+    argparser.add_argument('--history', nargs='+', default=[], help='More directories with previous experiments to estimate times from')
+    argparser.add_argument('--output', type=str, default=None, help='Path to write the plan as JSON')
+    flags = vars(argparser.parse_args(args))
+    extra_history = flags.pop('history')
+    output = flags.pop('output')
+    state = setup_gin(flags, save_config=False)
+    dirs = [d for d in history_dirs(state.output_dir, extra_history) if d.resolve() != Path(state.output_dir).resolve()] + [Path(state.output_dir)]
+    history = load_history(dirs)
+    plan = make_plan(state, history)
+    print(format_plan(plan))
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(plan, f, indent=2)
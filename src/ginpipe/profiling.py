@@ -0,0 +1,229 @@
+#Per task instrumentation. Enabled by giving execute_pipeline a list of instruments:
+#   execute_pipeline.instruments = [@ResourceInstrument(), @TracemallocInstrument(), @CProfileInstrument()]
+#Each instrument measures a task between start and stop and returns a dict of metrics. At the end of the pipeline
+#OUTPUT_DIR/profile.json has the metrics of every task, and OUTPUT_DIR/trace.json the timeline of tasks and
+#state saves, which can be opened in chrome://tracing or https://ui.perfetto.dev
+#RSS, I/O and tracemalloc are per process, so with the thread executor they include concurrently running tasks.
+from contextlib import contextmanager
+import gin
+import json
+import os
+from pathlib import Path
+import resource
+import sys
+import threading
+import time
+
+PROFILE_FILENAME = 'profile.json'
+TRACE_FILENAME = 'trace.json'
+
+_active_profiler = None
+
+def _read_proc_io():
+    #Per thread counters when available. read_bytes and write_bytes are what actually hit the disk.
+    for path in ['/proc/thread-self/io', '/proc/self/io']:
+        try:
+            with open(path, 'r') as f:
+                counters = dict([l.split(':') for l in f.read().splitlines() if ':' in l])
+            return {k: int(v) for k, v in counters.items()}
+        except OSError:
+            continue
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {'read_bytes': usage.ru_inblock*512, 'write_bytes': usage.ru_oublock*512}
+
+def _current_rss():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+def _peak_rss():
+    #ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak*1024
+
+@gin.configurable
+class ResourceInstrument:
+    #Peak and current RSS of the process, and bytes read and written while the task ran
+    def start(self, index, name, output_dir):
+        return _read_proc_io()
+
+    def stop(self, io_start):
+        io_end = _read_proc_io()
+        metrics = {'peak_rss_mb': _peak_rss()/1e6}
+        rss = _current_rss()
+        if rss is not None:
+            metrics['rss_mb'] = rss/1e6
+        for k in ['read_bytes', 'write_bytes', 'rchar', 'wchar']:
+            if (k in io_end) and (k in io_start):
+                metrics[k] = io_end[k] - io_start[k]
+        return metrics
+
+@gin.configurable
+class TracemallocInstrument:
+    #Peak memory allocated by Python during the task and the top allocation sites still alive at its end.
+    #tracemalloc slows down allocations considerably. It traces the whole process, so it is started once per
+    #pipeline, and the peak is only reported for tasks that ran alone (not with other tasks of the thread executor).
+    def __init__(self, top=10, frames=1):
+        self.top = top
+        self.frames = frames
+        self.started = False
+        self.lock = threading.Lock()
+        self.running = []
+
+    def begin(self):
+        import tracemalloc
+        self.started = not tracemalloc.is_tracing()
+        if self.started:
+            tracemalloc.start(self.frames)
+
+    def end(self):
+        import tracemalloc
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
+
+    def start(self, index, name, output_dir):
+        import tracemalloc
+        with self.lock:
+            for other in self.running:
+                other['alone'] = False
+            token = {'alone': len(self.running) == 0}
+            if token['alone']:
+                tracemalloc.reset_peak()
+            token['size_start'] = tracemalloc.get_traced_memory()[0]
+            self.running.append(token)
+        return token
+
+    def stop(self, token):
+        import tracemalloc
+        with self.lock:
+            self.running.remove(token)
+            current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)])
+        stats = snapshot.statistics('lineno')[:self.top]
+        metrics = {'traced_growth_mb': (current - token['size_start'])/1e6,
+                   'top_allocations': [{'where': str(s.traceback[0]), 'size_mb': s.size/1e6, 'count': s.count} for s in stats]}
+        if token['alone']:
+            metrics['traced_peak_mb'] = (peak - token['size_start'])/1e6
+        return metrics
+
+@gin.configurable
+class CProfileInstrument:
+    #Dumps OUTPUT_DIR/profiles/<index>_<task>.prof, e.g. for snakeviz or pstats. Only the thread running the task is profiled.
+    def start(self, index, name, output_dir):
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler, Path(output_dir, 'profiles', '{}_{}.prof'.format(index, name))
+
+    def stop(self, token):
+        profiler, path = token
+        profiler.disable()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(path)
+        return {'cprofile': str(path)}
+
+@gin.configurable
+class PyinstrumentInstrument:
+    #Writes a pyinstrument html report to OUTPUT_DIR/profiles/<index>_<task>.html
+    def __init__(self, interval=0.001):
+        self.interval = interval
+
+    def start(self, index, name, output_dir):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise Exception('PyinstrumentInstrument requires pyinstrument: pip install pyinstrument')
+        profiler = Profiler(interval=self.interval)
+        profiler.start()
+        return profiler, Path(output_dir, 'profiles', '{}_{}.html'.format(index, name))
+
+    def stop(self, token):
+        profiler, path = token
+        profiler.stop()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(profiler.output_html())
+        return {'pyinstrument': str(path)}
+
+class Profiler:
+    #Instruments can also have begin() and end(), called once when the pipeline starts and ends
+    def __init__(self, instruments, output_dir):
+        self.instruments = instruments
+        self.output_dir = output_dir
+        self.records = []
+        self.start_time = time.time()
+        for ins in self.instruments:
+            if hasattr(ins, 'begin'):
+                ins.begin()
+
+    def close(self):
+        for ins in self.instruments:
+            if hasattr(ins, 'end'):
+                ins.end()
+
+    @contextmanager
+    def task(self, index, name):
+        #Yields the dict where the metrics of the task are left
+        metrics = {'start': time.time(), 'pid': os.getpid(), 'thread': threading.current_thread().name}
+        tokens = [ins.start(index, name, self.output_dir) for ins in self.instruments]
+        try:
+            yield metrics
+        finally:
+            for ins, token in reversed(list(zip(self.instruments, tokens))):
+                metrics.update(ins.stop(token))
+
+    def record(self, index, name, wall_time, process_time, save_start, save_time, metrics=None):
+        metrics = dict(metrics) if metrics is not None else {}
+        record = {'index': index, 'task': name, 'wall_time': wall_time, 'process_time': process_time,
+                  'save_time': save_time, 'save_start': save_start}
+        record['start'] = metrics.pop('start', save_start - wall_time)
+        record.update(metrics)
+        self.records.append(record)
+
+    def trace_events(self):
+        main_pid = os.getpid()
+        thread_ids = {}
+        events = []
+        for r in self.records:
+            tid = thread_ids.setdefault((r.get('pid', main_pid), r.get('thread', 'MainThread')), len(thread_ids))
+            args = {k: v for k, v in r.items() if k not in ['task', 'start', 'save_start', 'pid', 'thread', 'top_allocations']}
+            events.append({'name': r['task'], 'cat': 'task', 'ph': 'X', 'pid': r.get('pid', main_pid), 'tid': tid,
+                           'ts': (r['start'] - self.start_time)*1e6, 'dur': r['wall_time']*1e6, 'args': args})
+            #Saves always happen in the main process, after the task
+            save_tid = thread_ids.setdefault((main_pid, 'MainThread'), len(thread_ids))
+            events.append({'name': 'save_state', 'cat': 'save', 'ph': 'X', 'pid': main_pid, 'tid': save_tid,
+                           'ts': (r['save_start'] - self.start_time)*1e6, 'dur': r['save_time']*1e6, 'args': {'task': r['task']}})
+        for (pid, thread), tid in thread_ids.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread}})
+        return events
+
+    def save(self):
+        Path(self.output_dir).mkdir(parents=True, exist_ok=True)
+        report = {'total_time': time.time() - self.start_time,
+                  'task_time': sum([r['wall_time'] for r in self.records]),
+                  'save_time': sum([r['save_time'] for r in self.records]),
+                  'tasks': self.records}
+        with open(Path(self.output_dir, PROFILE_FILENAME), 'w') as f:
+            json.dump(report, f, indent=2)
+        with open(Path(self.output_dir, TRACE_FILENAME), 'w') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, f)
+        return report
+
+def set_profiler(profiler):
+    global _active_profiler
+    _active_profiler = profiler
+
+def get_profiler():
+    return _active_profiler
+
+@contextmanager
+def profile_task(index, name):
+    #Metrics of the task if profiling is enabled, otherwise None
+    if _active_profiler is None:
+        yield None
+    else:
+        with _active_profiler.task(index, name) as metrics:
+            yield metrics
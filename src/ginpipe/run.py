@@ -1,8 +1,22 @@
-from .core import setup_gin, execute_pipeline
 import datetime
 import argparse
+import sys
 
 def main():
+    #Subcommands. ginpipe.core is imported after dispatching, so submit stays fast.
+    if (len(sys.argv) > 1) and (sys.argv[1] == 'sweep'):
+        from .sweep import main as sweep_main
+        sys.exit(sweep_main(sys.argv[2:]))
+    elif (len(sys.argv) > 1) and (sys.argv[1] == 'serve'):
+        from .serve import main as serve_main
+        sys.exit(serve_main(sys.argv[2:]))
+    elif (len(sys.argv) > 1) and (sys.argv[1] == 'plan'):
+        from .plan import main as plan_main
+        sys.exit(plan_main(sys.argv[2:]))
+    elif (len(sys.argv) > 1) and (sys.argv[1] == 'submit'):
+        from .submit import main as submit_main
+        sys.exit(submit_main(sys.argv[2:]))
+    from .core import setup_gin, execute_pipeline
     argparser = argparse.ArgumentParser(description='Execute arbitrary pipelines from gin configs')
     argparser.add_argument('config_path', nargs='+', default=[], help='Path to gin config files')
     argparser.add_argument('--experiment_name', type=str, default=datetime.datetime.now().strftime('%y-%d-%m-%H%M%S'),
@@ -12,6 +26,12 @@ def main():
     argparser.add_argument('--mods', dest='mods', nargs='+', default=[],
                            help='Modifications to config file')
     argparser.add_argument('--module_list', dest='module_list', nargs='+', default=[])
+    argparser.add_argument('--eager_externals', action='store_true',
+                           help='Import and register every module in the module list, even if the config does not reference it')
+    argparser.add_argument('--no_config_cache', dest='config_cache', action='store_false',
+                           help='Do not reuse the preprocessed config from previous runs')
+    argparser.add_argument('--sympy_fallback', action='store_true',
+                           help='Evaluate $(...) operations that are not plain arithmetic with sympy')
     
     flags = vars(argparser.parse_args())
 
@@ -0,0 +1,127 @@
+#Long running daemon that keeps the module list imported and registered in gin:
+#   ginpipe serve --module_list modules --workers 2
+#   ginpipe submit config.gin --mods N=3
+#Workers are forked from the warm daemon before jobs arrive. Each one accepts a single connection on the socket,
+#runs the pipeline with its output redirected to the client and exits, and the daemon forks a new one.
+#Changes to the imported modules need a restart of the daemon.
+import argparse
+import json
+import os
+from pathlib import Path
+import signal
+import socket
+import sys
+import threading
+import traceback
+from loguru import logger
+from .core import WELCOME_MESSAGE, gin_configure_externals
+from .compression import import_joblib
+from .submit import DEFAULT_SOCKET, EXIT_MARKER
+from .sweep import run_experiment
+
+def open_socket(socket_path):
+    socket_path = Path(socket_path)
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    if socket_path.exists():
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(socket_path))
+            probe.close()
+            raise Exception('A daemon is already listening on {}'.format(socket_path))
+        except ConnectionRefusedError:
+            #Left by a daemon that didn't exit cleanly
+            socket_path.unlink()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(socket_path))
+    #Submitted configs run arbitrary code, only the owner can connect
+    os.chmod(socket_path, 0o600)
+    server.listen()
+    return server
+
+def _stop_on_disconnect(conn):
+    #The client sends nothing after the request, so recv returns when it disconnects
+    try:
+        conn.recv(1)
+    except OSError:
+        pass
+    os.kill(os.getpid(), signal.SIGTERM)
+
+def run_job(conn, lib_versions):
+    with conn.makefile('rb') as f:
+        request = json.loads(f.readline())
+    #Everything the job prints, including loguru and subprocesses, goes to the client
+    sys.stdout.flush()
+    sys.stderr.flush()
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(conn.fileno(), 1)
+    os.dup2(conn.fileno(), 2)
+    threading.Thread(target=_stop_on_disconnect, args=(conn,), daemon=True).start()
+    os.chdir(request.pop('cwd'))
+    os.environ.clear()
+    os.environ.update(request.pop('env'))
+    flags = dict(request, module_list=[])
+    result = run_experiment(flags, lib_versions, [])
+    sys.stdout.flush()
+    sys.stderr.flush()
+    conn.sendall(EXIT_MARKER + '{}\n'.format(0 if result['status'] == 'ok' else 1).encode())
+    conn.close()
+
+def worker(server, lib_versions):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    conn, _ = server.accept()
+    server.close()
+    try:
+        run_job(conn, lib_versions)
+    except Exception:
+        traceback.print_exc()
+        sys.stderr.flush()
+    finally:
+        os._exit(0)
+
+def fork_worker(server, lib_versions):
+    pid = os.fork()
+    if pid == 0:
+        worker(server, lib_versions)
+    return pid
+
+def serve(flags, socket_path=DEFAULT_SOCKET, n_workers=2):
+    #Every module is imported, as the configs that will be submitted are not known yet
+    lib_versions = gin_configure_externals(dict(flags, eager_externals=True))
+    import_joblib()
+    server = open_socket(socket_path)
+    logger.info('Listening on {} with {} workers'.format(socket_path, n_workers))
+    workers = set([fork_worker(server, lib_versions) for _ in range(n_workers)])
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while True:
+            pid, status = os.wait()
+            if pid in workers:
+                workers.remove(pid)
+                logger.info('Worker {} finished'.format(pid))
+                workers.add(fork_worker(server, lib_versions))
+    except KeyboardInterrupt:
+        logger.info('Stopping daemon')
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        server.close()
+        Path(socket_path).unlink(missing_ok=True)
+
+def main(args=None):
+    argparser = argparse.ArgumentParser(prog='ginpipe serve', description='Keep pipeline modules imported and run pipelines submitted with ginpipe submit')
+    argparser.add_argument('--module_list', dest='module_list', nargs='+', default=[])
+    argparser.add_argument('--socket', type=str, default=str(DEFAULT_SOCKET), help='Path of the Unix socket to listen on')
+    argparser.add_argument('--workers', type=int, default=2, help='Number of jobs that can run at the same time')
+    flags = vars(argparser.parse_args(args))
+    socket_path = flags.pop('socket')
+    n_workers = flags.pop('workers')
+    logger.log('INTRO', WELCOME_MESSAGE)
+    serve(flags, socket_path, n_workers)
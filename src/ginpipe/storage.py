@@ -0,0 +1,190 @@
+import gin
+import json
+from pathlib import Path
+import shutil
+import sys
+from .compression import joblib_compress, parse_codec, import_joblib
+
+TMP_PREFIX = 'tmp_'
+#Each line has the fingerprints of the keys saved together, so saving a key appends a line instead of rewriting them all
+FINGERPRINTS_FILENAME = 'fingerprints.jsonl'
+
+@gin.configurable
+class JoblibBackend:
+    #Fallback for arbitrary objects
+    suffix = '.pkl'
+    compressible = True
+
+    def accepts(self, v):
+        return True
+
+    def dump(self, v, path, codec=None):
+        import_joblib().dump(v, path, compress=joblib_compress(codec))
+
+    def load(self, path):
+        return import_joblib().load(path)
+
+@gin.configurable
+class NumpyBackend:
+    #Stores arrays as raw .npy files (data aligned to 64 bytes) and loads them memory-mapped, without copying.
+    #mmap_mode='r' gives read-only arrays, use 'c' for copy-on-write arrays that tasks can modify in memory.
+    suffix = '.npy'
+    #Compressed arrays can't be memory-mapped, so keys with a codec go to other backends
+    compressible = False
+
+    def __init__(self, min_size=1024*1024, mmap_mode='r'):
+        self.min_size = min_size
+        self.mmap_mode = mmap_mode
+
+    def accepts(self, v):
+        #If numpy was never imported, v can't be an array
+        np = sys.modules.get('numpy')
+        return (np is not None) and isinstance(v, np.ndarray) and (not v.dtype.hasobject) and (v.nbytes >= self.min_size)
+
+    def dump(self, v, path, codec=None):
+        import numpy as np
+        with open(path, 'wb') as f:
+            np.save(f, v, allow_pickle=False)
+
+    def load(self, path):
+        import numpy as np
+        return np.load(path, mmap_mode=self.mmap_mode, allow_pickle=False)
+
+@gin.configurable
+class ChunkedBackend:
+    #Stores large lists and dicts as fixed-size chunks of items, content-addressed under chunks/<key>/.
+    #A value that grows by appending only writes its last chunk and the new ones.
+    suffix = '.chunks'
+    compressible = True
+
+    def __init__(self, min_items=10000, chunk_size=1000):
+        self.min_items = min_items
+        self.chunk_size = chunk_size
+
+    def accepts(self, v):
+        return (type(v) in [list, dict]) and (len(v) >= self.min_items)
+
+    def _chunk_dir(self, path):
+        #save_value dumps to tmp_<key><suffix> before publishing it as <key><suffix>
+        name = path.name[:-len(self.suffix)]
+        if name.startswith(TMP_PREFIX):
+            name = name[len(TMP_PREFIX):]
+        return Path(path.parent, 'chunks', name)
+
+    def _read_chunk_list(self, path):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def dump(self, v, path, codec=None):
+        joblib = import_joblib()
+        chunk_dir = self._chunk_dir(path)
+        chunk_dir.mkdir(parents=True, exist_ok=True)
+        published_path = Path(path.parent, chunk_dir.name + self.suffix)
+        published = self._read_chunk_list(published_path) if published_path.exists() else None
+        #Existing chunks are only reused if they were written with the same codec
+        reuse = (published is not None) and (published.get('codec') == codec)
+        items = list(v.items()) if isinstance(v, dict) else v
+        chunk_hashes = []
+        for i in range(0, len(items), self.chunk_size):
+            chunk = items[i:i+self.chunk_size]
+            chunk_hash = joblib.hash(chunk)
+            chunk_path = Path(chunk_dir, chunk_hash + '.pkl')
+            if (not chunk_path.exists()) or (not reuse):
+                chunk_tmp_path = Path(chunk_dir, TMP_PREFIX + chunk_hash + '.pkl')
+                joblib.dump(chunk, chunk_tmp_path, compress=joblib_compress(codec))
+                chunk_tmp_path.replace(chunk_path)
+            chunk_hashes.append(chunk_hash)
+        #Chunks are only deleted once no longer referenced by the published version, so a crash
+        #before the rename leaves a loadable value
+        referenced = set(chunk_hashes)
+        if published is not None:
+            referenced.update(published['chunks'])
+        for f in chunk_dir.glob('*.pkl'):
+            if f.stem not in referenced:
+                f.unlink()
+        with open(path, 'w') as f:
+            json.dump({'type': type(v).__name__, 'codec': codec, 'chunks': chunk_hashes}, f)
+
+    def load(self, path):
+        joblib = import_joblib()
+        chunk_list = self._read_chunk_list(path)
+        chunk_dir = Path(path.parent, 'chunks', path.name[:-len(self.suffix)])
+        items = []
+        for chunk_hash in chunk_list['chunks']:
+            items.extend(joblib.load(Path(chunk_dir, chunk_hash + '.pkl')))
+        return dict(items) if chunk_list['type'] == 'dict' else items
+
+    def remove(self, output_path, k):
+        Path(output_path, k + self.suffix).unlink(missing_ok=True)
+        shutil.rmtree(Path(output_path, 'chunks', k), ignore_errors=True)
+
+def default_backends():
+    return [NumpyBackend(), ChunkedBackend(), JoblibBackend()]
+
+class LazyValue:
+    #Handle to a state key saved on disk. It is deserialized the first time the key is accessed.
+    #fp is the fingerprint it was saved with, if known.
+    def __init__(self, path, backend=None, fp=None):
+        self.path = Path(path)
+        self.backend = backend if backend is not None else JoblibBackend()
+        self.size = self.path.stat().st_size
+        self.fp = fp
+
+    def load(self):
+        return self.backend.load(self.path)
+
+    def __repr__(self):
+        return 'LazyValue({})'.format(self.path)
+
+def save_value(k, v, output_path, backends, codec=None):
+    candidates = backends
+    if parse_codec(codec)[0] != 'none':
+        candidates = [b for b in backends if getattr(b, 'compressible', False)]
+    backend = [b for b in candidates if b.accepts(v)][0]
+    k_out_path = Path(output_path, k + backend.suffix)
+    k_temp_path = Path(output_path, TMP_PREFIX + k + backend.suffix)
+    backend.dump(v, k_temp_path, codec)
+    k_temp_path.replace(k_out_path)
+    #The key could have been saved by another backend before
+    for b in backends:
+        if b.suffix == backend.suffix:
+            continue
+        if hasattr(b, 'remove'):
+            b.remove(output_path, k)
+        else:
+            Path(output_path, k + b.suffix).unlink(missing_ok=True)
+
+def list_saved_keys(state_path, backends):
+    saved_keys = {}
+    fingerprints = load_fingerprints(state_path)
+    for b in backends:
+        for f in Path(state_path).glob('*' + b.suffix):
+            if not f.name.startswith(TMP_PREFIX):
+                k = f.name[:-len(b.suffix)]
+                saved_keys[k] = LazyValue(f, b, fingerprints.get(k))
+    return saved_keys
+
+def load_fingerprints(state_path):
+    fingerprints_path = Path(state_path, FINGERPRINTS_FILENAME)
+    if not fingerprints_path.exists():
+        return {}
+    fingerprints = {}
+    with open(fingerprints_path, 'r') as f:
+        for line in f:
+            #Later lines are newer. A partial last line only makes its keys be saved again.
+            try:
+                fingerprints.update(json.loads(line))
+            except ValueError:
+                break
+    return fingerprints
+
+def save_fingerprints(fingerprints, state_path):
+    #Replaces the file by a single line, when a pipeline starts
+    tmp_path = Path(state_path, TMP_PREFIX + FINGERPRINTS_FILENAME)
+    with open(tmp_path, 'w') as f:
+        f.write(json.dumps(fingerprints) + '\n')
+    tmp_path.replace(Path(state_path, FINGERPRINTS_FILENAME))
+
+def append_fingerprints(fingerprints, state_path):
+    with open(Path(state_path, FINGERPRINTS_FILENAME), 'a') as f:
+        f.write(json.dumps(fingerprints) + '\n')
@@ -0,0 +1,135 @@
+#Streaming tasks: consecutive streaming tasks in a pipeline are fused into a single task where chunks (records,
+#batches, files...) flow between them through bounded queues, so only the final result goes to the state.
+#   @stream_source()
+#   def read_lines(state):
+#       with open(state.flags['data']) as f:
+#           yield from f
+#   @stream_map()
+#   def tokenize(state, line):
+#       return line.split()
+#   @stream_sink(writes=['vocab_size'])
+#   def count(state, chunks):
+#       state['vocab_size'] = len(set(w for words in chunks for w in words))
+#   execute_pipeline.tasks = [@read_lines, @tokenize, @count]
+#A stream_map written as a generator receives the iterator of chunks instead of one chunk, so it can filter,
+#batch or keep state between chunks. Every stage runs in its own thread and blocks when the next one is
+#queue_size chunks behind.
+import inspect
+import queue
+import threading
+
+STREAM_ROLES = ['source', 'map', 'sink']
+_END = object()
+_ERROR = object()
+
+def _stream_role(role, reads=None, writes=None):
+    def decorator(fn):
+        fn._ginpipe_stream = role
+        fn._ginpipe_stream_io = {'reads': set(reads or []), 'writes': None if writes is None else set(writes)}
+        return fn
+    return decorator
+
+def stream_source(reads=None):
+    #fn(state) returns an iterable of chunks
+    return _stream_role('source', reads)
+
+def stream_map(reads=None):
+    #fn(state, chunk) returns the transformed chunk. Generators get fn(state, chunks) and yield chunks.
+    return _stream_role('map', reads)
+
+def stream_sink(reads=None, writes=None):
+    #fn(state, chunks) consumes the chunks and writes its result to the state
+    return _stream_role('sink', reads, writes)
+
+def _map_chunks(stage, state, chunks):
+    if inspect.isgeneratorfunction(inspect.unwrap(stage)):
+        yield from stage(state, chunks)
+    else:
+        for c in chunks:
+            yield stage(state, c)
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _feed(chunks, q, stop):
+    #Runs a stage in its own thread. Errors are passed downstream and raised by the sink.
+    try:
+        for c in chunks:
+            if not _put(q, (None, c), stop):
+                return
+        _put(q, (_END, None), stop)
+    except BaseException as e:
+        _put(q, (_ERROR, e), stop)
+
+def _drain(q, stop):
+    while not stop.is_set():
+        try:
+            kind, c = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if kind is _END:
+            return
+        elif kind is _ERROR:
+            raise c
+        yield c
+
+def run_stream(state, stages, queue_size=8):
+    stop = threading.Event()
+    threads = []
+    chunks = iter(stages[0](state))
+    try:
+        for stage in stages[1:]:
+            q = queue.Queue(maxsize=queue_size)
+            th = threading.Thread(target=_feed, args=(chunks, q, stop), daemon=True)
+            th.start()
+            threads.append(th)
+            chunks = _drain(q, stop)
+            if stage._ginpipe_stream == 'map':
+                chunks = _map_chunks(stage, state, chunks)
+        result = stages[-1](state, chunks)
+    finally:
+        #Stops upstream stages if the sink returned early or failed
+        stop.set()
+        for th in threads:
+            th.join(timeout=1)
+    return result if result is not None else state
+
+def fuse_stages(stages, queue_size):
+    def fused(state):
+        return run_stream(state, stages, queue_size)
+    fused.__name__ = '+'.join([s.__name__ for s in stages])
+    fused.__module__ = stages[-1].__module__
+    fused._ginpipe_stages = stages
+    writes = stages[-1]._ginpipe_stream_io['writes']
+    if writes is not None:
+        fused._ginpipe_io = {'reads': set().union(*[s._ginpipe_stream_io['reads'] for s in stages]), 'writes': writes}
+    return fused
+
+def fuse_streams(tasks, queue_size=8):
+    #Replaces every run of source, maps and sink in the task list by a single task
+    fused_tasks = []
+    stages = []
+    for t in tasks:
+        role = getattr(t, '_ginpipe_stream', None)
+        if role not in STREAM_ROLES + [None]:
+            raise Exception('Stream role not recognized: {}. The following values are allowed: {}'.format(role, STREAM_ROLES))
+        if (len(stages) > 0) and (role in [None, 'source']):
+            raise Exception('Stream starting at {} does not end in a stream_sink'.format(stages[0].__name__))
+        if (len(stages) == 0) and (role in ['map', 'sink']):
+            raise Exception('Streaming task {} is not preceded by a stream_source'.format(t.__name__))
+        if role is None:
+            fused_tasks.append(t)
+        elif role == 'sink':
+            fused_tasks.append(fuse_stages(stages + [t], queue_size))
+            stages = []
+        else:
+            stages.append(t)
+    if len(stages) > 0:
+        raise Exception('Stream starting at {} does not end in a stream_sink'.format(stages[0].__name__))
+    return fused_tasks
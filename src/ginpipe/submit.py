@@ -0,0 +1,70 @@
+#Client of `ginpipe serve`: sends a pipeline to the daemon and prints its output as it runs.
+#   ginpipe submit config.gin --mods N=3 --experiment_name eval
+#Only the standard library is imported, so submitting doesn't pay for importing gin or the pipeline modules.
+import argparse
+import datetime
+import json
+import os
+from pathlib import Path
+import socket
+import sys
+
+DEFAULT_SOCKET = Path(os.environ.get('GINPIPE_SOCKET', Path(os.environ.get('GINPIPE_CACHE_DIR', '~/.cache/ginpipe'), 'serve.sock'))).expanduser()
+#Last line written by the worker, with the exit code of the job
+EXIT_MARKER = b'\x00GINPIPE_EXIT '
+
+def submit(request, socket_path=DEFAULT_SOCKET, out=None):
+    #Returns the exit code of the job
+    out = out if out is not None else sys.stdout.buffer
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(str(socket_path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        raise Exception('Could not connect to {}. Start the daemon with: ginpipe serve --module_list ...'.format(socket_path))
+    conn.sendall(json.dumps(request).encode() + b'\n')
+    tail = b''
+    while True:
+        data = conn.recv(65536)
+        if not data:
+            break
+        data = tail + data
+        #Keep the end of the stream until we know it is not the exit marker
+        keep = len(EXIT_MARKER) + 8
+        out.write(data[:-keep])
+        out.flush()
+        tail = data[-keep:]
+    conn.close()
+    if EXIT_MARKER in tail:
+        tail, code = tail.split(EXIT_MARKER)
+        out.write(tail)
+        out.flush()
+        return int(code.strip())
+    out.write(tail)
+    out.flush()
+    return 1
+
+def main(args=None):
+    argparser = argparse.ArgumentParser(prog='ginpipe submit', description='Run a pipeline in a ginpipe serve daemon')
+    argparser.add_argument('config_path', nargs='+', default=[], help='Path to gin config files')
+    argparser.add_argument('--experiment_name', type=str, default=datetime.datetime.now().strftime('%y-%d-%m-%H%M%S'),
+                           help='Name for the experiment')
+    argparser.add_argument('--project_name', type=str,
+                           help='Name for the project', default='my_project')
+    argparser.add_argument('--mods', dest='mods', nargs='+', default=[],
+                           help='Modifications to config file')
+    argparser.add_argument('--no_config_cache', dest='config_cache', action='store_false',
+                           help='Do not reuse the preprocessed config from previous runs')
+    argparser.add_argument('--sympy_fallback', action='store_true',
+                           help='Evaluate $(...) operations that are not plain arithmetic with sympy')
+    argparser.add_argument('--socket', type=str, default=str(DEFAULT_SOCKET), help='Socket of the daemon')
+    flags = vars(argparser.parse_args(args))
+    socket_path = flags.pop('socket')
+    flags['config_path'] = [str(Path(c).resolve()) for c in flags['config_path']]
+    flags['cwd'] = os.getcwd()
+    #Jobs run with the environment of the client, e.g. CUDA_VISIBLE_DEVICES
+    flags['env'] = dict(os.environ)
+    try:
+        return submit(flags, socket_path)
+    except KeyboardInterrupt:
+        #Closing the connection stops the job
+        return 130
@@ -0,0 +1,315 @@
+#Runs many experiments of the same pipeline from one interpreter:
+#   ginpipe sweep config.gin --module_list modules --grid N=1,2,3 LR=0.1,0.01 --max_parallel 4
+#Modules are imported and configs read once in the parent, then each experiment runs in a process forked from it,
+#with a clean gin config and State. Each experiment writes to OUTPUT_DIR/<index> of the sweep.
+#With --share_prefixes, leading tasks with the same bindings in several experiments are run once (see PrefixTreeRunner).
+import argparse
+import datetime
+import hashlib
+import itertools
+import json
+import multiprocessing
+from multiprocessing.connection import wait
+from pathlib import Path
+import queue
+import shlex
+import time
+import traceback
+import gin
+from loguru import logger
+from .core import WELCOME_MESSAGE, gin_configure_externals, gin_parse_with_flags, write_config_log, new_state, execute_pipeline, record_task
+from .config import read_configs, default_lines, load_compiled_config
+from .stream import fuse_streams
+from .manifest import KeyFingerprints, task_bindings
+from .compression import import_joblib
+
+SUMMARY_FILENAME = 'sweep_summary.json'
+
+def grid_mods(grid):
+    #grid: ['N=1,2,3', 'LR=0.1,0.01'] -> one list of mods per point of the cartesian product
+    keys, values = [], []
+    for g in grid:
+        k, v = g.split('=', 1)
+        keys.append(k)
+        values.append(v.split(','))
+    return [['{}={}'.format(k, v) for k, v in zip(keys, point)] for point in itertools.product(*values)]
+
+def read_mods_file(path):
+    #One experiment per line, with mods separated by spaces as in --mods
+    with open(path, 'r') as f:
+        return [shlex.split(l) for l in f if l.strip() != '' and not l.startswith('#')]
+
+def sweep_experiments(grid=None, mods_file=None):
+    experiments = [[]]
+    if mods_file is not None:
+        experiments = read_mods_file(mods_file)
+    if grid:
+        experiments = [e + g for e in experiments for g in grid_mods(grid)]
+    return experiments
+
+def summary_value(v):
+    if isinstance(v, (int, float, str, bool)) or v is None:
+        return v
+    return repr(v)[:50]
+
+def experiment_flags(flags, i, mods, sweep_dir):
+    exp_mods = flags['mods'] + mods
+    if not any([m.startswith('OUTPUT_DIR') for m in mods]):
+        exp_mods = exp_mods + ["OUTPUT_DIR='{}/{:03d}'".format(sweep_dir, i)]
+    return dict(flags, mods=exp_mods, experiment_name='{}_{:03d}'.format(flags['experiment_name'], i))
+
+def error_summary(e):
+    #gin appends the configurables the error went through (In call to configurable ...) to the message
+    return '{}: {}'.format(type(e).__name__, str(e).split('\n')[0])
+
+def run_experiment(flags, lib_versions, summary_keys, state=None):
+    #state: State with the results of a prefix shared with other experiments, otherwise a new one is created
+    result = {'status': 'failed'}
+    wt = time.time()
+    try:
+        gin.clear_config()
+        inherited = state is not None
+        if not inherited:
+            state = new_state(flags)
+            state['library_versions'] = lib_versions
+        state.flags = flags
+        #The initial state of an inherited state was set before running the prefix, tasks could have modified it since
+        state = gin_parse_with_flags(state, flags, set_initial_state=not inherited)
+        result['output_dir'] = state.output_dir
+        write_config_log(state, interactive=False)
+        logger.add(Path(state.output_dir, 'log.txt'))
+        execute_pipeline(state, is_main=True)
+        result['status'] = 'ok'
+        result['summary'] = {k: summary_value(state.get(k)) for k in summary_keys if k in state}
+    except Exception as e:
+        logger.error('Experiment {} failed:\n{}'.format(flags['experiment_name'], traceback.format_exc()))
+        result['error'] = error_summary(e)
+    result['time'] = time.time() - wt
+    return result
+
+def _experiment_process(flags, lib_versions, summary_keys, conn):
+    conn.send(run_experiment(flags, lib_versions, summary_keys))
+    conn.close()
+
+def pipeline_tasks():
+    bindings = gin.get_bindings(execute_pipeline)
+    if bindings.get('execution_order', 'sequential') != 'sequential':
+        return None
+    #Same task list execute_pipeline runs, so indices match its manifest
+    return fuse_streams(bindings.get('tasks', []), bindings.get('stream_queue_size', 8))
+
+def prefix_signatures(flags):
+    #Signature of the state after each task: initial state keys, and the name and bindings of every task run so far
+    #(with the bindings of the configurables they call).
+    #Experiments with the same signature at task i computed the same state up to it.
+    gin.clear_config()
+    config, _, initial_state = load_compiled_config(flags)
+    gin.parse_config(config)
+    tasks = pipeline_tasks()
+    if tasks is None:
+        #Only sequential pipelines are shared
+        return []
+    signatures = []
+    sig = hashlib.md5(json.dumps(initial_state).encode()).hexdigest()
+    for t in tasks:
+        sig = hashlib.md5(json.dumps([sig, t.__name__, task_bindings(t)]).encode()).hexdigest()
+        signatures.append(sig)
+    return signatures
+
+class PrefixTreeRunner:
+    #Experiments sharing the first tasks run them once in a process, which then forks a process per group of
+    #experiments that diverge after them. Forked processes get the state copy-on-write.
+    #A semaphore limits how many processes are running tasks, processes waiting for their children don't count.
+    def __init__(self, flags, experiments, lib_versions, summary_keys, max_parallel, sweep_dir):
+        self.flags = [experiment_flags(flags, i, mods, sweep_dir) for i, mods in enumerate(experiments)]
+        self.lib_versions = lib_versions
+        self.summary_keys = summary_keys
+        self.signatures = [prefix_signatures(f) for f in self.flags]
+        gin.clear_config()
+        self.ctx = multiprocessing.get_context('fork')
+        self.slots = self.ctx.Semaphore(max_parallel)
+        self.results_queue = self.ctx.Queue()
+        self.results = {}
+
+    def common_prefix(self, members, depth):
+        n = depth
+        while all([len(self.signatures[m]) > n for m in members]) and (len(set([self.signatures[m][n] for m in members])) == 1):
+            n += 1
+        return n
+
+    def run_prefix(self, members, depth, n, state, fps):
+        flags = self.flags[members[0]]
+        gin.clear_config()
+        if state is None:
+            state = new_state(flags)
+            state['library_versions'] = self.lib_versions
+            state = gin_parse_with_flags(state, flags)
+            fps = KeyFingerprints(state)
+        else:
+            config, _, _ = load_compiled_config(flags)
+            gin.parse_config(config)
+        tasks = pipeline_tasks()
+        for i in range(depth, n):
+            t = tasks[i]
+            logger.info('Running {} (shared by {} experiments)'.format(t.__name__, len(members)))
+            pt = time.process_time()
+            wt = time.time()
+            state._reset_used_keys()
+            state = t(state)
+            pt = time.process_time() - pt
+            wt = time.time() - wt
+            record_task(state, i, t, wt, pt, set(state._read_keys), set(state.get_used_keys()), fps, save=False)
+        return state, fps
+
+    def run_group(self, members, depth, state=None, fps=None):
+        #Called holding a slot. state has the results of the first depth tasks of every member.
+        children = []
+        try:
+            if len(members) == 1:
+                self.results_queue.put((members[0], run_experiment(self.flags[members[0]], self.lib_versions, self.summary_keys, state)))
+                return
+            n = self.common_prefix(members, depth)
+            if n > depth:
+                try:
+                    state, fps = self.run_prefix(members, depth, n, state, fps)
+                except Exception as e:
+                    logger.error('Prefix shared by experiments {} failed:\n{}'.format(members, traceback.format_exc()))
+                    error = error_summary(e)
+                    for m in members:
+                        self.results_queue.put((m, {'status': 'failed', 'error': error}))
+                    return
+        finally:
+            self.slots.release()
+        groups = {}
+        for m in members:
+            key = self.signatures[m][n] if len(self.signatures[m]) > n else m
+            groups.setdefault(key, []).append(m)
+        for group in groups.values():
+            self.slots.acquire()
+            p = self.ctx.Process(target=self.run_group, args=(group, n, state, fps))
+            p.start()
+            children.append(p)
+            self._collect()
+        while any([p.is_alive() for p in children]):
+            wait([p.sentinel for p in children], timeout=0.1)
+            self._collect()
+        for p in children:
+            p.join()
+
+    def _collect(self):
+        #Only the parent of the sweep reads results, so the queue doesn't fill up
+        if multiprocessing.parent_process() is not None:
+            return
+        while True:
+            try:
+                i, result = self.results_queue.get(timeout=0.01)
+            except queue.Empty:
+                break
+            self.results[i] = result
+
+    def run(self):
+        self.slots.acquire()
+        self.run_group(list(range(len(self.flags))), 0)
+        self._collect()
+        results = []
+        for i in range(len(self.flags)):
+            result = self.results.get(i, {'status': 'crashed', 'error': 'the process running it exited unexpectedly'})
+            results.append(result)
+        return results
+
+def run_sweep(flags, experiments, max_parallel=1, summary_keys=None, share_prefixes=False):
+    summary_keys = summary_keys if summary_keys is not None else []
+    #Expensive setup done once, forked processes inherit it
+    read_configs(flags)
+    all_mods = flags['mods'] + [m for e in experiments for m in e]
+    lib_versions = gin_configure_externals(dict(flags, mods=all_mods))
+    import_joblib()
+    _, sweep_dir = default_lines(flags, '\n'.join(flags['config_str'] + flags['mods']))
+
+    if share_prefixes:
+        results = PrefixTreeRunner(flags, experiments, lib_versions, summary_keys, max_parallel, sweep_dir).run()
+        for i, (result, mods) in enumerate(zip(results, experiments)):
+            result['index'] = i
+            result['mods'] = mods
+    else:
+        results = run_forked(flags, experiments, lib_versions, summary_keys, max_parallel, sweep_dir)
+
+    Path(sweep_dir).mkdir(parents=True, exist_ok=True)
+    with open(Path(sweep_dir, SUMMARY_FILENAME), 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(summary_table(results, summary_keys))
+    return results
+
+def run_forked(flags, experiments, lib_versions, summary_keys, max_parallel, sweep_dir):
+    ctx = multiprocessing.get_context('fork')
+    results = [None]*len(experiments)
+    running = {}
+    pending = list(enumerate(experiments))
+    while (len(pending) > 0) or (len(running) > 0):
+        while (len(pending) > 0) and (len(running) < max_parallel):
+            i, mods = pending.pop(0)
+            exp_flags = experiment_flags(flags, i, mods, sweep_dir)
+            logger.info('Starting experiment {}/{}: {}'.format(i + 1, len(experiments), ' '.join(mods)))
+            parent_conn, child_conn = ctx.Pipe(duplex=False)
+            p = ctx.Process(target=_experiment_process, args=(exp_flags, lib_versions, summary_keys, child_conn))
+            p.start()
+            child_conn.close()
+            running[p.sentinel] = (i, mods, p, parent_conn)
+        for sentinel in wait(list(running.keys())):
+            i, mods, p, conn = running.pop(sentinel)
+            p.join()
+            try:
+                result = conn.recv()
+            except EOFError:
+                result = {'status': 'crashed', 'error': 'exit code {}'.format(p.exitcode)}
+            result['index'] = i
+            result['mods'] = mods
+            results[i] = result
+            logger.info('Experiment {} finished: {}'.format(i, result['status']))
+    return results
+
+def summary_table(results, summary_keys):
+    rows = [['#', 'mods', 'status', 'time (s)'] + summary_keys]
+    for r in results:
+        rows.append([str(r['index']), ' '.join(r['mods']), r['status'], '{:.1f}'.format(r.get('time', 0))] +
+                    [str(r.get('summary', {}).get(k, '')) for k in summary_keys])
+    widths = [max([len(row[j]) for row in rows]) for j in range(len(rows[0]))]
+    lines = ['  '.join([c.ljust(w) for c, w in zip(row, widths)]) for row in rows]
+    lines.insert(1, '  '.join(['-'*w for w in widths]))
+    return '\nSweep summary:\n' + '\n'.join(lines)
+
+def main(args=None):
+    argparser = argparse.ArgumentParser(prog='ginpipe sweep', description='Run a pipeline over a grid or list of config modifications')
+    argparser.add_argument('config_path', nargs='+', default=[], help='Path to gin config files')
+    argparser.add_argument('--experiment_name', type=str, default=datetime.datetime.now().strftime('%y-%d-%m-%H%M%S'),
+                           help='Name for the sweep. Experiments are named <experiment_name>_<index>')
+    argparser.add_argument('--project_name', type=str,
+                           help='Name for the project', default='my_project')
+    argparser.add_argument('--mods', dest='mods', nargs='+', default=[],
+                           help='Modifications applied to every experiment')
+    argparser.add_argument('--grid', nargs='+', default=[],
+                           help='Values to sweep as KEY=v1,v2,... Every combination is run')
+    argparser.add_argument('--mods_file', type=str, default=None,
+                           help='File with the mods of one experiment per line. Combined with --grid if both are given')
+    argparser.add_argument('--max_parallel', type=int, default=1, help='Maximum number of experiments running at the same time')
+    argparser.add_argument('--summary_keys', nargs='+', default=[], help='State keys shown in the summary table')
+    argparser.add_argument('--share_prefixes', action='store_true',
+                           help='Run tasks with the same bindings in every experiment once and fork the resulting state. '
+                                'Tasks must not depend on the experiment name or output directory unless it is in their bindings')
+    argparser.add_argument('--module_list', dest='module_list', nargs='+', default=[])
+    argparser.add_argument('--eager_externals', action='store_true',
+                           help='Import and register every module in the module list, even if the config does not reference it')
+    argparser.add_argument('--no_config_cache', dest='config_cache', action='store_false',
+                           help='Do not reuse the preprocessed config from previous runs')
+    argparser.add_argument('--sympy_fallback', action='store_true',
+                           help='Evaluate $(...) operations that are not plain arithmetic with sympy')
+
+    flags = vars(argparser.parse_args(args))
+    experiments = sweep_experiments(flags.pop('grid'), flags.pop('mods_file'))
+    max_parallel = flags.pop('max_parallel')
+    summary_keys = flags.pop('summary_keys')
+    share_prefixes = flags.pop('share_prefixes')
+    logger.log('INTRO', WELCOME_MESSAGE)
+    logger.info('Running sweep of {} experiments'.format(len(experiments)))
+    results = run_sweep(flags, experiments, max_parallel=max_parallel, summary_keys=summary_keys, share_prefixes=share_prefixes)
+    return 0 if all([r['status'] == 'ok' for r in results]) else 1
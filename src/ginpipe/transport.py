@@ -0,0 +1,209 @@
+#Shared memory handoff of large values between the main process and the workers of the dag process executor.
+#Arrays, CPU tensors and bytes over min_size are placed in a multiprocessing.shared_memory segment once and
+#only a SharedHandle is pickled. Arrays and tensors are mapped without copying, bytes are copied out of the segment.
+#Inputs are read-only arrays in the workers, as tasks writing to them would modify the state of the main process.
+#The main process counts the references to each segment (state keys bound to it and running tasks using it)
+#and unlinks it when none are left.
+from multiprocessing import shared_memory, resource_tracker
+import os
+import sys
+import weakref
+from loguru import logger
+
+SHM_DIR = '/dev/shm'
+
+class SharedHandle:
+    def __init__(self, name, kind, size, shape=None, dtype=None):
+        self.name = name
+        self.kind = kind
+        self.size = size
+        self.shape = shape
+        self.dtype = dtype
+
+    def __repr__(self):
+        return 'SharedHandle({}, {}, {} bytes)'.format(self.name, self.kind, self.size)
+
+def shared_kind(v, min_size):
+    #Kind of value if it can be placed in shared memory, otherwise None
+    np = sys.modules.get('numpy')
+    torch = sys.modules.get('torch')
+    if (np is not None) and isinstance(v, np.ndarray):
+        if (not v.dtype.hasobject) and (v.nbytes >= min_size):
+            return 'numpy'
+    elif (torch is not None) and isinstance(v, torch.Tensor):
+        if (v.device.type == 'cpu') and (not v.requires_grad) and (v.element_size()*v.nelement() >= min_size):
+            try:
+                v.numpy()
+                return 'torch'
+            except (TypeError, RuntimeError):
+                #dtypes without a numpy equivalent, e.g. bfloat16
+                return None
+    elif isinstance(v, (bytes, bytearray)) and (len(v) >= min_size):
+        return 'bytes'
+    return None
+
+def has_room(nbytes):
+    #Writing past the free space of /dev/shm kills the process with SIGBUS instead of raising
+    try:
+        st = os.statvfs(SHM_DIR)
+    except OSError:
+        return True
+    return st.f_bavail*st.f_frsize > nbytes
+
+def create_segment(v, kind):
+    if kind == 'bytes':
+        shm = shared_memory.SharedMemory(create=True, size=max(len(v), 1))
+        shm.buf[:len(v)] = v
+        return SharedHandle(shm.name, kind, len(v)), shm
+    import numpy as np
+    arr = v.detach().numpy() if kind == 'torch' else v
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    dst = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+    dst[...] = arr
+    del dst
+    return SharedHandle(shm.name, kind, arr.nbytes, arr.shape, arr.dtype.str), shm
+
+def segment_value(handle, shm, read_only=False):
+    if handle.kind == 'bytes':
+        return bytes(shm.buf[:handle.size])
+    import numpy as np
+    arr = np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=shm.buf)
+    #The mapping can only be closed once no array uses it
+    weakref.finalize(arr, shm.close)
+    if handle.kind == 'torch':
+        import torch
+        return torch.from_numpy(arr)
+    if read_only:
+        arr.flags.writeable = False
+    return arr
+
+def attach(handle, read_only=False):
+    shm = shared_memory.SharedMemory(name=handle.name)
+    v = segment_value(handle, shm, read_only)
+    if handle.kind == 'bytes':
+        shm.close()
+    return v, shm
+
+def import_inputs(inputs):
+    #Worker side. Returns the values, and the handles of the attached ones by id, to detect outputs that are inputs
+    values, attached = {}, {}
+    for k, v in inputs.items():
+        if isinstance(v, SharedHandle):
+            v_attached, _ = attach(v, read_only=True)
+            attached[id(v_attached)] = (v, v_attached)
+            v = v_attached
+        values[k] = v
+    return values, attached
+
+def export_outputs(outputs, attached, min_size):
+    #Worker side. The segments created here are unlinked by the main process
+    exported = {}
+    for k, v in outputs.items():
+        kind = shared_kind(v, min_size) if min_size is not None else None
+        if (id(v) in attached) and (attached[id(v)][1] is v):
+            exported[k] = attached[id(v)][0]
+        elif (kind is not None) and has_room(v.nbytes if kind != 'bytes' else len(v)):
+            handle, shm = create_segment(v, kind)
+            shm.close()
+            exported[k] = handle
+        else:
+            exported[k] = v
+    return exported
+
+class SharedMemoryTransport:
+    #Main process side
+    def __init__(self, min_size=1024*1024):
+        self.min_size = min_size
+        #Workers forked before the tracker starts would start their own, which would unlink the segments they create on exit
+        resource_tracker.ensure_running()
+        #name -> [references, SharedMemory, value in the main process]
+        self.segments = {}
+        #state key -> (handle, value bound to the key when it was shared)
+        self.keys = {}
+        #task index -> names of the segments it uses as inputs
+        self.task_refs = {}
+
+    def _acquire(self, name):
+        self.segments[name][0] += 1
+
+    def _release(self, name):
+        segment = self.segments[name]
+        segment[0] -= 1
+        if segment[0] == 0:
+            #Unlinking frees the memory once every process unmaps it, the state keeps its value meanwhile
+            try:
+                segment[1].unlink()
+            except FileNotFoundError:
+                pass
+            del self.segments[name]
+
+    def _unbind(self, k):
+        if k in self.keys:
+            handle, _ = self.keys.pop(k)
+            self._release(handle.name)
+
+    def _bind(self, k, handle, value):
+        self._unbind(k)
+        self.keys[k] = (handle, value)
+        self._acquire(handle.name)
+
+    def export_inputs(self, i, inputs, state):
+        exported = {}
+        for k, v in inputs.items():
+            if (k in self.keys) and (self.keys[k][1] is not v):
+                #The key was assigned a new value since it was shared
+                self._unbind(k)
+            if k not in self.keys:
+                kind = shared_kind(v, self.min_size)
+                if (kind is None) or (not has_room(v.nbytes if kind != 'bytes' else len(v))):
+                    exported[k] = v
+                    continue
+                handle, shm = create_segment(v, kind)
+                value = segment_value(handle, shm)
+                self.segments[handle.name] = [0, shm, value]
+                self._bind(k, handle, value)
+                #The key now lives in the segment, so it is shared again without copying. It is not a write.
+                if kind != 'bytes':
+                    state._internal_state[k] = value
+                    state._loaded_handles.pop(k, None)
+            handle = self.keys[k][0]
+            self._acquire(handle.name)
+            self.task_refs.setdefault(i, []).append(handle.name)
+            exported[k] = handle
+        return exported
+
+    def import_outputs(self, i, writes):
+        #Values to write in the state. Segments stay linked while a key is bound to them.
+        values = {}
+        for k, v in writes.items():
+            if isinstance(v, SharedHandle):
+                if v.name in self.segments:
+                    value = self.segments[v.name][2]
+                else:
+                    value, shm = attach(v)
+                    self.segments[v.name] = [0, shm, value]
+                self._bind(k, v, value)
+                v = value
+            else:
+                self._unbind(k)
+            values[k] = v
+        for name in self.task_refs.pop(i, []):
+            self._release(name)
+        return values
+
+    def discard(self, writes):
+        for v in writes.values():
+            if isinstance(v, SharedHandle) and (v.name not in self.segments):
+                try:
+                    shared_memory.SharedMemory(name=v.name).unlink()
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        for name in [n for refs in self.task_refs.values() for n in refs]:
+            self._release(name)
+        self.task_refs = {}
+        for k in list(self.keys):
+            self._unbind(k)
+        if len(self.segments) > 0:
+            logger.warning('Shared memory segments still referenced: {}'.format(list(self.segments)))
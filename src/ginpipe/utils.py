@@ -1,10 +1,13 @@
+from bisect import bisect_left
 from collections.abc import Mapping
 import gin
 from pathlib import Path
-import torch
 from ginpipe.core import gin_configure_externals
 import re
 
+#Parsed configs by path, reused while the file keeps its mtime and size
+_parsed_configs = {}
+
 def config_to_dict(config):
     with open(config,'r') as f:
         config = f.read()
@@ -39,30 +42,104 @@ def fuzzy_get(d, key):
             gathered.append((k,v))
     return gathered
             
-def get_target_d(d, new_d, target):
+def get_references(val):
+    if '@' in val:
+        return re.findall(r'@([^,\s\[\]]+)', val)
+    elif '%' in val:
+        return re.findall(r'%([^,\s\[\]]+)', val)
+    return []
+
+def get_target_d(d, new_d, target, visited=None):
+    #visited avoids looping on configs with circular references
+    visited = set() if visited is None else visited
+    if target in visited:
+        return
+    visited.add(target)
     gathered = fuzzy_get(d, target)
     for l in gathered:
         target, val = l
-        if '@' in val:
-            k = re.findall(r'@([^,\s\[\]]+)', val)
-        elif '%' in val:
-            k = re.findall(r'%([^,\s\[\]]+)', val)
-        else:
-            k = None
-        if k is not None:
-            for ki in k:
-                get_target_d(d, new_d, ki)
+        for ki in get_references(val):
+            get_target_d(d, new_d, ki, visited)
         new_d[target] = val
 
+class ParsedConfig:
+    #Config dict with the lookups of get_target_d indexed: fuzzy_get matches are prefix ranges of the sorted keys,
+    #and the keys reachable from each target through @/% references are memoized.
+    def __init__(self, d):
+        self.d = d
+        self.sorted_keys = sorted(d)
+        self.positions = {k: i for i, k in enumerate(d)}
+        self.references = {}
+        self.closures = {}
+
+    def with_additions(self, additions):
+        d = dict(self.d)
+        d.update(additions)
+        return ParsedConfig(d)
+
+    def prefixed(self, prefix):
+        i = bisect_left(self.sorted_keys, prefix)
+        keys = []
+        while (i < len(self.sorted_keys)) and self.sorted_keys[i].startswith(prefix):
+            keys.append(self.sorted_keys[i])
+            i += 1
+        return keys
+
+    def fuzzy_get(self, key):
+        #Same matches as fuzzy_get(self.d, key), in the same order
+        prefixes = [key, key.split('.')[-1]]
+        if '/' in key:
+            prefixes.append('{}/{}'.format(key.split('/')[0],key.split('/')[-1].split('.')[-1]))
+        keys = set([k for p in set(prefixes) for k in self.prefixed(p)])
+        return [(k, self.d[k]) for k in sorted(keys, key=self.positions.get)]
+
+    def get_references(self, k):
+        if k not in self.references:
+            self.references[k] = get_references(self.d[k])
+        return self.references[k]
+
+    def closure(self, target):
+        #Keys get_target_d(self.d, new_d, target) would add to new_d
+        if target not in self.closures:
+            keys = []
+            visited = set([target])
+            stack = [target]
+            while len(stack) > 0:
+                for k, _ in self.fuzzy_get(stack.pop()):
+                    keys.append(k)
+                    for ki in self.get_references(k):
+                        if ki not in visited:
+                            visited.add(ki)
+                            stack.append(ki)
+            self.closures[target] = list(dict.fromkeys(keys))
+        return self.closures[target]
+
+def load_parsed_config(config_path, additions=None):
+    path = Path(config_path).resolve()
+    stat = path.stat()
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _parsed_configs.get(str(path))
+    if (cached is None) or (cached['version'] != version):
+        cached = {'version': version, 'config': ParsedConfig(config_to_dict(path)), 'with_additions': {}}
+        _parsed_configs[str(path)] = cached
+    if not additions:
+        return cached['config']
+    try:
+        additions_key = tuple(sorted(additions.items()))
+        hash(additions_key)
+    except TypeError:
+        return cached['config'].with_additions(additions)
+    if additions_key not in cached['with_additions']:
+        cached['with_additions'][additions_key] = cached['config'].with_additions(additions)
+    return cached['with_additions'][additions_key]
+
 def get_model_config(config_path, targets, replacements, additions=None):
-    d = config_to_dict(config_path)
-    if additions is not None:
-        for k,v in additions.items():
-            d[k]=v
+    config = load_parsed_config(config_path, additions)
     pruned_config_str = ''
     pruned_config = {}
     for target in targets:
-        get_target_d(d, pruned_config, target)
+        for k in config.closure(target):
+            pruned_config[k] = config.d[k]
     for k,v in replacements.items():
         if k in pruned_config:
             pruned_config[v] = pruned_config.pop(k)
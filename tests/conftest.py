@@ -0,0 +1,32 @@
+#Tests import ginpipe from the src folder of this checkout, like the benchmarks.
+#Caches go to a temporary directory, so tests don't depend on previous runs.
+import os
+from pathlib import Path
+import sys
+import tempfile
+import pytest
+
+SRC_PATH = str(Path(__file__).resolve().parent.parent / 'src')
+if SRC_PATH not in sys.path:
+    sys.path.insert(0, SRC_PATH)
+os.environ['GINPIPE_CACHE_DIR'] = tempfile.mkdtemp(prefix='ginpipe_test_')
+
+from ginpipe.core import new_state
+
+@pytest.fixture
+def fresh_state():
+    #New state writing to output_dir, with keys set as its initial state
+    def make(output_dir, **keys):
+        state = new_state({})
+        state.output_dir = str(output_dir)
+        for k, v in keys.items():
+            state[k] = v
+        return state
+    return make
+
+@pytest.fixture(autouse=True)
+def calls(request, monkeypatch):
+    #Tasks defined in a test module append their name to its calls list, emptied for every test
+    calls = []
+    monkeypatch.setattr(request.module, 'calls', calls, raising=False)
+    return calls
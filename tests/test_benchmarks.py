@@ -0,0 +1,39 @@
+import json
+from pathlib import Path
+import subprocess
+import sys
+import pytest
+
+RUN_ALL = str(Path(__file__).resolve().parent.parent / 'benchmarks' / 'run_all.py')
+
+def run_benchmarks(*args):
+    return subprocess.run([sys.executable, RUN_ALL, '--quick'] + list(args), capture_output=True, text=True, timeout=600)
+
+@pytest.fixture(scope='module')
+def results(tmp_path_factory):
+    output = Path(tmp_path_factory.mktemp('benchmarks'), 'results.json')
+    result = run_benchmarks('--output', str(output))
+    assert output.exists(), result.stderr
+    return json.loads(output.read_text())
+
+def test_every_suite_reports(results):
+    suites = set([r['benchmark'].split('.')[0] for r in results['results']])
+    assert suites == {'config', 'externals', 'state', 'pipeline', 'import'}
+    assert all([r['min_s'] <= r['median_s'] for r in results['results']])
+    assert results['quick']
+
+def test_import_leaves_heavy_modules(results):
+    r = [r for r in results['results'] if r['benchmark'] == 'import.ginpipe_core'][0]
+    assert r['heavy_modules_imported'] == []
+
+def test_growth_benchmarks_have_a_limit(results):
+    growth = [r for r in results['results'] if 'growth' in r]
+    assert len(growth) > 0
+    assert all(['max_growth' in r for r in growth])
+
+def test_regressions_fail_the_comparison(results, tmp_path):
+    baseline = dict(results, results=[dict(r, min_s=r['min_s']/100) for r in results['results'] if r['benchmark'].startswith('config.')])
+    Path(tmp_path, 'baseline.json').write_text(json.dumps(baseline))
+    result = run_benchmarks('--suites', 'config', '--compare', str(Path(tmp_path, 'baseline.json')))
+    assert result.returncode == 1
+    assert 'Regressions over 1.25x' in result.stdout
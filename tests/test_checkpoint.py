@@ -0,0 +1,94 @@
+from pathlib import Path
+import threading
+import pytest
+from ginpipe.checkpoint import AsyncWriter, snapshot
+from ginpipe.core import execute_pipeline, State
+from ginpipe.manifest import load_manifest
+from ginpipe.storage import JoblibBackend, list_saved_keys
+
+def blocked_writer():
+    writer = AsyncWriter()
+    release = threading.Event()
+    writer.submit(release.wait)
+    return writer, release
+
+def test_superseded_writes_are_skipped():
+    writer, release = blocked_writer()
+    written = []
+    writer.submit(written.append, 1, key='k')
+    writer.submit(written.append, 2, key='k')
+    release.set()
+    writer.close()
+    assert written == [2]
+
+def test_writes_before_a_job_without_key_are_not_skipped():
+    writer, release = blocked_writer()
+    written = []
+    writer.submit(written.append, 1, key='k')
+    writer.submit(written.append, 'manifest')
+    writer.submit(written.append, 2, key='k')
+    writer.submit(written.append, 3, key='k')
+    release.set()
+    writer.close()
+    assert written == [1, 'manifest', 3]
+
+def test_jobs_without_key_are_dropped_after_a_failure():
+    writer, release = blocked_writer()
+    written = []
+    writer.submit(lambda: 1/0, key='k')
+    writer.submit(written.append, 'manifest')
+    writer.submit(written.append, 1, key='j')
+    writer.submit(written.append, 'fingerprints')
+    release.set()
+    with pytest.raises(ZeroDivisionError):
+        writer.close()
+    assert written == [1]
+
+def test_errors_are_raised_after_stopping_the_thread():
+    writer = AsyncWriter()
+    writer.submit(lambda: 1/0)
+    with pytest.raises(ZeroDivisionError):
+        writer.close()
+    assert not writer.thread.is_alive()
+
+def test_snapshot_copies_containers():
+    d = {'a': 1}
+    copied = snapshot(d)
+    d['b'] = 2
+    assert copied == {'a': 1}
+
+class FailingBackend(JoblibBackend):
+    def dump(self, v, path, codec=None):
+        raise IOError('disk full')
+
+def make_tasks(fail=False):
+    def a(state):
+        state['a'] = 1
+        return state
+    def b(state):
+        state['b'] = state['a'] + 1
+        if fail:
+            raise ValueError('b failed')
+        return state
+    return [a, b]
+
+def test_async_save_resume(tmp_path, fresh_state):
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=make_tasks(), is_main=True, async_save=True)
+    assert [e['task'] for e in load_manifest(Path(tmp_path, 'state'))] == ['a', 'b']
+    saved = list_saved_keys(Path(tmp_path, 'state'), [JoblibBackend()])
+    assert saved['b'].load() == 2
+    assert set(saved['execution_times'].load()) == {'a_0', 'b_0'}
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=make_tasks(fail=True), is_main=True, async_save=True)
+    assert 'execution_times' not in state
+
+def test_writer_error_does_not_hide_task_error(tmp_path, fresh_state):
+    with pytest.raises(ValueError, match='b failed'):
+        execute_pipeline(fresh_state(tmp_path), tasks=make_tasks(fail=True), is_main=True, async_save=True, storage_backends=[FailingBackend()])
+    assert State._async_writer is None
+
+def test_writer_error_is_raised(tmp_path, fresh_state):
+    with pytest.raises(IOError, match='disk full'):
+        execute_pipeline(fresh_state(tmp_path), tasks=make_tasks(), is_main=True, async_save=True, storage_backends=[FailingBackend()])
+    assert State._async_writer is None
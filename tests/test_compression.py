@@ -0,0 +1,60 @@
+from pathlib import Path
+import pytest
+from ginpipe.core import execute_pipeline
+from ginpipe.compression import parse_codec, joblib_compress, compress_bytes, decompress_bytes, benchmark_codecs
+from ginpipe.storage import list_saved_keys, default_backends
+
+def produce(state):
+    state['text'] = 'abc'*10000
+    state['other'] = 'xyz'*10000
+    return state
+
+def test_parse_codec():
+    assert parse_codec(None) == ('none', None)
+    assert parse_codec('zstd:19') == ('zstd', 19)
+    assert joblib_compress('lz4') == ('lz4', 3)
+    assert joblib_compress('none') == 0
+    with pytest.raises(Exception, match='Codec not recognized: gzip'):
+        parse_codec('gzip:3')
+
+@pytest.mark.parametrize('codec', ['none', 'zlib:1', 'lz4', 'zstd:9'])
+def test_bytes_roundtrip(codec):
+    if codec.startswith('lz4'):
+        pytest.importorskip('lz4')
+    if codec.startswith('zstd'):
+        pytest.importorskip('zstandard')
+    data = b'ginpipe'*1000
+    compressed = compress_bytes(data, codec)
+    assert decompress_bytes(compressed, codec) == data
+    if codec != 'none':
+        assert len(compressed) < len(data)
+
+def test_key_codecs_override_default(tmp_path, fresh_state):
+    execute_pipeline(fresh_state(tmp_path), tasks=[produce], is_main=True, codec='zlib:6', key_codecs={'other': 'none'})
+    state_path = Path(tmp_path, 'state')
+    text_size = Path(state_path, 'text.pkl').stat().st_size
+    assert text_size < 1000
+    assert Path(state_path, 'other.pkl').stat().st_size > 30000
+    assert list_saved_keys(state_path, default_backends())['text'].load() == 'abc'*10000
+
+def test_codec_change_saves_the_key_again(tmp_path, fresh_state):
+    execute_pipeline(fresh_state(tmp_path), tasks=[produce], is_main=True)
+    text_path = Path(tmp_path, 'state', 'text.pkl')
+    size = text_path.stat().st_size
+    #Same content, other codec: the fingerprint includes the codec
+    execute_pipeline(fresh_state(tmp_path), tasks=[produce], is_main=True, rerun_tasks=['produce'], codec='zlib:6')
+    assert text_path.stat().st_size < size
+
+def test_codecs_from_state_key(tmp_path, fresh_state):
+    state = fresh_state(tmp_path)
+    state['key_codecs'] = {'text': 'zlib:9'}
+    execute_pipeline(state, tasks=[produce], is_main=True)
+    assert Path(tmp_path, 'state', 'text.pkl').stat().st_size < 1000
+    assert Path(tmp_path, 'state', 'other.pkl').stat().st_size > 30000
+
+def test_benchmark_codecs(tmp_path, fresh_state):
+    state = fresh_state(tmp_path)
+    produce(state)
+    results = benchmark_codecs(state, codecs=['none', 'zlib:1'], keys=['text'])
+    assert set(results['text']) == {'none', 'zlib:1'}
+    assert results['text']['zlib:1']['ratio'] > results['text']['none']['ratio']
@@ -0,0 +1,53 @@
+from pathlib import Path
+from ginpipe import config
+from ginpipe.config import merge_appends, expand_lines, load_compiled_config, compiled_config_cache_path, prune_config_cache
+
+def flags_for(config_str, mods=(), **extra):
+    return dict({'config_str': [config_str], 'mods': list(mods), 'experiment_name': 'exp', 'project_name': 'proj'}, **extra)
+
+def test_appends_are_merged():
+    lines = ['f.x=[1, 2]', 'f.x+=[3]', 'g:', '    y=[1,', '        2]', 'g.y+=[4]']
+    merged = merge_appends(lines)
+    assert 'f.x=[1, 2,3]' in merged
+    assert 'g.y=[1,2,4]' in merged
+    assert not any(['+=' in l for l in merged])
+
+def test_operations_use_macros_defined_after_them():
+    lines, initial_state = expand_lines(['f.x=$(%N*2)', '$lr=$(1/%N)', 'N=4'])
+    assert lines == ['f.x=8', 'N=4']
+    assert initial_state == [('lr', '0.25')]
+
+def test_compiled_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CACHE_DIR', tmp_path)
+    flags = flags_for('N=2\nf.x=$(%N^2)\n$key=[1, 2]', mods=['N=3'])
+    compiled, output_dir, initial_state = load_compiled_config(flags)
+    assert 'f.x=9' in compiled
+    assert "EXPERIMENT_NAME='exp'" in compiled
+    assert output_dir == 'experiments/proj/exp'
+    assert initial_state == [('key', '[1, 2]')]
+    assert compiled_config_cache_path(flags).exists()
+    #Other experiment names share the compiled body
+    compiled_2, output_dir_2, _ = load_compiled_config(dict(flags, experiment_name='exp2'))
+    assert compiled_2.replace('exp2', 'exp') == compiled
+    assert output_dir_2 == 'experiments/proj/exp2'
+    assert len(list(Path(tmp_path, 'configs').glob('*.json'))) == 1
+
+def test_cache_keeps_most_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CACHE_DIR', tmp_path)
+    monkeypatch.setattr(config, 'CONFIG_CACHE_SIZE', 3)
+    flags = [flags_for('f.x={}'.format(i)) for i in range(3)]
+    for i, f in enumerate(flags):
+        load_compiled_config(f)
+        config.os.utime(compiled_config_cache_path(f), ns=(i, i))
+    #Using the oldest entry makes it the most recent
+    load_compiled_config(flags[0])
+    load_compiled_config(flags_for('f.x=3'))
+    cached = set(Path(tmp_path, 'configs').glob('*.json'))
+    assert cached == set([compiled_config_cache_path(f) for f in [flags[0], flags[2], flags_for('f.x=3')]])
+
+def test_prune_config_cache(tmp_path):
+    for i in range(5):
+        Path(tmp_path, '{}.json'.format(i)).write_text('{}')
+        config.os.utime(Path(tmp_path, '{}.json'.format(i)), ns=(i, i))
+    prune_config_cache(tmp_path, max_entries=2)
+    assert sorted([p.name for p in tmp_path.glob('*.json')]) == ['3.json', '4.json']
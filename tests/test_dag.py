@@ -0,0 +1,80 @@
+from pathlib import Path
+import threading
+import pytest
+from ginpipe.core import execute_pipeline, State
+from ginpipe.dag import declare_io, build_dependencies
+from ginpipe.manifest import load_manifest
+from ginpipe.storage import list_saved_keys, default_backends
+
+def test_dependencies():
+    ios = [{'reads': set(), 'writes': {'a'}}, {'reads': set(), 'writes': {'b'}}, {'reads': {'a', 'b'}, 'writes': {'c'}}, None]
+    assert build_dependencies(ios) == [set(), set(), {0, 1}, {0, 1, 2}]
+
+def test_thread_tasks_write_to_their_view(tmp_path, fresh_state):
+    seen = {}
+    started = threading.Barrier(2, timeout=10)
+    @declare_io(writes=['a'])
+    def first(state):
+        state['a'] = 1
+        started.wait()
+        seen['shared'] = 'a' in State._internal_state
+        seen['own'] = state['a']
+        return state
+    @declare_io(writes=['b'])
+    def second(state):
+        started.wait()
+        state['b'] = 2
+        return state
+    @declare_io(reads=['a', 'b'], writes=['c'])
+    def third(state):
+        state['c'] = state['a'] + state['b']
+        return state
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=[first, second, third], execution_order='dag', is_main=True)
+    assert seen == {'shared': False, 'own': 1}
+    assert state['c'] == 3
+    assert [e['task'] for e in sorted(load_manifest(Path(tmp_path, 'state')), key=lambda e: e['index'])] == ['first', 'second', 'third']
+
+def make_writer(i, n_keys):
+    @declare_io(writes=['{}_{}'.format(i, j) for j in range(n_keys)])
+    def writer(state):
+        for j in range(n_keys):
+            state['{}_{}'.format(i, j)] = list(range(j))
+        return state
+    writer.__name__ = 'writer_{}'.format(i)
+    return writer
+
+@pytest.mark.parametrize('async_save', [False, True])
+def test_concurrent_writes_while_saving(tmp_path, async_save, fresh_state):
+    tasks = [make_writer(i, 200) for i in range(8)]
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=tasks, execution_order='dag', max_workers=8, is_main=True, async_save=async_save)
+    saved = list_saved_keys(Path(tmp_path, 'state'), default_backends())
+    assert all(['{}_{}'.format(i, j) in saved for i in range(8) for j in range(200)])
+    assert saved['7_199'].load() == list(range(199))
+
+def test_failed_thread_task_keeps_completed_outputs(tmp_path, fresh_state):
+    @declare_io(writes=['a'])
+    def ok(state):
+        state['a'] = 1
+        return state
+    @declare_io(reads=['a'], writes=['b'])
+    def fail(state):
+        state['b'] = 2
+        raise ValueError('fail')
+    with pytest.raises(ValueError):
+        execute_pipeline(fresh_state(tmp_path), tasks=[ok, fail], execution_order='dag', is_main=True)
+    saved = list_saved_keys(Path(tmp_path, 'state'), default_backends())
+    assert 'a' in saved
+    assert 'b' not in saved
+
+@pytest.mark.parametrize('execution_order', ['sequential', 'dag'])
+def test_setdefault_writes_are_kept(tmp_path, execution_order, fresh_state):
+    @declare_io(writes=['metrics'])
+    def measure(state):
+        state.setdefault('metrics', {})['loss'] = 1
+        return state
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=[measure], execution_order=execution_order, is_main=True)
+    assert state['metrics'] == {'loss': 1}
+    assert list_saved_keys(Path(tmp_path, 'state'), default_backends())['metrics'].load() == {'loss': 1}
@@ -0,0 +1,98 @@
+import json
+from pathlib import Path
+import socket
+import subprocess
+import sys
+
+SCRIPT = '''
+import json, os, sys
+from ginpipe.core import new_state, execute_pipeline
+from ginpipe.distributed import rank_zero_only, rank_independent, get_rank
+
+@rank_zero_only
+def prep(state):
+    state['data'] = list(range(100))
+    if os.environ.get('CRASH'):
+        raise ValueError('prep crashed')
+    return state
+
+def local(state):
+    state['local'] = sum(state['data']) + get_rank()
+    return state
+
+@rank_independent
+def shared(state):
+    state['shared'] = sum(state['data'])
+    return state
+
+def last(state):
+    state['last'] = state['local'] + state['shared']
+    return state
+
+tasks = [globals()[t] for t in sys.argv[2].split(',')]
+state = new_state({})
+state.output_dir = sys.argv[1]
+result = {}
+try:
+    execute_pipeline(state, tasks=tasks, is_main=True, distributed=True, execution_order=os.environ.get('ORDER', 'sequential'))
+    result = {k: state[k] for k in ['local', 'shared', 'last'] if k in state}
+    result['executed'] = sorted(state.get('execution_times', {}))
+except Exception as e:
+    result['error'] = str(e)
+print(json.dumps(result))
+'''
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def run_ranks(tmp_path, tasks, world_size=2, **env):
+    script = Path(tmp_path, 'pipeline.py')
+    script.write_text(SCRIPT)
+    port = free_port()
+    procs = []
+    for rank in range(world_size):
+        proc_env = {'PYTHONPATH': str(Path(__file__).resolve().parent.parent / 'src'), 'RANK': str(rank), 'WORLD_SIZE': str(world_size),
+                    'MASTER_ADDR': '127.0.0.1', 'GINPIPE_PORT': str(port), 'PATH': '/usr/bin:/bin'}
+        proc_env.update(env)
+        procs.append(subprocess.Popen([sys.executable, str(script), str(Path(tmp_path, 'out')), ','.join(tasks)],
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=proc_env, text=True))
+    results = []
+    for p in procs:
+        out, _ = p.communicate(timeout=60)
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    return results
+
+def test_rank_zero_outputs_are_broadcast(tmp_path):
+    results = run_ranks(tmp_path, ['prep', 'local'])
+    assert [r['local'] for r in results] == [4950, 4951]
+    assert 'prep_0' in results[1]['executed']
+
+def test_resume_recomputes_rank_dependent_tasks(tmp_path):
+    run_ranks(tmp_path, ['prep', 'local'])
+    results = run_ranks(tmp_path, ['prep', 'local', 'shared', 'last'])
+    #local only depends on rank 0's prep, but its output differs on each rank
+    assert [r['local'] for r in results] == [4950, 4951]
+    for r in results:
+        assert 'prep_0' not in r['executed']
+        assert 'local_0' in r['executed']
+
+def test_resume_skips_rank_independent_tasks(tmp_path):
+    run_ranks(tmp_path, ['prep', 'shared'])
+    results = run_ranks(tmp_path, ['prep', 'shared', 'local', 'last'])
+    for rank, r in enumerate(results):
+        assert r['executed'] == ['last_0', 'local_0']
+        assert r['shared'] == 4950
+        assert r['last'] == 2*4950 + rank
+
+def test_rank_zero_failure_is_raised_on_every_rank(tmp_path):
+    results = run_ranks(tmp_path, ['prep', 'local'], CRASH='1')
+    assert 'prep crashed' in results[0]['error']
+    assert 'failed on rank 0' in results[1]['error']
+
+def test_invalid_order_closes_connections(tmp_path):
+    #Without closing the sockets of rank 0, rank 1 would wait for its first message forever
+    results = run_ranks(tmp_path, ['prep', 'local'], ORDER='dag')
+    assert 'require execution_order sequential' in results[0]['error']
+    assert 'error' in results[1]
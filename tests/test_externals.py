@@ -0,0 +1,54 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+from ginpipe.environment import config_tokens, module_is_referenced, save_module_symbols
+
+SRC_PATH = str(Path(__file__).resolve().parent.parent / 'src')
+
+def run_ginpipe(cwd, *args):
+    env = dict(os.environ, PYTHONPATH=SRC_PATH)
+    return subprocess.run([sys.executable, '-m', 'ginpipe.run'] + list(args), cwd=cwd, env=env, capture_output=True, text=True, timeout=120)
+
+def write_package(root, functions):
+    Path(root, 'pkg').mkdir(exist_ok=True)
+    Path(root, 'pkg', '__init__.py').write_text('from .sub import *\n')
+    Path(root, 'pkg', 'sub.py').write_text(''.join(['def {0}(state):\n    state["{0}"] = 1\n    return state\n'.format(f) for f in functions]))
+
+def test_unreferenced_modules_are_skipped(tmp_path):
+    Path(tmp_path, 'heavy.py').write_text('open("imported", "a").write("heavy\\n")\ndef unused(state):\n    return state\n')
+    write_package(tmp_path, ['beta'])
+    Path(tmp_path, 'modules').write_text('pkg: pkg\nheavy: heavy\n')
+    Path(tmp_path, 'config.gin').write_text('execute_pipeline.tasks=[@pkg.beta]\n')
+    for name in ['e1', 'e2']:
+        result = run_ginpipe(tmp_path, 'config.gin', '--module_list', 'modules', '--experiment_name', name)
+        assert result.returncode == 0, result.stderr
+    #Imported the first time to learn its symbols, then skipped
+    assert Path(tmp_path, 'imported').read_text() == 'heavy\n'
+
+def test_outdated_symbols_import_skipped_modules(tmp_path):
+    write_package(tmp_path, ['beta'])
+    Path(tmp_path, 'modules').write_text('pkg: pkg\n')
+    Path(tmp_path, 'config.gin').write_text('execute_pipeline.tasks=[@beta]\n')
+    result = run_ginpipe(tmp_path, 'config.gin', '--module_list', 'modules', '--experiment_name', 'e1')
+    assert result.returncode == 0, result.stderr
+    #A symbol of the package is added in a file other than __init__.py, so the cached symbols are outdated
+    init_stat = Path(tmp_path, 'pkg', '__init__.py').stat()
+    write_package(tmp_path, ['beta', 'alpha'])
+    os.utime(Path(tmp_path, 'pkg', '__init__.py'), ns=(init_stat.st_atime_ns, init_stat.st_mtime_ns))
+    Path(tmp_path, 'config.gin').write_text('execute_pipeline.tasks=[@alpha]\n')
+    result = run_ginpipe(tmp_path, 'config.gin', '--module_list', 'modules', '--experiment_name', 'e2')
+    assert result.returncode == 0, result.stderr
+    assert 'Importing pkg, skipped from the module list' in result.stderr
+
+def test_module_is_referenced(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_package(tmp_path, ['beta'])
+    tokens = config_tokens(['execute_pipeline.tasks=[@beta]'])
+    #Never imported: it has to be imported to know its symbols
+    assert module_is_referenced('pkg', 'other', tokens)
+    save_module_symbols('pkg', ['gamma'])
+    assert not module_is_referenced('pkg', 'other', tokens)
+    assert module_is_referenced('pkg', 'execute_pipeline', tokens)
+    save_module_symbols('pkg', ['beta'])
+    assert module_is_referenced('pkg', 'other', tokens)
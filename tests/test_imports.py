@@ -0,0 +1,33 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+SRC_PATH = str(Path(__file__).resolve().parent.parent / 'src')
+HEAVY_MODULES = ['sympy', 'joblib', 'numpy', 'torch', 'diff_match_patch', 'termcolor']
+
+def imported_after(code):
+    #Heavy modules in sys.modules after running code in a fresh interpreter
+    script = code + '\nimport sys\nprint(",".join(sorted(m for m in {} if m in sys.modules)))'.format(HEAVY_MODULES)
+    env = dict(os.environ, PYTHONPATH=SRC_PATH)
+    result = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return [m for m in result.stdout.strip().split(',') if m != '']
+
+def test_import_is_light():
+    assert imported_after('import ginpipe.run, ginpipe.core, ginpipe.utils') == []
+
+def test_joblib_is_imported_on_first_save(tmp_path):
+    code = '\n'.join(['from ginpipe.core import new_state, execute_pipeline',
+                      'state = new_state({})',
+                      'state.output_dir = {!r}'.format(str(tmp_path)),
+                      'def task(state):',
+                      '    state["a"] = 1',
+                      '    return state',
+                      'execute_pipeline(state, tasks=[task], is_main=True)'])
+    assert 'joblib' in imported_after(code)
+
+def test_sympy_is_only_imported_for_fallback():
+    code = '\n'.join(['from ginpipe.operations import evaluate_arithmetic',
+                      'assert evaluate_arithmetic("2**3 + 1") == "9"'])
+    assert 'sympy' not in imported_after(code)
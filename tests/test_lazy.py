@@ -0,0 +1,74 @@
+import pytest
+from ginpipe.core import execute_pipeline
+from ginpipe.storage import LazyValue, NumpyBackend, JoblibBackend
+
+def produce(state):
+    state['d'] = {'a': 1}
+    state['big'] = list(range(100000))
+    state['small'] = 'x'
+    return state
+
+def test_keys_are_loaded_on_access(tmp_path, fresh_state):
+    execute_pipeline(fresh_state(tmp_path), tasks=[produce], is_main=True)
+    seen = {}
+    def check(state):
+        seen['lazy'] = isinstance(state._internal_state['big'], LazyValue)
+        seen['big'] = len(state['big'])
+        return state
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=[produce, check], is_main=True)
+    assert seen == {'lazy': True, 'big': 100000}
+    #Not loaded by resuming
+    assert isinstance(state._internal_state['d'], LazyValue)
+
+def test_unchanged_values_are_evicted(tmp_path, fresh_state):
+    execute_pipeline(fresh_state(tmp_path), tasks=[produce], is_main=True)
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=[produce], is_main=True)
+    assert state['d'] == {'a': 1}
+    state.evict()
+    assert isinstance(state._internal_state['d'], LazyValue)
+
+def test_values_modified_in_place_are_not_evicted(tmp_path, fresh_state):
+    execute_pipeline(fresh_state(tmp_path), tasks=[produce], is_main=True)
+    def modify(state):
+        #Modified without assigning the key
+        state['d']['b'] = 2
+        return state
+    def read_big(state):
+        state['n'] = len(state['big'])
+        return state
+    def read_d(state):
+        state['d_keys'] = sorted(state['d'])
+        return state
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=[produce, modify, read_big, read_d], is_main=True, max_loaded_size=1)
+    assert state['d_keys'] == ['a', 'b']
+    #big was loaded after d, so d was over the limit
+    assert not isinstance(state._internal_state['d'], LazyValue)
+
+def test_read_only_arrays_are_evicted(tmp_path, fresh_state):
+    np = pytest.importorskip('numpy')
+    def arrays(state):
+        state['arr'] = np.arange(1000, dtype=np.float64)
+        return state
+    backends = [NumpyBackend(min_size=0), JoblibBackend()]
+    execute_pipeline(fresh_state(tmp_path), tasks=[arrays], is_main=True, storage_backends=backends)
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=[arrays], is_main=True, storage_backends=backends)
+    assert not state['arr'].flags.writeable
+    state.evict()
+    assert isinstance(state._internal_state['arr'], LazyValue)
+
+def test_nested_pipeline_does_not_load_unread_keys(tmp_path, fresh_state):
+    execute_pipeline(fresh_state(tmp_path), tasks=[produce], is_main=True)
+    def read_small(state):
+        state['n'] = len(state['small'])
+        return state
+    def nested(state):
+        execute_pipeline(state, tasks=[read_small])
+        return state
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=[produce, nested], is_main=True)
+    assert state['n'] == 1
+    assert isinstance(state._internal_state['big'], LazyValue)
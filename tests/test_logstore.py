@@ -0,0 +1,125 @@
+from pathlib import Path
+import numpy as np
+import pytest
+from ginpipe.core import execute_pipeline
+from ginpipe.logstore import CheckpointLog, LogIndex, LogValue, JOURNAL_FILENAME, INDEX_FILENAME, SEGMENT_SUFFIX
+
+def produce(state):
+    calls.append('produce')
+    state['a'] = {'x': 1}
+    state['arr'] = np.arange(1000, dtype=np.float64)
+    return state
+
+def consume(state):
+    calls.append('consume')
+    state['b'] = state['a']['x'] + 1
+    return state
+
+def segment_files(path):
+    return sorted(Path(path).glob('*' + SEGMENT_SUFFIX))
+
+@pytest.mark.parametrize('async_save', [False, True])
+def test_pipeline_resumes_from_the_log(tmp_path, async_save, fresh_state, calls):
+    store = CheckpointLog(fsync=False, min_array_size=1024)
+    execute_pipeline(fresh_state(tmp_path), tasks=[produce, consume], is_main=True, checkpoint_store=store, async_save=async_save)
+    store.close()
+    state_path = Path(tmp_path, 'state')
+    assert len(segment_files(state_path)) == 1
+    assert not Path(state_path, 'a.pkl').exists()
+    store = CheckpointLog(fsync=False, min_array_size=1024)
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=[produce, consume], is_main=True, checkpoint_store=store)
+    assert calls == ['produce', 'consume']
+    assert isinstance(state._internal_state['b'], LogValue)
+    assert state['b'] == 2
+    #Raw arrays are memory-mapped from the segment
+    assert isinstance(state['arr'], np.memmap)
+    assert state['arr'].offset % 64 == 0
+    np.testing.assert_array_equal(state['arr'], np.arange(1000))
+    store.close()
+
+def test_uncommitted_values_are_ignored(tmp_path):
+    store = CheckpointLog(fsync=False)
+    store.put(tmp_path, 'a', 1)
+    store.commit(tmp_path, manifest_entries=[{'index': 0}])
+    store.put(tmp_path, 'a', 2)
+    store.put(tmp_path, 'b', 3)
+    #Crash before the commit
+    store.open(tmp_path).file.flush()
+    reopened = CheckpointLog(fsync=False)
+    assert {k: h.load() for k, h in reopened.handles(tmp_path).items()} == {'a': 1}
+    assert reopened.manifest(tmp_path) == [{'index': 0}]
+    store.close()
+
+def test_torn_journal_line_is_dropped(tmp_path):
+    store = CheckpointLog(fsync=False)
+    store.put(tmp_path, 'a', 1, fp='fa')
+    store.commit(tmp_path)
+    store.close()
+    journal_path = Path(tmp_path, JOURNAL_FILENAME)
+    size = journal_path.stat().st_size
+    with open(journal_path, 'ab') as f:
+        f.write(b'{"keys": {"a": {"segm')
+    store = CheckpointLog(fsync=False)
+    assert store.fingerprints(tmp_path) == {'a': 'fa'}
+    assert journal_path.stat().st_size == size
+    #Later commits are not appended to the torn line
+    store.put(tmp_path, 'b', 2)
+    store.commit(tmp_path)
+    store.close()
+    assert sorted(CheckpointLog(fsync=False).handles(tmp_path)) == ['a', 'b']
+
+def test_manifest_entries_are_appended(tmp_path):
+    store = CheckpointLog(fsync=False)
+    store.commit(tmp_path, manifest=[{'index': 0}])
+    store.commit(tmp_path, manifest_entries=[{'index': 1}])
+    store.commit(tmp_path, manifest=[{'index': 5}])
+    store.commit(tmp_path, manifest_entries=[{'index': 6}])
+    store.close()
+    assert CheckpointLog(fsync=False).manifest(tmp_path) == [{'index': 5}, {'index': 6}]
+
+def test_compaction_keeps_live_values(tmp_path):
+    store = CheckpointLog(fsync=False, segment_size=16384, min_compact_size=32768, compact_ratio=0.5)
+    for i in range(20):
+        store.put(tmp_path, 'a', [str(j) for j in range(1000 + i)], codec='zlib:1' if i % 2 else None)
+        store.put(tmp_path, 'b', i)
+        store.commit(tmp_path, manifest_entries=[{'index': i}])
+    assert Path(tmp_path, INDEX_FILENAME).exists()
+    total = sum([f.stat().st_size for f in segment_files(tmp_path)])
+    assert total < 32768
+    handles = store.handles(tmp_path)
+    assert handles['a'].load() == [str(j) for j in range(1019)]
+    assert handles['b'].load() == 19
+    store.close()
+    reopened = CheckpointLog(fsync=False)
+    assert reopened.handles(tmp_path)['a'].load() == [str(j) for j in range(1019)]
+    assert len(reopened.manifest(tmp_path)) == 20
+
+def test_handles_survive_compaction(tmp_path):
+    store = CheckpointLog(fsync=False, min_compact_size=1, compact_ratio=0.1)
+    store.put(tmp_path, 'a', 'first')
+    store.commit(tmp_path)
+    handle = store.handles(tmp_path)['a']
+    store.put(tmp_path, 'b', 'x'*1000)
+    store.commit(tmp_path)
+    store.put(tmp_path, 'b', 'y'*1000)
+    store.commit(tmp_path)
+    assert handle.load() == 'first'
+    store.close()
+
+def test_index_reader_does_not_modify_the_log(tmp_path):
+    store = CheckpointLog(fsync=False)
+    store.put(tmp_path, 'a', 1, fp='fa')
+    store.commit(tmp_path, manifest_entries=[{'index': 0}])
+    #A commit being written
+    store.open(tmp_path).journal.write(b'{"keys": {"a": {"segm')
+    store.open(tmp_path).journal.flush()
+    files = {f.name: f.stat().st_size for f in Path(tmp_path).iterdir()}
+    index = LogIndex(tmp_path)
+    assert index.handles()['a'].load() == 1
+    assert index.fingerprints() == {'a': 'fa'}
+    assert index.manifest == [{'index': 0}]
+    assert {f.name: f.stat().st_size for f in Path(tmp_path).iterdir()} == files
+    assert LogIndex(Path(tmp_path, 'missing')).handles() == {}
+    assert not Path(tmp_path, 'missing').exists()
+    store.close()
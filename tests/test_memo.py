@@ -0,0 +1,66 @@
+from pathlib import Path
+import threading
+import time
+import pytest
+from ginpipe.core import execute_pipeline
+from ginpipe.memo import TaskCache
+
+def double(state):
+    calls.append('double')
+    state['y'] = state['x']*2
+    return state
+
+def test_outputs_are_reused_by_other_experiments(tmp_path, fresh_state, calls):
+    cache = TaskCache(cache_dir=tmp_path / 'cache')
+    execute_pipeline(fresh_state(tmp_path / 'a', x=1), tasks=[double], is_main=True, task_cache=cache)
+    state = fresh_state(tmp_path / 'b', x=1)
+    execute_pipeline(state, tasks=[double], is_main=True, task_cache=cache)
+    assert calls == ['double']
+    assert state['y'] == 2
+    #Reused outputs are recorded and saved like computed ones
+    assert Path(tmp_path, 'b', 'state', 'y.pkl').exists()
+    assert [e['task'] for e in state['task_manifest']] == ['double']
+
+def test_different_inputs_miss(tmp_path, fresh_state, calls):
+    cache = TaskCache(cache_dir=tmp_path / 'cache')
+    execute_pipeline(fresh_state(tmp_path / 'a', x=1), tasks=[double], is_main=True, task_cache=cache)
+    state = fresh_state(tmp_path / 'b', x=3)
+    execute_pipeline(state, tasks=[double], is_main=True, task_cache=cache)
+    assert calls == ['double', 'double']
+    assert state['y'] == 6
+
+def test_changed_code_misses(tmp_path, fresh_state, calls):
+    cache = TaskCache(cache_dir=tmp_path / 'cache')
+    def triple(state):
+        calls.append('triple')
+        state['y'] = state['x']*3
+        return state
+    triple.__name__ = 'double'
+    execute_pipeline(fresh_state(tmp_path / 'a', x=1), tasks=[double], is_main=True, task_cache=cache)
+    state = fresh_state(tmp_path / 'b', x=1)
+    execute_pipeline(state, tasks=[triple], is_main=True, task_cache=cache)
+    assert state['y'] == 3
+
+def test_unhashable_inputs_are_not_cached(tmp_path, fresh_state, calls):
+    cache = TaskCache(cache_dir=tmp_path / 'cache')
+    def use_lock(state):
+        calls.append('use_lock')
+        state['z'] = state['lock'] is not None
+        return state
+    for d in ['a', 'b']:
+        state = fresh_state(tmp_path / d, x=1)
+        state['lock'] = threading.Lock()
+        execute_pipeline(state, tasks=[use_lock], is_main=True, task_cache=cache)
+    assert calls == ['use_lock', 'use_lock']
+    assert list(Path(tmp_path, 'cache', 'entries').iterdir()) == []
+
+def test_least_recently_used_entries_are_evicted(tmp_path, fresh_state):
+    cache = TaskCache(cache_dir=tmp_path / 'cache')
+    for x in [1, 2]:
+        execute_pipeline(fresh_state(tmp_path / str(x), x=x), tasks=[double], is_main=True, task_cache=cache)
+        time.sleep(0.01)
+    entries = sorted(Path(tmp_path, 'cache', 'entries').iterdir(), key=lambda f: f.stat().st_mtime)
+    assert len(entries) == 2
+    cache.max_size = entries[-1].stat().st_size
+    cache.evict()
+    assert [f.name for f in Path(tmp_path, 'cache', 'entries').iterdir()] == [entries[-1].name]
@@ -0,0 +1,36 @@
+import pytest
+from ginpipe.operations import evaluate_arithmetic, evaluate_operation
+
+EXPRESSIONS = [
+    ('2^3+1', '9'),
+    ('2*3^2', '18'),
+    ('-2^2', '-4'),
+    ('2^3^2', '512'),
+    ('(2^3)^2', '64'),
+    ('2**3', '8'),
+    ('7/2', '3.5'),
+    ('6/3', '2'),
+    ('7//2', '3'),
+    ('7%3', '1'),
+    ('2.5*2', '5.0'),
+    ('1/3', '0.333333333333333'),
+    ('2^-1', '0.5'),
+]
+
+@pytest.mark.parametrize('expr,expected', EXPRESSIONS)
+def test_arithmetic(expr, expected):
+    assert evaluate_arithmetic(expr) == expected
+
+@pytest.mark.parametrize('expr', [e for e, _ in EXPRESSIONS if '//' not in e and '%' not in e and '.' not in e])
+def test_same_as_sympy(expr):
+    sympy = pytest.importorskip('sympy')
+    assert float(evaluate_arithmetic(expr)) == pytest.approx(float(sympy.sympify(expr)))
+
+@pytest.mark.parametrize('expr', ['__import__("os")', 'x+1', '2^100000', '[1]*3', '1/0'])
+def test_rejected(expr):
+    with pytest.raises(Exception, match='Could not evaluate operation'):
+        evaluate_operation(expr)
+
+def test_sympy_fallback():
+    pytest.importorskip('sympy')
+    assert evaluate_operation('sqrt(16)', sympy_fallback=True) == '4'
@@ -0,0 +1,58 @@
+from pathlib import Path
+import pytest
+from ginpipe.core import execute_pipeline
+from ginpipe.manifest import load_manifest
+from ginpipe.storage import load_fingerprints, list_saved_keys, default_backends
+
+def make_task(name, reads=(), fail=None):
+    def task(state):
+        calls.append(name)
+        state[name] = sum([state[k] for k in reads]) + 1
+        if (fail is not None) and fail():
+            raise ValueError('{} failed'.format(name))
+        return state
+    task.__name__ = name
+    return task
+
+def saved_value(output_dir, k):
+    return list_saved_keys(Path(output_dir, 'state'), default_backends())[k].load()
+
+def test_sequential_run_saves_outputs_and_manifest(tmp_path, fresh_state):
+    tasks = [make_task('a'), make_task('b', ['a'])]
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=tasks, is_main=True)
+    assert (state['a'], state['b']) == (1, 2)
+    manifest = load_manifest(Path(tmp_path, 'state'))
+    assert [e['task'] for e in manifest] == ['a', 'b']
+    assert manifest[1]['inputs'].keys() == {'a'}
+    #Times are kept in the manifest even if the run is killed before saving execution_times
+    assert manifest[1]['wall_time'] == state['execution_times']['b_0']['wall_time']
+    assert 'process_time' in manifest[1]
+    assert saved_value(tmp_path, 'b') == 2
+    assert set(saved_value(tmp_path, 'execution_times')) == {'a_0', 'b_0'}
+    assert saved_value(tmp_path, 'task_io')['b'] == {'reads': ['a'], 'writes': ['b']}
+
+def test_bookkeeping_is_not_saved_after_each_task(tmp_path, fresh_state):
+    saved_by_task = []
+    def check(state):
+        fps = load_fingerprints(Path(tmp_path, 'state'))
+        saved_by_task.append(sorted(k for k in fps if k in {'execution_times', 'task_io', 'operative_config'}))
+        return state
+    execute_pipeline(fresh_state(tmp_path), tasks=[make_task('a'), check, make_task('b')], is_main=True)
+    assert saved_by_task == [[]]
+    #Saved once the pipeline ends
+    assert {'execution_times', 'task_io', 'operative_config'} <= set(load_fingerprints(Path(tmp_path, 'state')))
+
+def test_manifest_and_fingerprints_are_appended(tmp_path, fresh_state):
+    execute_pipeline(fresh_state(tmp_path), tasks=[make_task(n) for n in 'abc'], is_main=True)
+    assert len(Path(tmp_path, 'state', 'manifest.jsonl').read_text().splitlines()) == 3
+    #One line for the compacted fingerprints, one per task and one for the bookkeeping keys
+    assert len(Path(tmp_path, 'state', 'fingerprints.jsonl').read_text().splitlines()) == 5
+
+def test_bookkeeping_is_saved_on_failure(tmp_path, fresh_state):
+    tasks = [make_task('a'), make_task('b', ['a'], fail=lambda: True)]
+    with pytest.raises(ValueError):
+        execute_pipeline(fresh_state(tmp_path), tasks=tasks, is_main=True)
+    assert set(saved_value(tmp_path, 'execution_times')) == {'a_0'}
+    #Outputs of the failed task are not saved
+    assert 'b' not in list_saved_keys(Path(tmp_path, 'state'), default_backends())
@@ -0,0 +1,119 @@
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import pytest
+from ginpipe.logstore import CheckpointLog
+from ginpipe.manifest import save_manifest
+from ginpipe.plan import critical_path, simulate, estimate, load_history, format_plan, task_name, saved_key
+
+SRC_PATH = str(Path(__file__).resolve().parent.parent / 'src')
+
+STEPS = '''import time
+
+def load(state):
+    time.sleep(0.2)
+    state['data'] = list(range(10))
+    return state
+
+def train(state, epochs=1):
+    time.sleep(0.1)
+    state['model'] = sum(state['data'])*epochs
+    return state
+'''
+
+def run_cli(cwd, *args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SRC_PATH, str(cwd)]))
+    return subprocess.run([sys.executable, '-m', 'ginpipe.run'] + list(args), cwd=cwd, env=env, capture_output=True, text=True, timeout=120)
+
+@pytest.fixture
+def project(tmp_path):
+    Path(tmp_path, 'steps.py').write_text(STEPS)
+    Path(tmp_path, 'modules').write_text('steps: steps\n')
+    Path(tmp_path, 'config.gin').write_text('execute_pipeline.tasks=[@steps.load, @steps.train]\n')
+    result = run_cli(tmp_path, 'config.gin', '--module_list', 'modules', '--experiment_name', 'first')
+    assert result.returncode == 0, result.stderr
+    return tmp_path
+
+def plan(cwd, name, *mods):
+    args = ['plan', 'config.gin', '--module_list', 'modules', '--experiment_name', name, '--output', 'plan.json']
+    if mods:
+        args += ['--mods'] + list(mods)
+    result = run_cli(cwd, *args)
+    assert result.returncode == 0, result.stderr
+    return json.loads(Path(cwd, 'plan.json').read_text()), result.stdout
+
+def test_critical_path_and_simulation():
+    deps = [set(), set(), {0, 1}, set()]
+    durations = [2, 3, 1, 4]
+    assert critical_path(deps, durations) == 4
+    assert simulate(deps, durations, 4) == 4
+    #With one worker tasks run one after the other
+    assert simulate(deps, durations, 1) == 10
+    assert simulate(deps, durations, 2) == 6
+
+def test_estimates_are_medians():
+    history = {'train': {'wall_time': [1, 2, 10]}}
+    assert estimate(history, 'train') == {'wall_time': 2, 'samples': 3}
+    assert estimate(history, 'other') == {'samples': 0}
+    assert task_name('train_model_0') == 'train_model'
+
+def test_completed_experiment_is_skipped(project):
+    result, stdout = plan(project, 'first')
+    assert [r['action'] for r in result['tasks']] == ['skip', 'skip']
+    assert result['sequential_time'] == 0
+    assert '2 of 2 tasks skipped' in stdout
+
+def test_new_experiment_uses_history(project):
+    result, stdout = plan(project, 'second', 'steps.train.epochs=2')
+    assert [r['action'] for r in result['tasks']] == ['run', 'run']
+    load_time = result['tasks'][0]['expected_time']
+    assert load_time >= 0.2
+    assert result['tasks'][0]['estimate']['samples'] == 1
+    assert result['sequential_time'] == pytest.approx(load_time + result['tasks'][1]['expected_time'])
+    assert result['no_history'] == []
+    #The plan doesn't run anything
+    assert not Path(project, 'experiments', 'my_project', 'second', 'state').exists()
+
+def test_changed_binding_resumes_from_the_task(project):
+    #Same experiment, train changed: load is skipped
+    result, _ = plan(project, 'first', 'steps.train.epochs=3')
+    assert [r['action'] for r in result['tasks']] == ['skip', 'run']
+
+def test_unknown_tasks_are_reported():
+    plan_ = {'output_dir': 'x', 'execution_order': 'sequential', 'n_skipped': 0, 'no_history': ['new'],
+             'sequential_time': 0, 'dag_time': 0, 'dag_critical_path': 0, 'max_workers': 2,
+             'tasks': [{'index': 0, 'task': 'new', 'action': 'run', 'expected_time': 0, 'estimate': {'samples': 0}}]}
+    text = format_plan(plan_)
+    assert 'No previous executions of new' in text
+    assert text.split('\n')[2].split()[:4] == ['0', 'new', 'run', '?']
+
+def test_history_from_profiles(tmp_path):
+    exp = Path(tmp_path, 'exp')
+    exp.mkdir()
+    Path(exp, 'profile.json').write_text(json.dumps({'tasks': [{'task': 'train', 'wall_time': 3, 'save_time': 1, 'peak_rss_mb': 100}]}))
+    history = load_history([exp])
+    assert history['train'] == {'peak_rss_mb': [100], 'wall_time': [3], 'save_time': [1]}
+
+def test_history_of_killed_runs_comes_from_the_manifest(tmp_path):
+    state_path = Path(tmp_path, 'exp', 'state')
+    state_path.mkdir(parents=True)
+    save_manifest([{'index': 0, 'task': 'load', 'wall_time': 4, 'process_time': 1},
+                   {'index': 1, 'task': 'train', 'wall_time': 2, 'process_time': 2}], state_path)
+    history = load_history([Path(tmp_path, 'exp')])
+    assert history == {'load': {'wall_time': [4]}, 'train': {'wall_time': [2]}}
+
+def test_history_of_a_running_log_is_read_only(tmp_path):
+    state_path = Path(tmp_path, 'exp', 'state')
+    store = CheckpointLog(fsync=False)
+    store.put(state_path, 'execution_times', {'train_0': {'wall_time': 2}})
+    store.commit(state_path)
+    store.open(state_path).journal.write(b'{"keys": {"execution_times": {"segm')
+    store.open(state_path).journal.flush()
+    files = {f.name: f.stat().st_size for f in state_path.iterdir()}
+    assert load_history([Path(tmp_path, 'exp')])['train'] == {'wall_time': [2]}
+    assert {f.name: f.stat().st_size for f in state_path.iterdir()} == files
+    assert saved_key(Path(tmp_path, 'other'), 'execution_times') is None
+    assert not Path(tmp_path, 'other').exists()
+    store.close()
@@ -0,0 +1,53 @@
+import json
+from pathlib import Path
+import time
+import tracemalloc
+import pytest
+from ginpipe.core import execute_pipeline
+from ginpipe.dag import declare_io
+from ginpipe.profiling import ResourceInstrument, TracemallocInstrument, CProfileInstrument, PROFILE_FILENAME, TRACE_FILENAME
+
+@declare_io(writes=['a'])
+def first(state):
+    state['a'] = 1
+    return state
+
+def allocating(name):
+    @declare_io(reads=['a'], writes=[name])
+    def task(state):
+        state[name] = [bytearray(1000) for _ in range(1000)]
+        time.sleep(0.1)
+        return state
+    task.__name__ = name
+    return task
+
+def load_profile(output_dir):
+    with open(Path(output_dir, PROFILE_FILENAME), 'r') as f:
+        return json.load(f)
+
+def test_sequential_profile(tmp_path, fresh_state):
+    instruments = [ResourceInstrument(), TracemallocInstrument(), CProfileInstrument()]
+    execute_pipeline(fresh_state(tmp_path), tasks=[first, allocating('b')], is_main=True, instruments=instruments)
+    records = load_profile(tmp_path)['tasks']
+    assert [(r['index'], r['task']) for r in records] == [(0, 'first'), (1, 'b')]
+    assert records[1]['traced_peak_mb'] >= 1
+    assert 'peak_rss_mb' in records[1]
+    assert Path(tmp_path, 'profiles', '1_b.prof').exists()
+    assert Path(tmp_path, TRACE_FILENAME).exists()
+    assert not tracemalloc.is_tracing()
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_dag_profile_uses_pipeline_indices(tmp_path, executor, fresh_state):
+    execute_pipeline(fresh_state(tmp_path), tasks=[first], is_main=True)
+    tasks = [first, allocating('b'), allocating('c')]
+    execute_pipeline(fresh_state(tmp_path), tasks=tasks, is_main=True, execution_order='dag', executor=executor,
+                     instruments=[TracemallocInstrument(), CProfileInstrument()])
+    records = load_profile(tmp_path)['tasks']
+    assert sorted([(r['index'], r['task']) for r in records]) == [(1, 'b'), (2, 'c')]
+    assert Path(tmp_path, 'profiles', '2_c.prof').exists()
+    for r in records:
+        assert r['traced_growth_mb'] is not None
+    if executor == 'thread':
+        #b and c run at the same time, so the peak of the process is not theirs
+        assert all(['traced_peak_mb' not in r for r in records])
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,172 @@
+import gin
+from pathlib import Path
+import pytest
+from ginpipe.core import execute_pipeline
+from ginpipe.manifest import task_bindings, called_configurables
+from ginpipe.memo import TaskCache
+
+@gin.configurable
+def scale(x, factor=1):
+    return x*factor
+
+@gin.configurable
+class Model:
+    def __init__(self, width=1):
+        self.width = width
+
+def build(state):
+    return scale(state['x'])
+
+def compute(state):
+    calls.append('compute')
+    state['y'] = build(state)
+    return state
+
+def make_model(state):
+    calls.append('make_model')
+    state['width'] = Model().width
+    return state
+
+@pytest.fixture(autouse=True)
+def clear_config():
+    gin.clear_config()
+    yield
+    gin.clear_config()
+
+def test_called_configurables_are_found():
+    gin.parse_config('scale.factor = 3')
+    calls_ = called_configurables(compute)
+    assert calls_ == {'{}.scale'.format(__name__): {'factor': '3'}}
+    assert '{}.Model'.format(__name__) in called_configurables(make_model)
+    assert task_bindings(compute)['__calls__'] == calls_
+
+def test_bindings_of_called_configurables_invalidate_resume(tmp_path, fresh_state, calls):
+    gin.parse_config('scale.factor = 3')
+    execute_pipeline(fresh_state(tmp_path, x=2), tasks=[compute, make_model], is_main=True)
+    state = fresh_state(tmp_path, x=2)
+    execute_pipeline(state, tasks=[compute, make_model], is_main=True)
+    assert calls == ['compute', 'make_model']
+    gin.parse_config('scale.factor = 5')
+    state = fresh_state(tmp_path, x=2)
+    execute_pipeline(state, tasks=[compute, make_model], is_main=True)
+    assert calls == ['compute', 'make_model', 'compute', 'make_model']
+    assert state['y'] == 10
+    gin.parse_config('Model.width = 4')
+    state = fresh_state(tmp_path, x=2)
+    execute_pipeline(state, tasks=[compute, make_model], is_main=True)
+    assert calls[4:] == ['make_model']
+    assert state['width'] == 4
+
+def test_rerun_tasks_forces_execution(tmp_path, fresh_state, calls):
+    execute_pipeline(fresh_state(tmp_path, x=2), tasks=[compute, make_model], is_main=True)
+    execute_pipeline(fresh_state(tmp_path, x=2), tasks=[compute, make_model], is_main=True, rerun_tasks=['make_model'])
+    assert calls == ['compute', 'make_model', 'make_model']
+
+def test_task_cache_keyed_on_called_configurables(tmp_path, fresh_state, calls):
+    cache = TaskCache(cache_dir=tmp_path / 'cache')
+    gin.parse_config('scale.factor = 3')
+    execute_pipeline(fresh_state(tmp_path / 'a', x=2), tasks=[compute], is_main=True, task_cache=cache)
+    execute_pipeline(fresh_state(tmp_path / 'b', x=2), tasks=[compute], is_main=True, task_cache=cache)
+    assert calls == ['compute']
+    gin.parse_config('scale.factor = 4')
+    state = fresh_state(tmp_path / 'c', x=2)
+    execute_pipeline(state, tasks=[compute], is_main=True, task_cache=cache)
+    assert calls == ['compute', 'compute']
+    assert state['y'] == 8
+    execute_pipeline(fresh_state(tmp_path / 'd', x=2), tasks=[compute], is_main=True, task_cache=cache, rerun_tasks=['compute'])
+    assert calls == ['compute', 'compute', 'compute']
+
+def counted(name, reads=()):
+    def task(state):
+        calls.append(name)
+        state[name] = sum([state[k] for k in reads]) + 1
+        return state
+    task.__name__ = name
+    return task
+
+def pipeline():
+    return [counted('a', ['x']), counted('b'), counted('c', ['a', 'b'])]
+
+def test_completed_tasks_are_skipped(tmp_path, fresh_state, calls):
+    execute_pipeline(fresh_state(tmp_path, x=2), tasks=pipeline(), is_main=True)
+    state = fresh_state(tmp_path, x=2)
+    execute_pipeline(state, tasks=pipeline(), is_main=True)
+    assert calls == ['a', 'b', 'c']
+    assert state['c'] == 5
+
+def test_changed_input_resumes_from_its_reader(tmp_path, fresh_state, calls):
+    execute_pipeline(fresh_state(tmp_path, x=2), tasks=pipeline(), is_main=True)
+    state = fresh_state(tmp_path, x=2)
+    state['x'] = 10
+    execute_pipeline(state, tasks=pipeline(), is_main=True)
+    assert calls == ['a', 'b', 'c', 'a', 'b', 'c']
+    assert state['c'] == 13
+
+def test_torn_manifest_line_reruns_the_task(tmp_path, fresh_state, calls):
+    execute_pipeline(fresh_state(tmp_path, x=2), tasks=pipeline(), is_main=True)
+    manifest_path = Path(tmp_path, 'state', 'manifest.jsonl')
+    lines = manifest_path.read_text().splitlines(keepends=True)
+    manifest_path.write_text(''.join(lines[:2]) + lines[2][:10])
+    execute_pipeline(fresh_state(tmp_path, x=2), tasks=pipeline(), is_main=True)
+    assert calls == ['a', 'b', 'c', 'c']
+
+def test_missing_output_reruns_the_task(tmp_path, fresh_state, calls):
+    execute_pipeline(fresh_state(tmp_path, x=2), tasks=pipeline(), is_main=True)
+    Path(tmp_path, 'state', 'b.pkl').unlink()
+    state = fresh_state(tmp_path, x=2)
+    execute_pipeline(state, tasks=pipeline(), is_main=True)
+    assert calls == ['a', 'b', 'c', 'b', 'c']
+    assert state['c'] == 5
+
+def init(state):
+    calls.append('init')
+    state['a'] = 1
+    return state
+
+@gin.configurable
+def bump(state, step=1):
+    calls.append('bump')
+    state['a'] = state['a'] + step
+    return state
+
+def report(state):
+    calls.append('report')
+    state['r'] = state['a']
+    return state
+
+def test_overwritten_key_resumes_from_its_writer(tmp_path, fresh_state, calls):
+    execute_pipeline(fresh_state(tmp_path), tasks=[init, bump, report], is_main=True)
+    gin.parse_config('bump.step = 10')
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=[init, bump, report], is_main=True)
+    #The a saved on disk is the one written by bump, init runs again to get the a bump reads
+    assert calls == ['init', 'bump', 'report', 'init', 'bump', 'report']
+    assert state['r'] == 11
+
+def test_keys_written_after_the_resume_point_are_dropped(tmp_path, fresh_state):
+    def peek(state):
+        state['seen'] = state.get('r')
+        return state
+    execute_pipeline(fresh_state(tmp_path), tasks=[init, bump, report], is_main=True)
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=[init, peek, bump, report], is_main=True)
+    #r is only written by report, so a fresh run doesn't have it when peek runs
+    assert state['seen'] is None
+    assert state['r'] == 2
+
+def run_nested(state):
+    calls.append('run_nested')
+    execute_pipeline(state, tasks=[counted('x1', ['a']), counted('x2', ['x1'])])
+    return state
+
+def test_nested_pipeline_keeps_the_outer_manifest(tmp_path, fresh_state, calls):
+    tasks = [counted('a'), run_nested, counted('c', ['x2'])]
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=tasks, is_main=True)
+    assert [(e['index'], e['task']) for e in state['task_manifest']] == [(0, 'a'), (1, 'run_nested'), (2, 'c')]
+    assert state['task_manifest'][1]['inputs'].keys() == {'a'}
+    assert state['task_manifest'][1]['outputs'].keys() == {'x1', 'x2'}
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=tasks, is_main=True)
+    assert calls == ['a', 'run_nested', 'x1', 'x2', 'c']
+    assert state['c'] == 4
@@ -0,0 +1,114 @@
+import os
+from pathlib import Path
+import signal
+import socket
+import subprocess
+import sys
+import time
+import pytest
+from ginpipe.serve import open_socket
+from ginpipe.submit import submit
+
+SRC_PATH = str(Path(__file__).resolve().parent.parent / 'src')
+
+STEPS = '''import os
+import time
+with open('imports.txt', 'a') as f:
+    f.write('steps\\n')
+
+def add(state, n=1):
+    print('adding', n)
+    state['total'] = n + 1
+    return state
+
+def fail(state):
+    raise ValueError('task failed')
+
+def slow(state):
+    with open('started.txt', 'w') as f:
+        f.write(str(os.getpid()))
+    time.sleep(60)
+    return state
+'''
+
+def wait_for(condition, timeout=30):
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:
+            raise TimeoutError()
+        time.sleep(0.05)
+
+@pytest.fixture
+def daemon(tmp_path):
+    Path(tmp_path, 'steps.py').write_text(STEPS)
+    Path(tmp_path, 'modules').write_text('steps: steps\n')
+    socket_path = Path(tmp_path, 'serve.sock')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SRC_PATH, str(tmp_path)]))
+    p = subprocess.Popen([sys.executable, '-m', 'ginpipe.run', 'serve', '--module_list', 'modules', '--socket', str(socket_path), '--workers', '1'],
+                         cwd=tmp_path, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for(lambda: socket_path.exists())
+    yield tmp_path, socket_path
+    p.send_signal(signal.SIGTERM)
+    p.wait(timeout=30)
+    assert not socket_path.exists()
+
+def run_submit(cwd, socket_path, config, *args):
+    Path(cwd, 'config.gin').write_text(config)
+    env = dict(os.environ, PYTHONPATH=SRC_PATH)
+    cmd = [sys.executable, '-m', 'ginpipe.run', 'submit', 'config.gin', '--socket', str(socket_path)] + list(args)
+    return subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, text=True, timeout=120)
+
+def test_jobs_run_in_the_warm_daemon(daemon):
+    cwd, socket_path = daemon
+    for i, n in enumerate([1, 5]):
+        result = run_submit(cwd, socket_path, 'execute_pipeline.tasks=[@steps.add]\n', '--mods', 'steps.add.n={}'.format(n), '--experiment_name', 'e{}'.format(i))
+        assert result.returncode == 0, result.stdout
+        assert 'adding {}'.format(n) in result.stdout
+        assert Path(cwd, 'experiments', 'my_project', 'e{}'.format(i), 'state', 'total.pkl').exists()
+    #Imported once by the daemon, not by the jobs
+    assert Path(cwd, 'imports.txt').read_text() == 'steps\n'
+
+def test_failed_job_exit_code(daemon):
+    cwd, socket_path = daemon
+    result = run_submit(cwd, socket_path, 'execute_pipeline.tasks=[@steps.fail]\n')
+    assert result.returncode == 1
+    assert 'task failed' in result.stdout
+
+def test_disconnecting_stops_the_job(daemon):
+    cwd, socket_path = daemon
+    Path(cwd, 'config.gin').write_text('execute_pipeline.tasks=[@steps.slow]\n')
+    env = dict(os.environ, PYTHONPATH=SRC_PATH)
+    client = subprocess.Popen([sys.executable, '-m', 'ginpipe.run', 'submit', 'config.gin', '--socket', str(socket_path)],
+                              cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for(lambda: Path(cwd, 'started.txt').exists() and Path(cwd, 'started.txt').read_text() != '')
+    pid = int(Path(cwd, 'started.txt').read_text())
+    client.kill()
+    client.wait()
+    def stopped():
+        try:
+            os.kill(pid, 0)
+            return False
+        except ProcessLookupError:
+            return True
+    wait_for(stopped)
+    #A new worker takes the next job
+    result = run_submit(cwd, socket_path, 'execute_pipeline.tasks=[@steps.add]\n')
+    assert result.returncode == 0, result.stdout
+
+def test_second_daemon_is_refused(daemon):
+    _, socket_path = daemon
+    with pytest.raises(Exception, match='A daemon is already listening'):
+        open_socket(socket_path)
+
+def test_stale_socket_is_replaced(tmp_path):
+    socket_path = Path(tmp_path, 'serve.sock')
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(socket_path))
+    stale.close()
+    server = open_socket(socket_path)
+    assert oct(socket_path.stat().st_mode & 0o777) == oct(0o600)
+    server.close()
+
+def test_submit_without_daemon(tmp_path):
+    with pytest.raises(Exception, match='Could not connect'):
+        submit({}, Path(tmp_path, 'missing.sock'))
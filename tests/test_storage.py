@@ -0,0 +1,99 @@
+import json
+from pathlib import Path
+import numpy as np
+from ginpipe.storage import (ChunkedBackend, JoblibBackend, NumpyBackend, default_backends, list_saved_keys,
+                             save_value, load_fingerprints, save_fingerprints, append_fingerprints)
+
+def backends():
+    return [NumpyBackend(min_size=1024), ChunkedBackend(min_items=100, chunk_size=10), JoblibBackend()]
+
+def load(state_path, k):
+    return list_saved_keys(state_path, backends())[k].load()
+
+def test_values_roundtrip_with_each_backend(tmp_path):
+    values = {'array': np.arange(1000), 'items': list(range(1000)), 'mapping': {i: str(i) for i in range(200)}, 'small': {'a': 1}}
+    for k, v in values.items():
+        save_value(k, v, tmp_path, backends())
+    assert sorted([f.name for f in tmp_path.iterdir() if f.is_file()]) == ['array.npy', 'items.chunks', 'mapping.chunks', 'small.pkl']
+    for k, v in values.items():
+        if isinstance(v, np.ndarray):
+            np.testing.assert_array_equal(load(tmp_path, k), v)
+        else:
+            assert load(tmp_path, k) == v
+
+def test_key_moving_backends_removes_old_files(tmp_path):
+    save_value('x', list(range(1000)), tmp_path, backends())
+    assert Path(tmp_path, 'chunks', 'x').exists()
+    save_value('x', [1, 2], tmp_path, backends())
+    assert not Path(tmp_path, 'x.chunks').exists()
+    assert not Path(tmp_path, 'chunks', 'x').exists()
+    assert load(tmp_path, 'x') == [1, 2]
+    save_value('x', np.arange(1000), tmp_path, backends())
+    assert not Path(tmp_path, 'x.pkl').exists()
+
+def test_compressed_value_replaces_array(tmp_path):
+    #Compression skips NumpyBackend, the .npy file must still be removed
+    save_value('x', np.arange(1000), tmp_path, backends())
+    save_value('x', np.arange(1000), tmp_path, backends(), codec='zlib:3')
+    assert [f.name for f in tmp_path.iterdir()] == ['x.pkl']
+    np.testing.assert_array_equal(load(tmp_path, 'x'), np.arange(1000))
+
+def test_chunk_list_records_codec(tmp_path):
+    save_value('x', list(range(1000)), tmp_path, backends(), codec='zlib:3')
+    with open(Path(tmp_path, 'x.chunks'), 'r') as f:
+        assert json.load(f)['codec'] == 'zlib:3'
+    assert load(tmp_path, 'x') == list(range(1000))
+
+def test_chunks_reused_only_with_same_codec(tmp_path):
+    save_value('x', list(range(1000)), tmp_path, backends())
+    first_chunk = sorted(Path(tmp_path, 'chunks', 'x').iterdir())[0]
+    mtime = first_chunk.stat().st_mtime_ns
+    save_value('x', list(range(1010)), tmp_path, backends())
+    assert first_chunk.stat().st_mtime_ns == mtime
+    assert len(list(Path(tmp_path, 'chunks', 'x').iterdir())) == 101
+    save_value('x', list(range(1010)), tmp_path, backends(), codec='zlib:9')
+    #Rewritten as a zlib stream
+    with open(first_chunk, 'rb') as f:
+        assert f.read(1) == b'\x78'
+    assert load(tmp_path, 'x') == list(range(1010))
+
+def test_appended_fingerprints_override_compacted_ones(tmp_path):
+    save_fingerprints({'a': '1', 'b': '2'}, tmp_path)
+    append_fingerprints({'a': '3'}, tmp_path)
+    append_fingerprints({'c': '4'}, tmp_path)
+    assert load_fingerprints(tmp_path) == {'a': '3', 'b': '2', 'c': '4'}
+    #A partial last line from a crash is ignored
+    with open(Path(tmp_path, 'fingerprints.jsonl'), 'a') as f:
+        f.write('{"a": "5"')
+    assert load_fingerprints(tmp_path) == {'a': '3', 'b': '2', 'c': '4'}
+
+def test_default_backends_keep_small_values_in_joblib(tmp_path):
+    save_value('x', [1], tmp_path, default_backends())
+    assert Path(tmp_path, 'x.pkl').exists()
+
+def test_arrays_are_memory_mapped(tmp_path):
+    save_value('x', np.arange(1000, dtype=np.float64), tmp_path, backends())
+    x = load(tmp_path, 'x')
+    assert isinstance(x, np.memmap)
+    assert not x.flags.writeable
+    assert x.offset % 64 == 0
+    np.testing.assert_array_equal(x, np.arange(1000))
+
+def test_copy_on_write_arrays(tmp_path):
+    save_value('x', np.arange(1000), tmp_path, backends())
+    x = list_saved_keys(tmp_path, [NumpyBackend(min_size=1024, mmap_mode='c')])['x'].load()
+    x[0] = 5
+    np.testing.assert_array_equal(load(tmp_path, 'x'), np.arange(1000))
+
+def test_small_and_object_arrays_are_pickled(tmp_path):
+    save_value('small', np.arange(10), tmp_path, backends())
+    save_value('objects', np.array([{'a': i} for i in range(1000)], dtype=object), tmp_path, backends())
+    assert sorted([f.name for f in tmp_path.iterdir()]) == ['objects.pkl', 'small.pkl']
+    assert load(tmp_path, 'objects')[3] == {'a': 3}
+
+def test_new_state_resets_storage_backends(tmp_path):
+    from ginpipe.core import new_state, State
+    state = new_state({})
+    state.set_storage_backends([JoblibBackend()])
+    new_state({})
+    assert [type(b) for b in State._storage_backends] == [type(b) for b in default_backends()]
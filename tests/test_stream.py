@@ -0,0 +1,108 @@
+import itertools
+import threading
+import pytest
+from ginpipe.core import execute_pipeline
+from ginpipe.stream import stream_source, stream_map, stream_sink, fuse_streams
+
+#Sources append the chunks they produce to calls
+@stream_source()
+def numbers(state):
+    for i in range(state['n']):
+        calls.append(i)
+        yield i
+
+@stream_map()
+def square(state, x):
+    return x*x
+
+@stream_map()
+def pairs(state, chunks):
+    batch = []
+    for c in chunks:
+        batch.append(c)
+        if len(batch) == 2:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+@stream_sink(writes=['total'])
+def add(state, chunks):
+    state['total'] = sum(chunks)
+
+@stream_sink(writes=['batches'])
+def collect(state, chunks):
+    state['batches'] = list(chunks)
+
+def test_stages_are_fused(tmp_path, fresh_state):
+    state = fresh_state(tmp_path, n=10)
+    tasks = fuse_streams([numbers, square, add])
+    assert [t.__name__ for t in tasks] == ['numbers+square+add']
+    assert tasks[0]._ginpipe_io == {'reads': set(), 'writes': {'total'}}
+    execute_pipeline(state, tasks=[numbers, square, add], is_main=True)
+    assert state['total'] == sum([i*i for i in range(10)])
+    assert [e['task'] for e in state['task_manifest']] == ['numbers+square+add']
+
+def test_generator_maps_get_the_iterator(tmp_path, fresh_state):
+    state = fresh_state(tmp_path, n=5)
+    execute_pipeline(state, tasks=[numbers, pairs, collect], is_main=True)
+    assert state['batches'] == [[0, 1], [2, 3], [4]]
+
+def test_fused_task_is_skipped_on_resume(tmp_path, fresh_state, calls):
+    execute_pipeline(fresh_state(tmp_path, n=10), tasks=[numbers, square, add], is_main=True)
+    calls.clear()
+    state = fresh_state(tmp_path, n=10)
+    execute_pipeline(state, tasks=[numbers, square, add], is_main=True)
+    assert calls == []
+    assert state['total'] == 285
+
+def test_memory_is_bounded_by_the_queues(tmp_path, fresh_state, calls):
+    ahead = []
+    @stream_sink(writes=['count'])
+    def count(state, chunks):
+        n = 0
+        for c in chunks:
+            n += 1
+            ahead.append(len(calls) - n)
+        state['count'] = n
+    state = fresh_state(tmp_path, n=1000)
+    execute_pipeline(state, tasks=[numbers, square, count], is_main=True, stream_queue_size=4)
+    assert state['count'] == 1000
+    #Two queues of 4 chunks, plus one chunk held by each stage
+    assert max(ahead) <= 2*4 + 3
+
+def test_errors_are_raised_by_the_pipeline(tmp_path, fresh_state):
+    @stream_map()
+    def broken(state, x):
+        if x == 3:
+            raise ValueError('bad chunk')
+        return x
+    threads = threading.active_count()
+    with pytest.raises(ValueError, match='bad chunk'):
+        execute_pipeline(fresh_state(tmp_path, n=10), tasks=[numbers, broken, add], is_main=True)
+    assert threading.active_count() == threads
+
+def test_early_return_stops_the_source(tmp_path, fresh_state, calls):
+    @stream_source()
+    def endless(state):
+        for i in itertools.count():
+            calls.append(i)
+            yield i
+    @stream_sink(writes=['first'])
+    def first(state, chunks):
+        state['first'] = next(iter(chunks))
+    threads = threading.active_count()
+    state = fresh_state(tmp_path, n=10)
+    execute_pipeline(state, tasks=[endless, square, first], is_main=True)
+    assert state['first'] == 0
+    assert threading.active_count() == threads
+
+def test_invalid_streams():
+    with pytest.raises(Exception, match='does not end in a stream_sink'):
+        fuse_streams([numbers, square])
+    with pytest.raises(Exception, match='is not preceded by a stream_source'):
+        fuse_streams([square, add])
+    def plain(state):
+        return state
+    with pytest.raises(Exception, match='does not end in a stream_sink'):
+        fuse_streams([numbers, plain, add])
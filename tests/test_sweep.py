@@ -0,0 +1,117 @@
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import pytest
+from ginpipe.sweep import grid_mods, sweep_experiments
+
+SRC_PATH = str(Path(__file__).resolve().parent.parent / 'src')
+
+STEPS = '''def log_call(name):
+    with open('calls.txt', 'a') as f:
+        f.write(name + '\\n')
+
+def prep(state, scale=1, fail=False):
+    log_call('prep')
+    if fail:
+        raise ValueError('prep failed')
+    state['base'] = scale
+    return state
+
+def train(state, lr=0.1):
+    log_call('train')
+    if lr < 0:
+        raise ValueError('negative lr')
+    state['score'] = state['base']*lr
+    return state
+
+def double(state):
+    log_call('double')
+    state['n'] = state['n']*2
+    return state
+
+def score_n(state, lr=0.1):
+    log_call('score_n')
+    state['score'] = state['n']*lr
+    return state
+'''
+
+CONFIG = '''LR=0.1
+FAIL_PREP=False
+execute_pipeline.tasks=[@prep, @train]
+prep.scale=10
+prep.fail=%FAIL_PREP
+train.lr=%LR
+'''
+
+@pytest.fixture
+def project(tmp_path):
+    Path(tmp_path, 'steps.py').write_text(STEPS)
+    Path(tmp_path, 'modules').write_text('steps: steps\n')
+    Path(tmp_path, 'config.gin').write_text(CONFIG)
+    return tmp_path
+
+def run_sweep(cwd, *args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SRC_PATH, str(cwd)]))
+    cmd = [sys.executable, '-c', 'import sys; from ginpipe.sweep import main; sys.exit(main(sys.argv[1:]))',
+           'config.gin', '--module_list', 'modules', '--experiment_name', 'sweep', '--summary_keys', 'score'] + list(args)
+    result = subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, text=True, timeout=300)
+    summary_path = Path(cwd, 'experiments', 'my_project', 'sweep', 'sweep_summary.json')
+    summary = json.loads(summary_path.read_text()) if summary_path.exists() else None
+    calls = Path(cwd, 'calls.txt').read_text().split() if Path(cwd, 'calls.txt').exists() else []
+    return result, summary, sorted(calls)
+
+def test_grid_mods():
+    assert grid_mods(['A=1,2', 'B=x']) == [['A=1', 'B=x'], ['A=2', 'B=x']]
+
+def test_mods_file_combined_with_grid(tmp_path):
+    Path(tmp_path, 'mods').write_text('# comment\nA=1 C="a b"\n\nA=2\n')
+    assert sweep_experiments(['B=3,4'], Path(tmp_path, 'mods')) == [['A=1', 'C=a b', 'B=3'], ['A=1', 'C=a b', 'B=4'],
+                                                                    ['A=2', 'B=3'], ['A=2', 'B=4']]
+
+def test_sweep_runs_every_experiment(project):
+    result, summary, calls = run_sweep(project, '--grid', 'LR=0.1,0.2', '--max_parallel', '2')
+    assert result.returncode == 0, result.stderr
+    assert [(r['status'], r['summary']['score']) for r in summary] == [('ok', 1.0), ('ok', 2.0)]
+    assert calls == ['prep', 'prep', 'train', 'train']
+    assert Path(project, 'experiments', 'my_project', 'sweep', '001', 'state', 'score.pkl').exists()
+
+def test_failed_experiment_is_reported(project):
+    result, summary, _ = run_sweep(project, '--grid', 'LR=0.1,-1')
+    assert result.returncode == 1
+    assert [r['status'] for r in summary] == ['ok', 'failed']
+    assert summary[1]['error'] == 'ValueError: negative lr'
+
+def test_shared_prefix_runs_once(project):
+    result, summary, calls = run_sweep(project, '--grid', 'LR=0.1,0.2,0.3', '--max_parallel', '2', '--share_prefixes')
+    assert result.returncode == 0, result.stderr
+    assert [r['summary']['score'] for r in summary] == [1.0, 2.0, 3.0]
+    assert calls == ['prep', 'train', 'train', 'train']
+    #Every experiment saves the shared outputs and can be resumed on its own
+    for i in range(3):
+        state_path = Path(project, 'experiments', 'my_project', 'sweep', '{:03d}'.format(i), 'state')
+        assert Path(state_path, 'base.pkl').exists()
+        manifest = [json.loads(l) for l in Path(state_path, 'manifest.jsonl').read_text().splitlines()]
+        assert [e['task'] for e in manifest] == ['prep', 'train']
+
+def test_shared_prefix_failure_fails_its_experiments(project):
+    result, summary, calls = run_sweep(project, '--grid', 'LR=0.1,0.2', '--mods', 'FAIL_PREP=True', '--share_prefixes')
+    assert result.returncode == 1
+    assert [(r['status'], r['error']) for r in summary] == [('failed', 'ValueError: prep failed')]*2
+    assert calls == ['prep']
+
+def test_different_prefixes_are_not_shared(project):
+    Path(project, 'mods').write_text('prep.scale=1\nprep.scale=2\n')
+    result, summary, calls = run_sweep(project, '--mods_file', 'mods', '--share_prefixes')
+    assert result.returncode == 0, result.stderr
+    assert [r['summary']['score'] for r in summary] == [pytest.approx(0.1), pytest.approx(0.2)]
+    assert calls == ['prep', 'prep', 'train', 'train']
+
+def test_shared_prefix_keeps_modified_initial_state(project):
+    #The initial state is not set again after the prefix, double's n is kept
+    Path(project, 'config.gin').write_text('LR=1\n$n=10\nexecute_pipeline.tasks=[@double, @score_n]\nscore_n.lr=%LR\n')
+    result, summary, calls = run_sweep(project, '--grid', 'LR=1,2', '--share_prefixes')
+    assert result.returncode == 0, result.stderr
+    assert [r['summary']['score'] for r in summary] == [20, 40]
+    assert calls == ['double', 'score_n', 'score_n']
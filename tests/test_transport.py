@@ -0,0 +1,84 @@
+import os
+from pathlib import Path
+import numpy as np
+import pytest
+from ginpipe.core import new_state, execute_pipeline
+from ginpipe.dag import declare_io
+from ginpipe.transport import SharedMemoryTransport, SharedHandle, export_outputs, import_inputs
+
+pytestmark = pytest.mark.skipif(not Path('/dev/shm').exists(), reason='needs /dev/shm')
+
+def segments():
+    return set([f for f in os.listdir('/dev/shm') if f.startswith('psm_')])
+
+@declare_io(writes=['a', 'blob'])
+def make(state):
+    state['a'] = np.arange(100000, dtype=np.float64)
+    state['blob'] = b'x'*100000
+    return state
+
+@declare_io(reads=['a'], writes=['b'])
+def add_one(state):
+    state['b'] = state['a'] + 1
+    return state
+
+@declare_io(reads=['a', 'blob'], writes=['c'])
+def total(state):
+    state['c'] = float(state['a'].sum()) + len(state['blob'])
+    return state
+
+@declare_io(reads=['a'], writes=['d'])
+def modify_input(state):
+    state['a'][0] = 5
+    state['d'] = 1
+    return state
+
+@declare_io(reads=['a'], writes=['a2'])
+def same_array(state):
+    state['a2'] = state['a']
+    return state
+
+def test_large_values_go_through_shared_memory(tmp_path, fresh_state):
+    before = segments()
+    state = fresh_state(tmp_path)
+    execute_pipeline(state, tasks=[make, add_one, total, same_array], execution_order='dag', executor='process',
+                     max_workers=2, shm_min_size=1024, is_main=True)
+    np.testing.assert_array_equal(state['b'], np.arange(100000) + 1)
+    assert state['blob'] == b'x'*100000
+    assert state['c'] == float(np.arange(100000).sum()) + 100000
+    np.testing.assert_array_equal(state['a2'], state['a'])
+    #Unlinked once the pipeline ends, the state keeps the mapped values
+    assert segments() == before
+
+def test_inputs_are_read_only(tmp_path, fresh_state):
+    before = segments()
+    state = fresh_state(tmp_path)
+    with pytest.raises(ValueError, match='read-only'):
+        execute_pipeline(state, tasks=[make, modify_input], execution_order='dag', executor='process', shm_min_size=1024, is_main=True)
+    assert state['a'][0] == 0
+    assert segments() == before
+
+def test_small_values_are_pickled():
+    transport = SharedMemoryTransport(min_size=1024)
+    state = new_state({})
+    state['small'] = np.arange(10)
+    exported = transport.export_inputs(0, {'small': state['small']}, state)
+    assert not isinstance(exported['small'], SharedHandle)
+    transport.close()
+
+def test_worker_outputs_roundtrip():
+    before = segments()
+    transport = SharedMemoryTransport(min_size=1024)
+    state = new_state({})
+    state['a'] = np.arange(10000)
+    inputs = transport.export_inputs(0, {'a': state['a']}, state)
+    assert inputs['a'].name.lstrip('/') in segments()
+    values, attached = import_inputs(inputs)
+    assert not values['a'].flags.writeable
+    writes = export_outputs({'same': values['a'], 'new': values['a']*2}, attached, 1024)
+    #An input returned as an output keeps its segment
+    assert writes['same'].name == inputs['a'].name
+    imported = transport.import_outputs(0, writes)
+    np.testing.assert_array_equal(imported['new'], np.arange(10000)*2)
+    transport.close()
+    assert segments() == before
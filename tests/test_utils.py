@@ -0,0 +1,74 @@
+import os
+from pathlib import Path
+import pytest
+from ginpipe.utils import config_to_dict, fuzzy_get, get_target_d, get_model_config, load_parsed_config, ParsedConfig
+
+CONFIG = '''#Model config
+HIDDEN=128
+LAYERS=4
+Model.encoder=@Encoder
+Model.decoder=@dec/Decoder
+Model.layers=%LAYERS
+Encoder.hidden=%HIDDEN
+Encoder.activation=@relu
+dec/Decoder.hidden=%HIDDEN
+Decoder.dropout=0.1
+Trainer.model=@Model
+Trainer.lr=0.001
+Loop.next=@Loop2
+Loop2.next=@Loop
+'''
+
+def reference_config(config_path, targets, additions=None):
+    #What get_model_config collected before the lookups were indexed
+    d = config_to_dict(config_path)
+    d.update(additions or {})
+    new_d = {}
+    for t in targets:
+        get_target_d(d, new_d, t)
+    return new_d
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = Path(tmp_path, 'config.gin')
+    path.write_text(CONFIG)
+    return path
+
+@pytest.mark.parametrize('key', ['Model', 'Encoder.hidden', 'dec/Decoder', 'Decoder', 'HIDDEN', 'Loop', 'missing'])
+def test_indexed_lookups_match(config_path, key):
+    d = config_to_dict(config_path)
+    parsed = ParsedConfig(d)
+    assert parsed.fuzzy_get(key) == fuzzy_get(d, key)
+    reference = {}
+    get_target_d(d, reference, key)
+    assert set(parsed.closure(key)) == set(reference)
+
+def test_model_config_matches_reference(config_path):
+    config = get_model_config(config_path, ['Model'], {'Model.layers': 'Model.n_layers'})
+    reference = reference_config(config_path, ['Model'])
+    reference['Model.n_layers'] = reference.pop('Model.layers')
+    lines = [l for l in config.split('\n') if l != '']
+    assert sorted(lines) == sorted(['{}={}'.format(k, v) for k, v in reference.items()])
+    #Macros first
+    assert lines[:2] == ['HIDDEN=128', 'LAYERS=4']
+    assert 'Trainer.lr=0.001' not in lines
+
+def test_additions(config_path):
+    config = get_model_config(config_path, ['Model'], {}, additions={'Model.extra': '@Extra', 'Extra.size': '3'})
+    assert 'Extra.size=3' in config.split('\n')
+    #Not kept for lookups without additions
+    assert 'Extra.size' not in get_model_config(config_path, ['Model'], {})
+
+def test_parsed_config_is_reloaded_when_the_file_changes(config_path):
+    first = load_parsed_config(config_path)
+    assert load_parsed_config(config_path) is first
+    config_path.write_text(CONFIG.replace('Trainer.lr=0.001', 'Trainer.lr=0.01'))
+    stat = config_path.stat()
+    os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    second = load_parsed_config(config_path)
+    assert second is not first
+    assert second.d['Trainer.lr'] == '0.01'
+
+def test_circular_references_terminate(config_path):
+    config = get_model_config(config_path, ['Loop'], {})
+    assert set([l for l in config.split('\n') if l != '']) == {'Loop.next=@Loop2', 'Loop2.next=@Loop'}